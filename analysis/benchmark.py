@@ -0,0 +1,285 @@
+import argparse
+import collections
+import itertools
+import json
+import math
+import sys
+import time
+import tracemalloc
+
+from retrieval.core import IndexWrapper, Stopper, ExpandableDocument
+from retrieval.feedback import build_rm1
+from retrieval.output import ColumnWriter
+from retrieval.qpp import QPPEngine
+from retrieval.scoring import DirichletTermScorer, QLQueryScorer, ExpansionDocTermScorer, build_vocab, \
+    cosine_similarity, kl_divergence, jaccard_similarity, average_precision, clarity
+from retrieval.similarity import VectorSet
+from retrieval.synthetic import SyntheticCollection
+
+
+SCALES = collections.OrderedDict([
+    ('small', {'num_docs': 1000, 'vocab_size': 10000, 'mean_length': 200}),
+    ('medium', {'num_docs': 10000, 'vocab_size': 30000, 'mean_length': 300}),
+    ('large', {'num_docs': 50000, 'vocab_size': 50000, 'mean_length': 400}),
+])
+
+# How many of the first calls of each benchmark are summed into its checksum
+CHECKSUM_CALLS = 5
+
+
+class Workload(object):
+    """
+    The synthetic collection of one scale, with queries, their results and judgments, shared by every benchmark.
+    """
+    def __init__(self, scale, seed=0, num_queries=50):
+        self.collection = SyntheticCollection(seed=seed, **SCALES[scale])
+        self.index = IndexWrapper(self.collection.index, store=self.collection.store)
+        self.stopper = Stopper(terms=self.collection.stopwords())
+        self.queries = self.collection.queries(num_queries)
+        self.qrels = self.collection.qrels(self.queries)
+        self.results = [self.index.query(query, count=1000) for query in self.queries]
+        self._rm1s = {}
+
+    def inputs(self, i):
+        """
+        :return: The i-th query, cycling through them, and its results.
+        """
+        i %= len(self.queries)
+        return self.queries[i], self.results[i]
+
+    def batch(self, i, size=10):
+        """
+        :return: The size queries from the i-th on, cycling through them.
+        """
+        return [self.queries[(i + j) % len(self.queries)] for j in range(size)]
+
+    def rm1(self, i):
+        i %= len(self.queries)
+        if i not in self._rm1s:
+            self._rm1s[i] = build_rm1(self.results[i][:10], self.index, stopper=self.stopper)
+        return self._rm1s[i]
+
+
+# Each benchmark does one unit of work on the i-th query and returns a number to check results by. Scorers are made
+# afresh in every call, so that their caches do not carry over from one call to the next.
+
+def dirichlet_score(workload, i):
+    """Score each query term against each of the top 10 documents, one call at a time."""
+    query, results = workload.inputs(i)
+    scorer = DirichletTermScorer(workload.index)
+    return sum([scorer.score(term, doc) for term in query.vector for doc, _ in results[:10]])
+
+
+def dirichlet_score_batch(workload, i):
+    """Score the vocabulary of the top 10 documents against each of them."""
+    _, results = workload.inputs(i)
+    docs = [doc for doc, _ in results[:10]]
+    vocab = build_vocab(*[doc.term_vector() for doc in docs])
+    return float(DirichletTermScorer(workload.index).score_batch(vocab, docs).sum())
+
+
+def ql_score_matrix(workload, i):
+    """Query likelihood of the query against its top 100 documents."""
+    query, results = workload.inputs(i)
+    scorer = QLQueryScorer(DirichletTermScorer(workload.index))
+    return float(scorer.score_matrix([query], [doc for doc, _ in results[:100]]).sum())
+
+
+def expansion_score_batch(workload, i):
+    """Expansion model probabilities of the query terms for the top document, including finding its expansion
+    documents."""
+    query, results = workload.inputs(i)
+    if not results:
+        return 0.0
+    document = ExpandableDocument(results[0][0].docno, workload.index)
+    scorer = ExpansionDocTermScorer(DirichletTermScorer(workload.index), stopper=workload.stopper)
+    return float(scorer.score_batch(list(query.vector), [document]).sum())
+
+
+def rm1(workload, i):
+    """RM1 from the top 10 documents."""
+    _, results = workload.inputs(i)
+    return sum(build_rm1(results[:10], workload.index, stopper=workload.stopper).vector.values())
+
+
+def pseudo_query(workload, i):
+    """Pseudo-queries of the top 10 documents."""
+    _, results = workload.inputs(i)
+    return sum([ExpandableDocument(doc.docno, workload.index).pseudo_query(stopper=workload.stopper).length()
+                for doc, _ in results[:10]])
+
+
+def pairwise(function):
+    def benchmark(workload, i):
+        _, results = workload.inputs(i)
+        vectors = [doc.document_vector() for doc, _ in results[:10]]
+        return sum([function(vector1, vector2) for vector1, vector2 in itertools.combinations(vectors, 2)])
+    benchmark.__doc__ = 'Every pair of the top 10 document vectors.'
+    return benchmark
+
+
+def pairwise_jaccard(workload, i):
+    """Every pair of the top 10 documents' term sets."""
+    _, results = workload.inputs(i)
+    sets = [set(doc.document_vector()) for doc, _ in results[:10]]
+    return sum([jaccard_similarity(set1, set2) for set1, set2 in itertools.combinations(sets, 2)])
+
+
+def vector_set_cosine(workload, i):
+    """The cosine matrix of the top 100 document vectors."""
+    _, results = workload.inputs(i)
+    return float(VectorSet([doc.term_vector() for doc, _ in results[:100]]).cosine().sum())
+
+
+def ap(workload, i):
+    """Average precision of the 1000 results."""
+    query, results = workload.inputs(i)
+    return average_precision(query.title, [doc.docno for doc, _ in results], workload.qrels)
+
+
+def rm1_clarity(workload, i):
+    """Clarity of the RM1 from the top 10 documents, the RM1 itself built beforehand."""
+    return clarity(workload.rm1(i).vector, workload.index)
+
+
+def qpp_features(workload, i):
+    """Every QPP feature of a batch of 10 queries, including their retrieval."""
+    features = QPPEngine(workload.index, stopper=workload.stopper).features(workload.batch(i))
+    return float(sum([values.sum() for values in features.values()]))
+
+
+def qpp_pre_retrieval_features(workload, i):
+    """avg_idf, scs and avg_scq of a batch of 10 queries."""
+    features = QPPEngine(workload.index).pre_retrieval_features(workload.batch(i))
+    return float(sum([values.sum() for values in features.values()]))
+
+
+def qpp_rm1_clarity(workload, i):
+    """RM1 clarity of the top 10 results."""
+    _, results = workload.inputs(i)
+    return QPPEngine(workload.index, stopper=workload.stopper).rm1_clarity(results[:10])
+
+
+def qpp_wig(workload, i):
+    """Weighted information gain of the top 10 results."""
+    query, results = workload.inputs(i)
+    return QPPEngine(workload.index).wig(query, results[:10])
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('DirichletTermScorer.score', dirichlet_score),
+    ('DirichletTermScorer.score_batch', dirichlet_score_batch),
+    ('QLQueryScorer.score_matrix', ql_score_matrix),
+    ('ExpansionDocTermScorer.score_batch', expansion_score_batch),
+    ('build_rm1', rm1),
+    ('ExpandableDocument.pseudo_query', pseudo_query),
+    ('cosine_similarity', pairwise(cosine_similarity)),
+    ('kl_divergence', pairwise(kl_divergence)),
+    ('jaccard_similarity', pairwise_jaccard),
+    ('VectorSet.cosine', vector_set_cosine),
+    ('average_precision', ap),
+    ('clarity', rm1_clarity),
+    ('QPPEngine.features', qpp_features),
+    ('QPPEngine.pre_retrieval_features', qpp_pre_retrieval_features),
+    ('QPPEngine.rm1_clarity', qpp_rm1_clarity),
+    ('QPPEngine.wig', qpp_wig),
+])
+
+
+def measure(benchmark, workload, min_seconds=1.0):
+    """
+    Run a benchmark for at least min_seconds, then once more under tracemalloc.
+    :return: The number of timed calls, calls per second, peak bytes allocated during one call, and the sum of the
+    first CHECKSUM_CALLS results. Those first calls also warm up the index's caches and are not timed.
+    """
+    checksum = sum([benchmark(workload, i) for i in range(CHECKSUM_CALLS)])
+
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_seconds:
+        benchmark(workload, CHECKSUM_CALLS + calls)
+        calls += 1
+        elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    benchmark(workload, 0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return calls, calls / elapsed, peak, checksum
+
+
+def build_workload(scale, seed=0):
+    """
+    :return: The workload, and the seconds and peak bytes it took to build, under tracemalloc.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    workload = Workload(scale, seed=seed)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return workload, seconds, peak
+
+
+def main():
+    options = argparse.ArgumentParser(description='Measure the throughput and memory use of the retrieval package on '
+                                                  'synthetic Zipfian collections.')
+    options.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small'])
+    options.add_argument('--only', nargs='+', help='run only the benchmarks whose names contain one of these')
+    options.add_argument('--seconds', type=float, default=1.0, help='minimum time to run each benchmark for')
+    options.add_argument('--seed', type=int, default=0)
+    options.add_argument('--baseline', help='a JSON file saved by --save-baseline to compare against')
+    options.add_argument('--save-baseline', help='save the results to this JSON file')
+    args = options.parse_args()
+
+    benchmarks = [(name, benchmark) for name, benchmark in BENCHMARKS.items()
+                  if not args.only or any([pattern in name for pattern in args.only])]
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['seed'] != args.seed or any([baseline['scales'].get(scale, SCALES[scale]) != SCALES[scale]
+                                                 for scale in args.scales]):
+            print('The baseline was run on different collections, so its results will not match', file=sys.stderr)
+
+    results = collections.OrderedDict()
+    with ColumnWriter(['scale', 'benchmark', 'calls', 'ops_per_sec', 'peak_kib', 'checksum', 'baseline_ops_per_sec',
+                       'speedup', 'same_result'], header=True, block_rows=1) as writer:
+        for scale in args.scales:
+            workload, seconds, peak = build_workload(scale, seed=args.seed)
+            rows = [('SyntheticCollection', 1, 1 / seconds, peak, workload.index.total_terms())]
+            writer.write_row([scale, 'SyntheticCollection', 1, 1 / seconds, peak // 1024,
+                              workload.index.total_terms()] + compare(baseline, scale, 'SyntheticCollection',
+                                                                      1 / seconds, workload.index.total_terms()))
+            for name, benchmark in benchmarks:
+                calls, ops_per_sec, peak, checksum = measure(benchmark, workload, min_seconds=args.seconds)
+                rows.append((name, calls, ops_per_sec, peak, checksum))
+                writer.write_row([scale, name, calls, ops_per_sec, peak // 1024, checksum] +
+                                 compare(baseline, scale, name, ops_per_sec, checksum))
+            results[scale] = collections.OrderedDict([(name, {'calls': calls, 'ops_per_sec': ops_per_sec,
+                                                              'peak_bytes': peak, 'checksum': checksum})
+                                                      for name, calls, ops_per_sec, peak, checksum in rows])
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'seed': args.seed, 'scales': {scale: SCALES[scale] for scale in results}, 'results': results},
+                      f, indent=2)
+
+
+def compare(baseline, scale, name, ops_per_sec, checksum):
+    """
+    :return: The baseline's ops/sec for the benchmark, the speedup over it, and whether the checksums agree, or NA
+    for each if the baseline does not have the benchmark.
+    """
+    try:
+        previous = baseline['results'][scale][name]
+    except KeyError:
+        return ['NA', 'NA', 'NA']
+    same_result = math.isclose(checksum, previous['checksum'], rel_tol=1e-9, abs_tol=1e-12)
+    return [previous['ops_per_sec'], ops_per_sec / previous['ops_per_sec'], 'yes' if same_result else 'no']
+
+
+if __name__ == '__main__':
+    main()
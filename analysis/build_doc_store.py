@@ -0,0 +1,48 @@
+import argparse
+import collections
+
+from retrieval.core import IndexWrapper, Query
+from retrieval.memindex import open_index
+from retrieval.store import DocumentVectorStore
+
+
+def main():
+    options = argparse.ArgumentParser()
+    options.add_argument('output')
+    options.add_argument('--index')
+    options.add_argument('--csv', help='a docno,term,count file such as data/doc_vectors.csv')
+    options.add_argument('--docnos', nargs='*', default=[], help='files of docnos to include, one per line')
+    options.add_argument('--pseudo-queries', help='also include the top results of these pseudo-queries')
+    options.add_argument('--num-docs', type=int, default=10)
+    args = options.parse_args()
+
+    if args.csv:
+        store = DocumentVectorStore.from_csv(args.csv)
+    elif args.index:
+        index = IndexWrapper(open_index(args.index))
+
+        docnos = collections.OrderedDict()
+        for file_name in args.docnos:
+            with open(file_name) as f:
+                for line in f:
+                    docnos[line.strip()] = True
+
+        if args.pseudo_queries:
+            pseudo_query_terms = collections.defaultdict(collections.Counter)
+            with open(args.pseudo_queries) as f:
+                for line in f:
+                    docno, term, weight = line.strip().split(',')
+                    pseudo_query_terms[docno][term] = float(weight)
+            for docno in pseudo_query_terms:
+                for doc, _ in index.query(Query(docno, vector=pseudo_query_terms[docno]), count=args.num_docs):
+                    docnos[doc.docno] = True
+
+        store = DocumentVectorStore.from_index(index, docnos.keys())
+    else:
+        options.error('one of --index or --csv is required')
+
+    store.save(args.output)
+
+
+if __name__ == '__main__':
+    main()
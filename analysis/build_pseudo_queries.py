@@ -0,0 +1,76 @@
+import argparse
+import collections
+import functools
+import sys
+
+from retrieval.core import IndexWrapper, Stopper
+from retrieval.instrument import enable_profiling, instrument
+from retrieval.memindex import open_index
+from retrieval.output import ColumnWriter
+from retrieval.runner import ShardedRunner
+from retrieval.store import DocumentVectorStore
+
+
+class PseudoQueryBuilder(object):
+    """
+    The index and stop list shared by every document, loaded once per process.
+    """
+    def __init__(self, args):
+        if args.profile:
+            enable_profiling(args.profile)
+        store = DocumentVectorStore.open(args.doc_store) if args.doc_store else None
+        # Every document is read once, so there is nothing to gain from caching its vector
+        self.index = IndexWrapper(instrument(open_index(args.index), 'index.backend'), cache_bytes=0, store=store)
+        self.index = instrument(self.index, 'index')
+        self.stopper = Stopper(file=args.stoplist) if args.stoplist else Stopper()
+        self.stopword_mask = self.stopper.stopword_mask(self.index)
+        self.num_terms = args.num_terms
+
+    def pseudo_query_rows(self, docno):
+        """
+        :return: The docno,term,weight rows of the document's pseudo-query, the same terms as
+        ExpandableDocument.pseudo_query gives, or no rows if the document is not in the index.
+        """
+        try:
+            doc_id = self.index.doc_id(docno)
+        except IndexError:
+            print('{} is not in the index'.format(docno), file=sys.stderr)
+            return []
+        vector = self.index.term_vector(doc_id)
+        vector = vector.select(~self.stopword_mask[vector.term_ids]).top(self.num_terms)
+        return [(docno, self.index.term(term_id), float(count)) for term_id, count in
+                zip(vector.term_ids.tolist(), vector.counts.tolist())]
+
+    def shard_rows(self, docnos):
+        return [self.pseudo_query_rows(docno) for docno in docnos]
+
+
+def main():
+    options = argparse.ArgumentParser(description='Write the pseudo-query of each document as docno,term,weight '
+                                                  'rows, as in data/pseudo-queries/*.pq.')
+    options.add_argument('index')
+    options.add_argument('docnos', nargs='+', help='files of docnos, one per line')
+    options.add_argument('--stoplist')
+    options.add_argument('--num-terms', type=int, default=20)
+    options.add_argument('--doc-store')
+    options.add_argument('--workers', type=int, default=1, help='processes to spread documents over')
+    options.add_argument('--profile', nargs='?', const='-',
+                         help='time index calls and write a JSON report at exit, to this file or stderr')
+    args = options.parse_args()
+
+    docnos = collections.OrderedDict()
+    for file_name in args.docnos:
+        with open(file_name) as f:
+            for line in f:
+                if line.strip():
+                    docnos[line.strip()] = True
+
+    runner = ShardedRunner(functools.partial(PseudoQueryBuilder, args), PseudoQueryBuilder.shard_rows,
+                           workers=args.workers)
+    with ColumnWriter(['docno', 'term', 'weight']) as writer:
+        for rows in runner.run(list(docnos)):
+            writer.write_rows(rows)
+
+
+if __name__ == '__main__':
+    main()
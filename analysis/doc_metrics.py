@@ -1,13 +1,21 @@
 import argparse
 import collections
+import functools
 import math
+import sys
+import traceback
 from pprint import pprint
 
-import pyndri
-
+from retrieval.cache import QueryResultCache
 from retrieval.core import IndexWrapper, Stopper, Qrels, ExpandableDocument, read_queries, Query
+from retrieval.instrument import enable_profiling, instrument
+from retrieval.memindex import open_index
+from retrieval.output import ColumnWriter
+from retrieval.runner import ShardedRunner
 from retrieval.scoring import DirichletTermScorer, QLQueryScorer, ExpansionDocTermScorer, InterpolatedTermScorer, \
     build_vocab, cosine_similarity
+from retrieval.similarity import VectorSet, mean_pairwise
+from retrieval.store import DocumentVectorStore
 
 
 def entropy(vector):
@@ -15,115 +23,189 @@ def entropy(vector):
     return -1 * sum([vector[k] / total * math.log2(vector[k] / total) for k in vector])
 
 
+class DocMetrics(object):
+    """
+    The indexes, scorers and input files shared by every document, loaded once per process.
+    """
+    def __init__(self, args):
+        if args.profile:
+            enable_profiling(args.profile)
+        self.optimal_params = collections.defaultdict(dict)
+        with open(args.optimal_params) as f:
+            for line in f:
+                query, param_blob = line.strip().split()
+                params = param_blob.split(',')
+                for param in params:
+                    name, value = param.split(':')
+                    if name == 'origW':
+                        self.optimal_params[query]['o'] = float(value)
+                    elif name == 'expDocs':
+                        self.optimal_params[query]['d'] = int(value)
+                    elif name == 'expTerms':
+                        self.optimal_params[query]['t'] = int(value)
+
+        target_store = DocumentVectorStore.open(args.target_store) if args.target_store else None
+        expansion_store = DocumentVectorStore.open(args.expansion_store) if args.expansion_store else None
+        self.target_index = IndexWrapper(instrument(open_index(args.target_index), 'target_index.backend'),
+                                         store=target_store, collection_stats=args.target_stats,
+                                         path=args.target_index)
+        self.expansion_index = IndexWrapper(instrument(open_index(args.expansion_index), 'expansion_index.backend'),
+                                            store=expansion_store,
+                                            collection_stats=args.expansion_stats,
+                                            query_cache=QueryResultCache(args.query_cache)
+                                            if args.query_cache else None,
+                                            path=args.expansion_index)
+        self.target_index = instrument(self.target_index, 'target_index')
+        self.expansion_index = instrument(self.expansion_index, 'expansion_index')
+        self.qrels = Qrels(file=args.qrels)
+        self.stopper = Stopper(file=args.stoplist)
+        # Each query stopped once, for every document it was judged for
+        self.stopped_queries = {q.title: Query(q.title, vector=self.stopper.stop(q.vector))
+                                for q in read_queries(args.queries)}
+
+        self.target_term_scorer = instrument(DirichletTermScorer(self.target_index), 'target_term_scorer')
+        self.target_ql_scorer = instrument(QLQueryScorer(self.target_term_scorer), 'target_ql_scorer')
+        self.expansion_doc_scorer = instrument(DirichletTermScorer(self.expansion_index), 'expansion_doc_scorer')
+
+        self.topic_terms = collections.defaultdict(lambda: collections.defaultdict(set))
+        with open(args.topic_terms) as f:
+            for line in f:
+                user, docno, _, term = line.strip().split(',')
+                self.topic_terms[docno][user].add(term)
+
+    def document(self, docno):
+        """
+        :return: A generator of the document's output rows.
+        """
+        optimal_params = self.optimal_params
+        stopper = self.stopper
+        target_term_scorer = self.target_term_scorer
+        target_ql_scorer = self.target_ql_scorer
+
+        doc = ExpandableDocument(docno, self.target_index, expansion_index=self.expansion_index)
+        expansion_docs = doc.expansion_docs(doc.pseudo_query(stopper=stopper))
+
+        pairwise_cosine = mean_pairwise(VectorSet([d.term_vector() for d, _ in expansion_docs]).cosine())
+
+        yield docno, 'NA', 'NA', 'pairwise_cosine', 'NA' if pairwise_cosine is None else pairwise_cosine
+
+        associated_queries = [self.stopped_queries[associated_query]
+                              for associated_query in self.qrels.judged_for_queries(docno)]
+        target_qls = target_ql_scorer.score_matrix(associated_queries, [doc])[:, 0].tolist()
+
+        for query, target_ql in zip(associated_queries, target_qls):
+            expansion_term_scorer = ExpansionDocTermScorer(self.expansion_doc_scorer, stopper=stopper,
+                                                           num_docs=optimal_params[query.title]['d'],
+                                                           num_terms=optimal_params[query.title]['t'])
+            expansion_ql_scorer = QLQueryScorer(expansion_term_scorer)
+            interpolated_term_scorer = InterpolatedTermScorer([target_term_scorer, expansion_term_scorer],
+                                                              [optimal_params[query.title]['o'],
+                                                               1.0-optimal_params[query.title]['o']])
+            interpolated_ql_scorer = QLQueryScorer(interpolated_term_scorer)
+
+            expansion_ql = expansion_ql_scorer.score_matrix([query], [doc])[0, 0].item()
+            expanded_ql = interpolated_ql_scorer.score_matrix([query], [doc])[0, 0].item()
+
+            yield docno, 'query', query.title, 'target_ql', target_ql
+            yield docno, 'query', query.title, 'expansion_ql', expansion_ql
+            yield docno, 'query', query.title, 'expanded_ql', expanded_ql
+
+        expansion_vocab = sorted(build_vocab(*[d.document_vector() for d, _ in expansion_docs]))
+        expansion_lm = dict(zip(expansion_vocab,
+                                expansion_term_scorer.score_batch(expansion_vocab, [doc])[0].tolist()))
+
+        target_vocab = list(doc.document_vector().keys())
+        target_lm = dict(zip(target_vocab, target_term_scorer.score_batch(target_vocab, [doc])[0].tolist()))
+
+        distance = cosine_similarity(target_lm, expansion_lm)
+
+        yield docno, 'NA', 'NA', 'distance', distance
+
+        expansion_entropy = entropy(expansion_lm)
+        target_entropy = entropy(target_lm)
+
+        yield docno, 'NA', 'NA', 'expansion_entropy', expansion_entropy
+        yield docno, 'NA', 'NA', 'target_entropy', target_entropy
+
+        users = list(self.topic_terms[docno])
+        tt_queries = [Query(user, vector={term: 1 for term in sorted(self.topic_terms[docno][user])})
+                      for user in users]
+        target_tt_likelihoods = target_ql_scorer.score_matrix(tt_queries, [doc])[:, 0].tolist()
+        expansion_tt_likelihoods = expansion_ql_scorer.score_matrix(tt_queries, [doc])[:, 0].tolist()
+        expanded_tt_likelihoods = interpolated_ql_scorer.score_matrix(tt_queries, [doc])[:, 0].tolist()
+
+        for user, target_tt_likelihood, expansion_tt_likelihood, expanded_tt_likelihood in zip(
+                users, target_tt_likelihoods, expansion_tt_likelihoods, expanded_tt_likelihoods):
+            yield docno, 'user', user, 'target_tt_likelihood', target_tt_likelihood
+            yield docno, 'user', user, 'expansion_tt_likelihood', expansion_tt_likelihood
+            yield docno, 'user', user, 'expanded_tt_likelihood', expanded_tt_likelihood
+
+    def document_rows(self, docno):
+        """
+        :return: A tuple of the document's output rows and, if it failed part way, the error's traceback. The rows
+        are those a run on this document alone writes before failing.
+        """
+        rows = []
+        try:
+            for row in self.document(docno):
+                rows.append(row)
+        except Exception:
+            return rows, traceback.format_exc()
+        return rows, None
+
+    def shard_rows(self, docnos):
+        return [self.document_rows(docno) for docno in docnos]
+
+
+def write_results(writer, docnos, results):
+    """
+    Write each document's rows in docno order, reporting failed documents on stderr.
+    """
+    for docno, (rows, error) in zip(docnos, results):
+        writer.write_rows(rows)
+        if error:
+            writer.flush()
+            print('{} failed:\n{}'.format(docno, error), file=sys.stderr, end='')
+
+
 def main():
     options = argparse.ArgumentParser()
     options.add_argument('topic_terms')
-    options.add_argument('document')
+    options.add_argument('document', nargs='?', help='a docno; leave out when using --doc-list')
     options.add_argument('target_index')
     options.add_argument('expansion_index')
     options.add_argument('queries')
     options.add_argument('qrels')
     options.add_argument('stoplist')
     options.add_argument('optimal_params')
+    options.add_argument('--doc-list', help='a file of docnos, one per line, such as data/annotations/docs.robust')
+    options.add_argument('--workers', type=int, default=1, help='processes to spread --doc-list documents over')
+    options.add_argument('--target-store')
+    options.add_argument('--expansion-store')
+    options.add_argument('--target-stats')
+    options.add_argument('--expansion-stats')
+    options.add_argument('--query-cache')
+    options.add_argument('--columns', help='also save each output column as a .npy file in this directory')
+    options.add_argument('--profile', nargs='?', const='-',
+                         help='time index and scorer calls and write a JSON report at exit, to this file or stderr')
     args = options.parse_args()
 
-    optimal_params = collections.defaultdict(dict)
-    with open(args.optimal_params) as f:
-        for line in f:
-            query, param_blob = line.strip().split()
-            params = param_blob.split(',')
-            for param in params:
-                name, value = param.split(':')
-                if name == 'origW':
-                    optimal_params[query]['o'] = float(value)
-                elif name == 'expDocs':
-                    optimal_params[query]['d'] = int(value)
-                elif name == 'expTerms':
-                    optimal_params[query]['t'] = int(value)
-
-    target_index = IndexWrapper(pyndri.Index(args.target_index))
-    expansion_index = IndexWrapper(pyndri.Index(args.expansion_index))
-    queries = {q.title: q for q in read_queries(args.queries)}
-    qrels = Qrels(file=args.qrels)
-    stopper = Stopper(file=args.stoplist)
-
-    target_term_scorer = DirichletTermScorer(target_index)
-    target_ql_scorer = QLQueryScorer(target_term_scorer)
-
-    topic_terms = collections.defaultdict(lambda: collections.defaultdict(set))
-    with open(args.topic_terms) as f:
-        for line in f:
-            user, docno, _, term = line.strip().split(',')
-            topic_terms[docno][user].add(term)
+    if bool(args.document) == bool(args.doc_list):
+        options.error('give either a document or --doc-list')
 
     #print('docno,idtype,idvalue,metric,value')
 
-    docno = args.document
-
-    doc = ExpandableDocument(docno, target_index, expansion_index=expansion_index)
-    expansion_docs = doc.expansion_docs(doc.pseudo_query(stopper=stopper))
-
-    pairwise_cosine = []
-    for i in range(len(expansion_docs)):
-        for j in range(i+1, len(expansion_docs)):
-            pairwise_cosine.append(cosine_similarity(expansion_docs[i][0].document_vector(),
-                                                 expansion_docs[j][0].document_vector()))
-    pairwise_cosine = sum(pairwise_cosine) / len(pairwise_cosine)
-
-    print(docno, 'NA', 'NA', 'pairwise_cosine', pairwise_cosine)
-
-    associated_queries = qrels.judged_for_queries(docno).keys()
-    for associated_query in associated_queries:
-        query = queries[associated_query]
-        query.vector = stopper.stop(query.vector)
-
-        expansion_term_scorer = ExpansionDocTermScorer(DirichletTermScorer(expansion_index), stopper=stopper,
-                                                       num_docs=optimal_params[query.title]['d'],
-                                                       num_terms=optimal_params[query.title]['t'])
-        expansion_ql_scorer = QLQueryScorer(expansion_term_scorer)
-        interpolated_term_scorer = InterpolatedTermScorer([target_term_scorer, expansion_term_scorer],
-                                                          [optimal_params[query.title]['o'],
-                                                           1.0-optimal_params[query.title]['o']])
-        interpolated_ql_scorer = QLQueryScorer(interpolated_term_scorer)
-
-        target_ql = target_ql_scorer.score(query, doc)
-        expansion_ql = expansion_ql_scorer.score(query, doc)
-        expanded_ql = interpolated_ql_scorer.score(query, doc)
-
-        print(docno, 'query', query.title, 'target_ql', target_ql)
-        print(docno, 'query', query.title, 'expansion_ql', expansion_ql)
-        print(docno, 'query', query.title, 'expanded_ql', expanded_ql)
-
-    expansion_vocab = build_vocab(*[d.document_vector() for d, _ in expansion_docs])
-    expansion_lm = {}
-    for term in expansion_vocab:
-        expansion_lm[term] = expansion_term_scorer.score(term, doc)
-
-    target_lm = {}
-    for term in doc.document_vector().keys():
-        target_lm[term] = target_term_scorer.score(term, doc)
-
-    distance = cosine_similarity(target_lm, expansion_lm)
-
-    print(docno, 'NA', 'NA', 'distance', distance)
-
-    expansion_entropy = entropy(expansion_lm)
-    target_entropy = entropy(target_lm)
-
-    print(docno, 'NA', 'NA', 'expansion_entropy', expansion_entropy)
-    print(docno, 'NA', 'NA', 'target_entropy', target_entropy)
-
-    for user in topic_terms[docno]:
-        tt = topic_terms[docno][user]
-        tt_query = Query(user, vector={term: 1 for term in tt})
+    with ColumnWriter(['docno', 'idtype', 'idvalue', 'metric', 'value'], separator=' ',
+                      column_dir=args.columns) as writer:
+        if args.document:
+            writer.write_rows(DocMetrics(args).document(args.document))
+            return
 
-        target_tt_likelihood = target_ql_scorer.score(tt_query, doc)
-        expansion_tt_likelihood = expansion_ql_scorer.score(tt_query, doc)
-        expanded_tt_likelihood = interpolated_ql_scorer.score(tt_query, doc)
+        with open(args.doc_list) as f:
+            docnos = [line.strip() for line in f if line.strip()]
 
-        print(docno, 'user', user, 'target_tt_likelihood', target_tt_likelihood)
-        print(docno, 'user', user, 'expansion_tt_likelihood', expansion_tt_likelihood)
-        print(docno, 'user', user, 'expanded_tt_likelihood', expanded_tt_likelihood)
+        runner = ShardedRunner(functools.partial(DocMetrics, args), DocMetrics.shard_rows, workers=args.workers)
+        write_results(writer, docnos, runner.run(docnos))
 
 
 if __name__ == '__main__':
@@ -1,12 +1,16 @@
 import argparse
 import collections
-import math
-import statistics
-
-import pyndri
-
-from retrieval.core import IndexWrapper, build_rm1, Stopper, Query
-from retrieval.scoring import clarity, DirichletTermScorer
+import functools
+
+from retrieval.cache import QueryResultCache
+from retrieval.core import IndexWrapper, Stopper, Query
+from retrieval.instrument import enable_profiling, instrument
+from retrieval.memindex import open_index
+from retrieval.output import ColumnWriter
+from retrieval.qpp import QPPEngine, FEATURES
+from retrieval.runner import ShardedRunner
+from retrieval.scoring import DirichletTermScorer
+from retrieval.store import DocumentVectorStore
 
 """
 List of features:
@@ -16,109 +20,57 @@ List of features:
 """
 
 
+class QPPFeatures(object):
+    """
+    The index, stop list and pseudo-queries shared by every document, loaded once per process.
+    """
+    def __init__(self, args):
+        if args.profile:
+            enable_profiling(args.profile)
+        self.pseudo_queries = collections.defaultdict(collections.Counter)
+        with open(args.pseudo_queries) as f:
+            for line in f:
+                docno, term, weight = line.strip().split(',')
+                self.pseudo_queries[docno][term] = float(weight)
+
+        self.stopper = Stopper(file=args.stoplist)
+
+        store = DocumentVectorStore.open(args.doc_store) if args.doc_store else None
+        self.index = IndexWrapper(instrument(open_index(args.expansion_index), 'index.backend'), store=store,
+                                  collection_stats=args.collection_stats,
+                                  query_cache=QueryResultCache(args.query_cache) if args.query_cache else None,
+                                  path=args.expansion_index)
+        self.index = instrument(self.index, 'index')
+        self.engine = QPPEngine(self.index, stopper=self.stopper,
+                                scorer=instrument(DirichletTermScorer(self.index), 'scorer'))
+
+    def shard_rows(self, docnos):
+        return self.engine.rows([Query(docno, vector=self.pseudo_queries[docno]) for docno in docnos])
+
+
 def main():
     options = argparse.ArgumentParser()
     options.add_argument('pseudo_queries')
     options.add_argument('expansion_index')
     options.add_argument('stoplist')
+    options.add_argument('--doc-store')
+    options.add_argument('--collection-stats')
+    options.add_argument('--query-cache')
+    options.add_argument('--workers', type=int, default=1, help='processes to spread pseudo-queries over')
+    options.add_argument('--columns', help='also save each output column as a .npy file in this directory')
+    options.add_argument('--profile', nargs='?', const='-',
+                         help='time index and scorer calls and write a JSON report at exit, to this file or stderr')
     args = options.parse_args()
 
-    pseudo_queries = collections.defaultdict(collections.Counter)
+    docnos = []
     with open(args.pseudo_queries) as f:
         for line in f:
-            docno, term, weight = line.strip().split(',')
-            pseudo_queries[docno][term] = float(weight)
-
-    stopper = Stopper(file=args.stoplist)
-
-    index = IndexWrapper(pyndri.Index(args.expansion_index))
-    for docno in pseudo_queries:
-        query = Query(docno, vector=pseudo_queries[docno])
-
-        top_results = index.query(query, count=10)
-
-        rm1 = build_rm1(top_results, index, stopper=stopper)
-
-        # Features
-        rm1_clarity = clarity(rm1.vector, index)
-        weighted_ig = wig(query, index, top_results=top_results)
-        normalized_qc = nqc(query, index, top_results=top_results)
-        average_idf = avg_idf(query.vector.keys(), index)
-        simple_clarity = scs(query, index)
-        average_scq = statistics.mean(scqs(query, index))
-
-        print(query.title, rm1_clarity, weighted_ig, normalized_qc, average_idf, simple_clarity, average_scq, sep=',')
-
-
-def scqs(query, index):
-    def scq(term):
-        try:
-            return (1 + math.log(index.term_count(term) + 1)) * math.log(index.total_docs() / (
-                    index.term_document_frequency(term) + 1))
-        except KeyError:
-            return (1 + math.log(index.term_count(term) + 1)) * math.log(index.total_docs() / 1)
-    return [scq(term) for term in query.vector.keys()]
-
-
-def scs(query, index):
-    def q_prob(t):
-        return query.vector[t] / query.length()
-
-    scs = 0.0
-    for term in query.vector.keys():
-        try:
-            scs += q_prob(term) * math.log(q_prob(term) / (index.term_count(term) / index.total_terms()))
-        except ZeroDivisionError:
-            scs += 0.0
-    return scs
-
-
-def avg_idf(terms, index):
-    total = 0.0
-    for term in terms:
-        try:
-            total += math.log(index.total_docs() / index.term_document_frequency(term))
-        except:
-            total += 0.0
-    return total / len(terms)
-
-
-def wig(query, index, top_results=None):
-    if top_results is None:
-        top_results = index.query(query, count=10)
-    if len(top_results) == 0:
-        return 0.0
-
-    dirichlet_scorer = DirichletTermScorer(index)
-
-    wig = 0.0
-    for doc, _ in top_results:
-        for term in query.vector:
-            p_doc = dirichlet_scorer.score(term, doc)
-            p_col = (index.term_count(term) + 1) / index.total_terms()
-            lam = 1 / math.sqrt(query.length())
-            wig += lam * math.log(p_doc / p_col)
-
-    return wig / len(top_results)
-
-
-def nqc(query, index, top_results=None):
-    if top_results is None:
-        top_results = index.query(query, count=10)
-    if len(top_results) == 0:
-        return 0.0
-
-    mu = statistics.mean([score for _, score in top_results])
-    squared_diffs = [(score - mu) ** 2 for _, score in top_results]
-    num = math.sqrt(sum(squared_diffs) / len(top_results))
-
-    col_score = 0.0
-    for term in query.vector:
-        q_weight = query.vector[term] / query.length()
-        term_score = math.log((index.term_count(term) / index.total_terms()) + 0.001)
-        col_score += q_weight * term_score
+            docnos.append(line.strip().split(',')[0])
+    docnos = list(collections.OrderedDict.fromkeys(docnos))
 
-    return num / col_score
+    runner = ShardedRunner(functools.partial(QPPFeatures, args), QPPFeatures.shard_rows, workers=args.workers)
+    with ColumnWriter(['docno'] + list(FEATURES), column_dir=args.columns) as writer:
+        writer.write_rows(runner.run(docnos))
 
 
 if __name__ == '__main__':
@@ -1,14 +1,107 @@
 import argparse
 import collections
+import functools
 import sys
 
-import pyndri
-
+from retrieval.cache import QueryResultCache
 from retrieval.core import Qrels, Query, IndexWrapper, Stopper
-from retrieval.scoring import recall, average_precision, jaccard_similarity, build_vocab, DirichletTermScorer, \
+from retrieval.instrument import enable_profiling, instrument
+from retrieval.memindex import open_index
+from retrieval.output import ColumnWriter
+from retrieval.runner import ShardedRunner
+from retrieval.store import DocumentVectorStore
+from retrieval.scoring import recall, average_precision, jaccard_similarity, pseudo_document, DirichletTermScorer, \
     cosine_similarity, precision
 
 
+class PQQMetrics(object):
+    """
+    The index, qrels, pseudo-queries and queries shared by every document, loaded once per process.
+    """
+    def __init__(self, args):
+        if args.profile:
+            enable_profiling(args.profile)
+        self.args = args
+        if args.index:
+            store = DocumentVectorStore.open(args.doc_store) if args.doc_store else None
+            self.index = IndexWrapper(instrument(open_index(args.index), 'index.backend'), store=store,
+                                      collection_stats=args.collection_stats,
+                                      query_cache=QueryResultCache(args.query_cache) if args.query_cache else None,
+                                      path=args.index)
+            self.index = instrument(self.index, 'index')
+            self.scorer = instrument(DirichletTermScorer(self.index), 'scorer')
+
+        self.qrels = Qrels(file=args.qrels)
+
+        self.stopper = Stopper(file=args.stoplist)
+
+        self.pq = collections.defaultdict(dict)
+        with open(args.pseudo_queries) as f:
+            for line in f:
+                doc, term, weight = line.strip().split(',')
+                self.pq[doc][term] = float(weight)
+
+        self.q = collections.defaultdict(set)
+        with open(args.queries) as f:
+            for line in f:
+                query, term = line.strip().split(',')
+                self.q[query].add(term)
+
+    def shard_rows(self, docs):
+        """
+        :return: The output rows of each document, retrieving every query of the shard in one batch.
+        """
+        args = self.args
+        qrels = self.qrels
+        pq = self.pq
+        q = self.q
+
+        pq_queries = {doc: Query(doc, vector=collections.Counter(pq[doc])) for doc in docs}
+        # Sorted terms keep the query strings, and so the scores, the same from run to run
+        q_queries = {associated_query: Query(associated_query, vector=self.stopper.stop(collections.Counter(
+            sorted(q[associated_query])))) for doc in docs for associated_query in qrels.judged_for_queries(doc)}
+        if args.index:
+            all_pq_results = dict(zip(pq_queries, self.index.query_batch(pq_queries.values(), 10)))
+            all_q_results = dict(zip(q_queries, self.index.query_batch(q_queries.values(), 10)))
+
+        shard_rows = []
+        for doc in docs:
+            rows = []
+            if args.index:
+                pq_results = all_pq_results[doc]
+                pq_results_set = set([r.docno for r, _ in pq_results])
+            for associated_query in qrels.judged_for_queries(doc):
+                q_query = q_queries[associated_query]
+                if args.index:
+                    q_results = all_q_results[associated_query]
+                    q_results_set = set([r.docno for r, _ in q_results])
+                    results_jacc = jaccard_similarity(pq_results_set, q_results_set)
+
+                    pq_results_ap = average_precision(associated_query, [r.docno for r, _ in pq_results], qrels)
+                    q_results_ap = average_precision(associated_query, [r.docno for r, _ in q_results], qrels)
+                    pq_results_prec = precision(pq_results_set, qrels.rel_docs(associated_query))
+                    q_results_prec = precision(q_results_set, qrels.rel_docs(associated_query))
+
+                    pq_pseudo_doc = pseudo_document(pq_results, self.scorer)
+                    q_pseudo_doc = pseudo_document(q_results, self.scorer)
+                    cosine = cosine_similarity(pq_pseudo_doc, q_pseudo_doc)
+
+                q_qrels = Qrels.from_dict({associated_query: q_query.vector})
+
+                pseudo_ap = average_precision(associated_query, sorted(pq[doc].keys(), key=lambda k: pq[doc][k],
+                                                                       reverse=True), q_qrels)
+                pq_q_recall = recall(set(pq[doc].keys()), q[associated_query])
+                q_weight_perc = sum([pq[doc][term] if term in pq[doc] else 0.0 for term in q[associated_query]]) / \
+                    sum([pq[doc][term] for term in pq[doc]])
+
+                output = [doc, associated_query, pq_q_recall, pseudo_ap, q_weight_perc]
+                if args.index:
+                    output += [results_jacc, cosine, pq_results_ap, q_results_ap, pq_results_prec, q_results_prec]
+                rows.append(output)
+            shard_rows.append(rows)
+        return shard_rows
+
+
 def main():
     options = argparse.ArgumentParser()
     options.add_argument('pseudo_queries')
@@ -16,82 +109,28 @@ def main():
     options.add_argument('qrels')
     options.add_argument('stoplist')
     options.add_argument('--index')
+    options.add_argument('--doc-store')
+    options.add_argument('--collection-stats')
+    options.add_argument('--workers', type=int, default=1, help='processes to spread documents over')
+    options.add_argument('--query-cache')
+    options.add_argument('--columns', help='also save each output column as a .npy file in this directory')
+    options.add_argument('--profile', nargs='?', const='-',
+                         help='time index and scorer calls and write a JSON report at exit, to this file or stderr')
     args = options.parse_args()
 
-    if args.index:
-        index = IndexWrapper(pyndri.Index(args.index))
-        scorer = DirichletTermScorer(index)
-
-    qrels = Qrels(file=args.qrels)
-
-    stopper = Stopper(file=args.stoplist)
-
-    judged = collections.defaultdict(set)
-    with open(args.qrels) as f:
-        for line in f:
-            query, _, doc, _ = line.split()
-            judged[doc].add(query)
-
-    pq = collections.defaultdict(dict)
+    docs = []
     with open(args.pseudo_queries) as f:
         for line in f:
-            doc, term, weight = line.strip().split(',')
-            pq[doc][term] = float(weight)
-
-    q = collections.defaultdict(set)
-    with open(args.queries) as f:
-        for line in f:
-            query, term = line.strip().split(',')
-            q[query].add(term)
-
-    def normalize_results_scores(results):
-        total = sum([score for _, score in results])
-        return [(doc, score / total) for doc, score in results]
+            docs.append(line.strip().split(',')[0])
+    docs = list(collections.OrderedDict.fromkeys(docs))
 
     col_names = 'doc,query,pq_q_recall,pq_q_ap,q_weight_perc'
     if args.index:
         col_names += ',pq_q_results_jacc,pq_q_results_cosine,pq_results_ap,q_results_ap,pq_results_prec,q_results_prec'
-    print(col_names)
-    for doc in pq:
-        pq_query = Query(doc, vector=collections.Counter(pq[doc]))
-        if args.index:
-            pq_results = index.query(pq_query, 10)
-            pq_results_set = set([r.docno for r, _ in pq_results])
-        for associated_query in judged[doc]:
-            q_query = Query(associated_query, vector=stopper.stop(collections.Counter(q[associated_query])))
-            if args.index:
-                q_results = index.query(q_query, 10)
-                q_results_set = set([r.docno for r, _ in q_results])
-                results_jacc = jaccard_similarity(pq_results_set, q_results_set)
-
-                pq_results_ap = average_precision(associated_query, [r.docno for r, _ in pq_results], qrels)
-                q_results_ap = average_precision(associated_query, [r.docno for r, _ in q_results], qrels)
-                pq_results_prec = precision(pq_results_set, qrels.rel_docs(associated_query))
-                q_results_prec = precision(q_results_set, qrels.rel_docs(associated_query))
-
-                pq_vocab = build_vocab(*[r.document_vector() for r, _ in pq_results])
-                q_vocab = build_vocab(*[r.document_vector() for r, _ in q_results])
-
-                pq_pseudo_doc = {term: sum([exp_score * scorer.score(term, exp_doc) for exp_doc, exp_score in
-                                            normalize_results_scores(pq_results)]) for term in pq_vocab}
-                q_pseudo_doc = {term: sum([exp_score * scorer.score(term, exp_doc) for exp_doc, exp_score in
-                                           normalize_results_scores(q_results)]) for term in q_vocab}
-                cosine = cosine_similarity(pq_pseudo_doc, q_pseudo_doc)
-
-            q_qrels = Qrels()
-            q_qrels._qrels[associated_query] = q_query.vector
-
-            pseudo_ap = average_precision(associated_query, sorted(pq[doc].keys(), key=lambda k: pq[doc][k],
-                                                                   reverse=True), q_qrels)
-            pq_q_recall = recall(set(pq[doc].keys()), q[associated_query])
-            q_weight_perc = sum([pq[doc][term] if term in pq[doc] else 0.0 for term in q[associated_query]]) / \
-                            sum([pq[doc][term] for term in pq[doc]])
-
-            output = [doc, associated_query, str(pq_q_recall), str(pseudo_ap), str(q_weight_perc)]
-            if args.index:
-                output += [str(results_jacc), str(cosine), str(pq_results_ap), str(q_results_ap), str(pq_results_prec),
-                           str(q_results_prec)]
-            print(','.join(output))
+    runner = ShardedRunner(functools.partial(PQQMetrics, args), PQQMetrics.shard_rows, workers=args.workers)
+    with ColumnWriter(col_names.split(','), header=True, column_dir=args.columns) as writer:
+        for rows in runner.run(docs):
+            writer.write_rows(rows)
 
 
 if __name__ == '__main__':
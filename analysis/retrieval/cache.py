@@ -0,0 +1,177 @@
+import collections
+import json
+import sqlite3
+import sys
+import time
+
+
+def vector_size(vector):
+    """
+    Rough size in bytes of a {term: weight} vector, including its keys and values, or of a TermVector.
+    """
+    if hasattr(vector, 'nbytes'):
+        return sys.getsizeof(vector) + vector.nbytes
+    return sys.getsizeof(vector) + sum([sys.getsizeof(term) + sys.getsizeof(weight)
+                                        for term, weight in vector.items()])
+
+
+class LRUCache(object):
+    def __init__(self, max_bytes=2**27, sizeof=vector_size):
+        """
+        A least-recently-used cache bounded by the total size of its values rather than the number of entries.
+        :param max_bytes: The memory budget. Least recently used entries are evicted once it is exceeded.
+        :param sizeof: A function returning the size in bytes of a value.
+        """
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = collections.OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class QueryResultCache(object):
+    def __init__(self, file_name, max_entries=10**6, flush_every=1000, count_every=1000):
+        """
+        A persistent cache of retrieval results, kept in an SQLite file that any number of indexes and scripts can
+        share. Entries are keyed on the fingerprint of the index, the query string and the result count, so an index
+        rebuilt at the same path never sees the results of the old one. IndexWrapper binds the cache to its index.
+
+        Recording when a hit was last used would take a write per hit, which makes the processes sharing the file
+        wait on each other. Uses are kept in memory instead, and written once flush_every entries have been hit, with
+        the next put, and on close. Uses still unwritten when a process exits without closing the cache are lost,
+        which only makes eviction less exact.
+        :param file_name: The SQLite database file. It is created if missing.
+        :param max_entries: Cap on the number of entries in the file, over all indexes; least recently used ones go
+        first.
+        :param flush_every: How many entries may be hit before their times are written out.
+        :param count_every: How many puts to make between counting the entries in the file. Between counts, puts keep
+        a running count of their own, and entries other processes add are only seen at the next count.
+        """
+        self.fingerprint = None
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self.count_every = count_every
+        self.evictions = 0
+        self._used = {}
+        self._puts = 0
+        self._connection = sqlite3.connect(file_name)
+        self._connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE IF NOT EXISTS query_results (fingerprint TEXT, query TEXT, count INTEGER, results TEXT,
+                                                      last_used REAL, PRIMARY KEY (fingerprint, query, count));
+            CREATE INDEX IF NOT EXISTS query_results_last_used ON query_results (last_used);
+        """)
+        self._entries = self.entries()
+
+    def bind(self, fingerprint):
+        """
+        :param fingerprint: A string that changes whenever the index does, such as IndexWrapper.identity().
+        """
+        self.flush()
+        self.fingerprint = fingerprint
+
+    def get(self, query, count):
+        """
+        :return: The cached list of (doc_id, score) tuples, or None.
+        """
+        row = self._connection.execute('SELECT results FROM query_results WHERE fingerprint = ? AND query = ? AND '
+                                       'count = ?', (self.fingerprint, query, count)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[(self.fingerprint, query, count)] = time.time()
+        if len(self._used) >= self.flush_every:
+            self.flush()
+        return [tuple(result) for result in json.loads(row[0])]
+
+    def put(self, query, count, results):
+        """
+        :param results: A sequence of (doc_id, score) tuples.
+        """
+        with self._connection:
+            self._write_used()
+            cursor = self._connection.execute('INSERT OR IGNORE INTO query_results VALUES (?, ?, ?, ?, ?)',
+                                              (self.fingerprint, query, count,
+                                               json.dumps([[int(doc_id), float(score)] for doc_id, score in results]),
+                                               time.time()))
+            self._entries += cursor.rowcount
+            self._puts += 1
+            # Other processes may be adding entries too, so count them all now and then
+            if self._puts % self.count_every == 0:
+                self._entries = self.entries()
+            excess = self._entries - self.max_entries
+            if excess > 0:
+                cursor = self._connection.execute('DELETE FROM query_results WHERE rowid IN (SELECT rowid FROM '
+                                                  'query_results ORDER BY last_used LIMIT ?)', (excess,))
+                self._entries -= cursor.rowcount
+                self.evictions += cursor.rowcount
+
+    def flush(self):
+        """
+        Write out the times of the hits not yet recorded.
+        """
+        if self._used:
+            with self._connection:
+                self._write_used()
+
+    def _write_used(self):
+        self._connection.executemany('UPDATE query_results SET last_used = ? WHERE fingerprint = ? AND query = ? AND '
+                                     'count = ?', [(last_used,) + key for key, last_used in self._used.items()])
+        self._used = {}
+
+    def entries(self):
+        return self._connection.execute('SELECT COUNT(*) FROM query_results').fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': self.entries(), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -1,10 +1,24 @@
+import array
 import collections
+import concurrent.futures
+import functools
+import itertools
 import json
 import math
+import os
+import sys
+import threading
+import types
+import weakref
 import xml.etree.ElementTree
-from functools import lru_cache
 
-from retrieval.scoring import DirichletTermScorer
+import numpy as np
+
+from retrieval.cache import LRUCache
+from retrieval.memindex import open_index
+from retrieval.scoring import ExpansionLanguageModel
+from retrieval.stats import CollectionStatistics, index_fingerprint, index_identity
+from retrieval.vectors import TermVector
 
 
 def read_queries(file_name, format='json'):
@@ -43,23 +57,56 @@ def read_queries(file_name, format='json'):
 
 
 class Query(object):
+    """
+    An immutable weighted query. Terms are kept in sorted order, whatever order the vector or query string gives them
+    in, so equal vectors make equal queries. The Indri #weight string, its hash and the query length are computed once.
+    Queries compare and hash by their #weight string, so the title does not matter.
+
+    vector is a read-only {term: weight} mapping; build a new Query to change it:
+
+        query = Query(query.title, vector=stopper.stop(query.vector))
+    """
+    __slots__ = ('title', 'vector', '_length', '_string', '_hash')
+
     def __init__(self, title, query_string='', vector=None):
-        self.title = title
-        self.vector = collections.Counter(vector)
+        vector = collections.Counter(vector)
         for term in query_string.lower().strip().split():
-            self.vector[term] += 1
+            vector[term] += 1
+        vector = {sys.intern(term): vector[term] for term in sorted(vector)}
+        string = '#weight( ' + ' '.join([str(weight) + ' ' + term for term, weight in vector.items()]) + ' )'
+
+        set_attribute = super().__setattr__
+        set_attribute('title', title)
+        set_attribute('vector', types.MappingProxyType(vector))
+        set_attribute('_length', sum(vector.values()))
+        set_attribute('_string', string)
+        set_attribute('_hash', hash(string))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Query objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Query objects are immutable')
+
+    def __reduce__(self):
+        return Query, (self.title, '', dict(self.vector))
 
     def length(self):
-        return sum(self.vector.values())
+        return self._length
 
     def __str__(self):
-        return '#weight( ' + ' '.join([str(weight) + ' ' + term for term, weight in self.vector.items()]) + ' )'
+        return self._string
+
+    def __repr__(self):
+        return 'Query({!r}, {!r})'.format(self.title, self._string)
 
     def __hash__(self):
-        return hash(str(self))
+        return self._hash
 
     def __eq__(self, other):
-        return str(self) == str(other)
+        if isinstance(other, Query):
+            return self._hash == other._hash and self._string == other._string
+        return self._string == str(other)
 
 
 class Stopper(object):
@@ -71,16 +118,46 @@ class Stopper(object):
             with open(file) as f:
                 for line in f:
                     self.stopwords.add(line.strip().lower())
+        # Keyed weakly, so that a long-lived Stopper does not keep every index it has seen alive
+        self._stopword_ids = weakref.WeakKeyDictionary()
+        self._stopword_masks = weakref.WeakKeyDictionary()
+
+    def stopword_ids(self, index):
+        """
+        :param index: An IndexWrapper object.
+        :return: A sorted array of the index's term IDs for the stop words.
+        """
+        if index not in self._stopword_ids:
+            self._stopword_ids[index] = np.unique(np.array([index.term_id(term) for term in self.stopwords] + [0],
+                                                           dtype=np.int32))
+        return self._stopword_ids[index]
 
-    def stop(self, vector):
+    def stopword_mask(self, index):
+        """
+        :param index: An IndexWrapper object.
+        :return: A boolean array over the index's term IDs, True for the stop words and for ID 0.
+        """
+        if index not in self._stopword_masks:
+            mask = np.zeros(index.max_term_id() + 1, dtype=bool)
+            mask[self.stopword_ids(index)] = True
+            self._stopword_masks[index] = mask
+        return self._stopword_masks[index]
+
+    def stop(self, vector, index=None):
         """
         Return a copy of the vector without stop words.
-        :param vector: Assumes the vector is a {term: weight} dictionary, generally a Counter.
-        :return: A Counter object containing the vector less stop words.
+        :param vector: Assumes the vector is a {term: weight} dictionary, generally a Counter, or a TermVector.
+        :param index: The IndexWrapper a TermVector's term IDs belong to. Not needed for dictionaries.
+        :return: A Counter object containing the vector less stop words, or a TermVector if given one.
         """
+        if isinstance(vector, TermVector):
+            return vector.select(~self.stopword_mask(index)[vector.term_ids])
         return collections.Counter({term: weight for term, weight in vector.items() if term not in self.stopwords})
 
 
+_NO_STOPWORDS = Stopper()
+
+
 class Document(object):
     def __init__(self, index, docno=None, doc_id=None):
         self.index = index
@@ -101,10 +178,12 @@ class Document(object):
             except IOError:
                 self.docno = ''
 
-    @lru_cache(maxsize=2**6)
     def document_vector(self):
         return self.index.document_vector(self.doc_id)
 
+    def term_vector(self):
+        return self.index.term_vector(self.doc_id)
+
     def __str__(self):
         return '<{docno}>'.format(docno=self.docno)
 
@@ -116,8 +195,9 @@ class ExpandableDocument(Document):
             self.expansion_index = expansion_index
         else:
             self.expansion_index = index
+        self._expansion_results = {}
+        self._expansion_models = {}
 
-    @lru_cache(maxsize=2**6)
     def expansion_docs(self, pseudo_query, num_docs=10, include_scores=True):
         """
         Get the expansion documents for this document.
@@ -126,22 +206,48 @@ class ExpandableDocument(Document):
         :param include_scores: If True, return a list of (doc, score) tuples.
         :return: A list of ExpandableDocument objects, with corresponding scores if include_scores=True.
         """
-        # Get raw expansion docs
-        exp_doc_results = self.expansion_index.query(str(pseudo_query), count=num_docs)
+        key = (pseudo_query, num_docs)
+        if key not in self._expansion_results:
+            # Get raw expansion docs
+            exp_doc_results = self.expansion_index.query(str(pseudo_query), count=num_docs)
 
-        # Normalize scores
-        total_score = sum([score for _, score in exp_doc_results])
-        exp_doc_results = [(doc.doc_id, score / total_score) for doc, score in exp_doc_results]
+            # Normalize scores
+            total_score = sum([score for _, score in exp_doc_results])
+            exp_doc_results = [(doc.doc_id, score / total_score) for doc, score in exp_doc_results]
 
-        # Convert doc IDs to ExpandableDocument objects
-        expansion_docs = [(ExpandableDocument(self.expansion_index.docno(doc_id), self.expansion_index,
-                                              self.expansion_index), score) for doc_id, score in exp_doc_results]
+            # Convert doc IDs to ExpandableDocument objects
+            self._expansion_results[key] = [(ExpandableDocument(self.expansion_index.docno(doc_id),
+                                                                self.expansion_index, self.expansion_index), score)
+                                            for doc_id, score in exp_doc_results]
+        expansion_docs = self._expansion_results[key]
 
         if include_scores:
             return expansion_docs
         return [result[0] for result in expansion_docs]
 
-    def pseudo_query(self, num_terms=20, stopper=Stopper()):
+    def expansion_model(self, scorer, stopper=None, num_docs=10, num_terms=20):
+        """
+        Get the mixture of this document's expansion document language models, computed once per set of arguments.
+        :param scorer: A scorer with a score_batch method, associated with the expansion index.
+        :param stopper: Passed on to pseudo_query().
+        :param num_docs: The number of expansion documents.
+        :param num_terms: The number of terms in the pseudo-query used to find the expansion documents.
+        :return: An ExpansionLanguageModel object.
+        """
+        key = (scorer, stopper, num_docs, num_terms)
+        if key not in self._expansion_models:
+            expansion_docs = self.expansion_docs(self.pseudo_query(stopper=stopper, num_terms=num_terms),
+                                                 num_docs=num_docs)
+
+            # Normalize the document scores, in case it hasn't already been done
+            k = expansion_docs[0][1]
+            total = sum([math.exp(score-k) for _, score in expansion_docs])
+            expansion_docs = [(doc, math.exp(score-k) / total) for doc, score in expansion_docs]
+
+            self._expansion_models[key] = ExpansionLanguageModel(scorer, expansion_docs)
+        return self._expansion_models[key]
+
+    def pseudo_query(self, num_terms=20, stopper=None):
         """
         Converts this document into a pseudo-query, which is a Query containing the limited representation of the
         document.
@@ -150,63 +256,421 @@ class ExpandableDocument(Document):
         an empty Stopper.
         :return: A Query object containing the limited representation of the document.
         """
-        return Query(self.docno, vector={term: weight for term, weight in
-                                         stopper.stop(self.document_vector()).most_common(num_terms)})
+        stopper = stopper if stopper is not None else _NO_STOPWORDS
+        vector = stopper.stop(self.term_vector(), self.index).top(num_terms)
+        return Query(self.docno, vector={self.index.term(term_id): count for term_id, count in
+                                         zip(vector.term_ids.tolist(), vector.counts.tolist())})
 
 
 class Qrels(object):
+    """
+    Relevance judgments, held as parallel arrays of query IDs, document IDs and relevance grades. Queries and docnos
+    are numbered in the order they first appear, so judged_for_queries lists queries in file order, and docnos are
+    kept once each in a byte string array. The judgments are sorted by query and then document for forward (query to
+    documents) lookups, and a second ordering by document gives reverse (document to queries) lookups without
+    scanning every query.
+
+    Single judgments are looked up in a {docno: relevance} dictionary per query, built the first time the query is
+    asked about. Lookups never add entries; unjudged pairs have relevance 0.
+    """
     def __init__(self, file=None):
-        self._qrels = collections.defaultdict(lambda: collections.defaultdict(int))
-
+        """
+        :param file: A TREC qrels file of query, iteration, docno and relevance columns.
+        :raise ValueError: Naming the first line that does not have four fields or whose relevance is not an integer.
+        """
+        query_titles, docnos, query_ids, doc_ids, relevance = [], np.zeros(0, dtype=np.bytes_), [], [], []
         if file:
-            with open(file) as f:
-                for line in f:
-                    query, _, docno, rel = line.strip().split()
-                    rel = int(rel)
-                    self._qrels[query][docno] = rel
+            query_numbers, doc_numbers, query_ids, doc_ids, relevance = self._read(file)
+            query_titles = [query_title.decode() for query_title in query_numbers]
+            # The dictionary is several times the size of the array, so it goes before the indexes are built
+            docnos = np.array(list(doc_numbers), dtype=np.bytes_)
+            del doc_numbers
+        self._build(query_titles, docnos, query_ids, doc_ids, np.array(relevance, dtype=np.int32))
+
+    @classmethod
+    def from_dict(cls, judgments):
+        """
+        :param judgments: A {query_title: {docno: relevance}} dictionary, such as a query's term vector standing in
+        for judgments of terms.
+        """
+        query_numbers, doc_numbers, query_ids, doc_ids, relevance = {}, {}, [], [], []
+        for query_title in judgments:
+            for docno, grade in judgments[query_title].items():
+                query_ids.append(query_numbers.setdefault(query_title, len(query_numbers)))
+                doc_ids.append(doc_numbers.setdefault(docno, len(doc_numbers)))
+                relevance.append(grade)
+        qrels = cls()
+        # Judgments from a dictionary keep their type, so term weights standing in for grades are not truncated
+        qrels._build(list(query_numbers), np.array([docno.encode() for docno in doc_numbers], dtype=np.bytes_),
+                     query_ids, doc_ids, np.array(relevance) if relevance else np.zeros(0, dtype=np.int32))
+        return qrels
+
+    @staticmethod
+    def _read(file):
+        """
+        :return: The query titles and docnos, as {bytes: ID} dictionaries numbered in order of first appearance, and
+        the query ID, document ID and relevance of every judgment, as int arrays.
+        """
+        query_numbers, doc_numbers = {}, {}
+        query_ids, doc_ids, relevance = array.array('i'), array.array('i'), array.array('i')
+        with open(file, 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                fields = line.split()
+                if len(fields) != 4:
+                    if not fields:
+                        continue
+                    raise ValueError('{}, line {}: expected 4 fields, found {}'.format(file, line_number, len(fields)))
+                query_title, _, docno, grade = fields
+                try:
+                    relevance.append(int(grade))
+                except ValueError:
+                    raise ValueError('{}, line {}: relevance {} is not an integer'.format(file, line_number,
+                                                                                         grade.decode()))
+                query_ids.append(query_numbers.setdefault(query_title, len(query_numbers)))
+                doc_ids.append(doc_numbers.setdefault(docno, len(doc_numbers)))
+        return query_numbers, doc_numbers, query_ids, doc_ids, relevance
+
+    def _build(self, query_titles, docnos, query_ids, doc_ids, relevance):
+        self._query_titles = query_titles
+        self._query_ids = {query_title: i for i, query_title in enumerate(query_titles)}
+        self._docnos = docnos
+        query_ids = np.array(query_ids, dtype=np.int32)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+
+        # A pair judged more than once keeps its last judgment. np.unique on the reversed keys finds last
+        # occurrences, and leaves the pairs sorted by query and then document.
+        keys = query_ids.astype(np.int64) * max(len(docnos), 1) + doc_ids
+        _, last = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last
+        self._pair_queries = query_ids[keep]
+        self._pair_docs = doc_ids[keep]
+        self._relevance = relevance[keep]
+        self._query_offsets = np.concatenate([[0], np.cumsum(np.bincount(self._pair_queries,
+                                                                         minlength=len(self._query_titles)))])
+
+        self._by_doc = np.argsort(self._pair_docs, kind='stable').astype(np.int32)
+        self._doc_offsets = np.concatenate([[0], np.cumsum(np.bincount(self._pair_docs, minlength=len(docnos)))])
+
+        self._judgments = {}
+        self._rel_docs = {}
+        self._judged_docs = {}
+        # Built on first use: a {docno: doc_id} dictionary for reverse lookups, and the docnos in sorted order with
+        # their IDs for relevance_matrix
+        self._doc_ids = None
+        self._sorted_docnos = None
+
+    def _doc_id(self, docno):
+        if self._doc_ids is None:
+            self._doc_ids = {docno.decode(): i for i, docno in enumerate(self._docnos.tolist())}
+        return self._doc_ids.get(docno)
+
+    def _query_slice(self, query_title):
+        query_id = self._query_ids.get(query_title)
+        if query_id is None:
+            return slice(0, 0)
+        return slice(self._query_offsets[query_id], self._query_offsets[query_id+1])
+
+    def _query_judgments(self, query_title):
+        """
+        :return: The {docno: relevance} dictionary of the query's judgments. Unknown queries get an empty one, which
+        is not kept.
+        """
+        try:
+            return self._judgments[query_title]
+        except KeyError:
+            if query_title not in self._query_ids:
+                return {}
+        judged = self._query_slice(query_title)
+        docnos = [docno.decode() for docno in self._docnos[self._pair_docs[judged]].tolist()]
+        judgments = self._judgments[query_title] = dict(zip(docnos, self._relevance[judged].tolist()))
+        return judgments
 
     def is_rel(self, docno, query_title):
         return self.relevance_of(docno, query_title) > 0
 
     def relevance_of(self, docno, query_title):
-        return self._qrels[query_title][docno]
+        return self._query_judgments(query_title).get(docno, 0)
 
     def rel_docs(self, query_title):
-        return set([docno for docno in self._qrels[query_title] if self._qrels[query_title][docno] > 0])
+        if query_title not in self._rel_docs:
+            rel_docs = frozenset([docno for docno, relevance in self._query_judgments(query_title).items()
+                                  if relevance > 0])
+            if query_title not in self._query_ids:
+                return rel_docs
+            self._rel_docs[query_title] = rel_docs
+        return self._rel_docs[query_title]
 
     def judged_docs(self, query_title):
-        return set(self._qrels[query_title].keys())
+        if query_title not in self._judged_docs:
+            judged_docs = frozenset(self._query_judgments(query_title))
+            if query_title not in self._query_ids:
+                return judged_docs
+            self._judged_docs[query_title] = judged_docs
+        return self._judged_docs[query_title]
+
+    def __contains__(self, query_title):
+        return query_title in self._query_ids
+
+    def relevance_levels(self, query_title):
+        """
+        :return: The relevance of every document judged for the query, as an array.
+        """
+        return self._relevance[self._query_slice(query_title)]
+
+    def relevance_matrix(self, query_titles, docnos):
+        """
+        Look up many judgments at once, as relevance_of does one.
+
+        :param query_titles: A list of n query titles.
+        :param docnos: An n x m array of docno byte strings, one row per query.
+        :return: An n x m array of relevance, 0 where a document was not judged for its row's query.
+        """
+        docnos = np.asarray(docnos, dtype=np.bytes_)
+        query_ids = np.array([self._query_ids.get(query_title, -1) for query_title in query_titles], dtype=np.int64)
+        relevance = np.zeros(docnos.shape, dtype=self._relevance.dtype)
+        if not len(self._docnos) or not docnos.size:
+            return relevance
+
+        if self._sorted_docnos is None:
+            order = np.argsort(self._docnos)
+            self._sorted_docnos = (self._docnos[order], order.astype(np.int64))
+        sorted_docnos, sorted_doc_ids = self._sorted_docnos
+        positions = np.minimum(np.searchsorted(sorted_docnos, docnos), len(sorted_docnos) - 1)
+        found = (sorted_docnos[positions] == docnos) & (query_ids >= 0)[:, np.newaxis]
+        doc_ids = sorted_doc_ids[positions]
+
+        pair_keys = self._pair_queries.astype(np.int64) * len(self._docnos) + self._pair_docs
+        keys = query_ids[:, np.newaxis] * len(self._docnos) + doc_ids
+        positions = np.minimum(np.searchsorted(pair_keys, keys), len(pair_keys) - 1)
+        found &= pair_keys[positions] == keys
+        relevance[found] = self._relevance[positions[found]]
+        return relevance
 
     def judged_for_queries(self, docno):
-        queries = {}
-        for query in self._qrels:
-            if docno in self._qrels[query]:
-                queries[query] = self.relevance_of(docno, query)
-        return queries
+        """
+        :return: A {query_title: relevance} dictionary of the queries that judged the document, in file order.
+        """
+        doc_id = self._doc_id(docno)
+        if doc_id is None:
+            return {}
+        pairs = self._by_doc[self._doc_offsets[doc_id]:self._doc_offsets[doc_id+1]]
+        return {self._query_titles[query_id]: relevance for query_id, relevance in
+                zip(self._pair_queries[pairs].tolist(), self._relevance[pairs].tolist())}
 
 
 class BatchResults(object):
-    def __init__(self, file=None):
-        self._scores = collections.defaultdict(dict)
-        self._docs = collections.defaultdict(list)
+    """
+    A TREC run file held as columns. Each query's results are a contiguous slice, in file order, of parallel arrays of
+    document IDs, ranks and scores; document IDs index the sorted byte string array docnos. Queries keep the order
+    they first appear in.
+
+    Parsing a run file is slow, so the columns are saved next to it as <file>.npz and reused for as long as the run
+    file's size and modification time are unchanged.
+    """
+    def __init__(self, file=None, cache_file=None):
+        """
+        :param file: A TREC run file of query, Q0, docno, rank, score and run name columns.
+        :param cache_file: Where to keep the parsed columns, by default the run file name plus .npz. Pass False to
+        neither read nor write a cache.
+        """
+        self.query_titles = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.ranks = np.zeros(0, dtype=np.int32)
+        self.scores = np.zeros(0, dtype=np.float64)
+        self.docnos = np.zeros(0, dtype=np.bytes_)
         if file:
-            with open(file) as f:
-                for line in f:
-                    query, _, docno, rank, score, run = line.strip().split()
-                    self._scores[query][docno] = float(score)
-                    self._docs[query].append(docno)
+            if cache_file is None:
+                cache_file = file + '.npz'
+            source = os.stat(file)
+            source = np.array([source.st_size, source.st_mtime_ns], dtype=np.int64)
+            if not (cache_file and self._load(cache_file, source)):
+                self._parse(file)
+                if cache_file:
+                    self._save(cache_file, source)
+        self._query_ids = {query_title: i for i, query_title in enumerate(self.query_titles)}
+
+    @classmethod
+    def from_results(cls, results):
+        """
+        :param results: A {query_title: [(document, score), ...]} dictionary, such as query titles zipped with the
+        results of IndexWrapper.query_batch. Documents may be Document objects or docnos.
+        """
+        batch_results = cls()
+        query_titles = [query_title for query_title in results if len(results[query_title])]
+        docnos = [getattr(doc, 'docno', doc).encode()
+                  for query_title in query_titles for doc, _ in results[query_title]]
+        if not docnos:
+            return batch_results
+        lengths = [len(results[query_title]) for query_title in query_titles]
+        batch_results.query_titles = query_titles
+        batch_results.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        batch_results.docnos, doc_ids = np.unique(np.array(docnos, dtype=np.bytes_), return_inverse=True)
+        batch_results.doc_ids = doc_ids.ravel().astype(np.int32)
+        batch_results.ranks = np.concatenate([np.arange(1, length + 1, dtype=np.int32) for length in lengths])
+        batch_results.scores = np.array([score for query_title in query_titles for _, score in results[query_title]],
+                                        dtype=np.float64)
+        batch_results._query_ids = {query_title: i for i, query_title in enumerate(query_titles)}
+        return batch_results
+
+    def _parse(self, file):
+        """
+        :raise ValueError: Naming the first line that does not have six fields or whose rank or score is not a number.
+        """
+        query_numbers, doc_numbers = {}, {}
+        query_ids, doc_ids, ranks, scores = array.array('i'), array.array('i'), array.array('i'), array.array('d')
+        with open(file, 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                fields = line.split()
+                if len(fields) != 6:
+                    if not fields:
+                        continue
+                    raise ValueError('{}, line {}: expected 6 fields, found {}'.format(file, line_number, len(fields)))
+                query_title, _, docno, rank, score, _ = fields
+                try:
+                    ranks.append(int(rank))
+                    scores.append(float(score))
+                except ValueError:
+                    raise ValueError('{}, line {}: rank {} or score {} is not a number'.format(
+                        file, line_number, rank.decode(), score.decode()))
+                query_ids.append(query_numbers.setdefault(query_title, len(query_numbers)))
+                doc_ids.append(doc_numbers.setdefault(docno, len(doc_numbers)))
+        if not query_numbers:
+            return
+
+        # Number docnos in sorted order, which Evaluator relies on for trec_eval's tie breaking
+        docnos = np.array(list(doc_numbers), dtype=np.bytes_)
+        del doc_numbers
+        docno_order = np.argsort(docnos)
+        docno_ranks = np.empty(len(docnos), dtype=np.int32)
+        docno_ranks[docno_order] = np.arange(len(docnos), dtype=np.int32)
+
+        query_ids = np.array(query_ids, dtype=np.int32)
+        order = np.argsort(query_ids, kind='stable')
+        self.query_titles = [query_title.decode() for query_title in query_numbers]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(query_ids, minlength=len(query_numbers)))])
+        self.docnos = docnos[docno_order]
+        self.doc_ids = docno_ranks[np.array(doc_ids, dtype=np.int32)][order]
+        self.ranks = np.array(ranks, dtype=np.int32)[order]
+        self.scores = np.array(scores, dtype=np.float64)[order]
+
+    def _load(self, cache_file, source):
+        try:
+            data = np.load(cache_file)
+        except (OSError, ValueError):
+            return False
+        with data:
+            if not np.array_equal(data['source'], source):
+                return False
+            self.query_titles = [query_title.decode() for query_title in data['query_titles'].tolist()]
+            self.offsets = data['offsets']
+            self.doc_ids = data['doc_ids']
+            self.ranks = data['ranks']
+            self.scores = data['scores']
+            self.docnos = data['docnos']
+        return True
+
+    def _save(self, cache_file, source):
+        try:
+            with open(cache_file, 'wb') as f:
+                np.savez(f, source=source, query_titles=np.array([query_title.encode() for query_title in
+                                                                  self.query_titles], dtype=np.bytes_),
+                         offsets=self.offsets, doc_ids=self.doc_ids, ranks=self.ranks, scores=self.scores,
+                         docnos=self.docnos)
+        except OSError:
+            pass
+
+    def _query_slice(self, query_title):
+        query_id = self._query_ids.get(query_title)
+        if query_id is None:
+            return slice(0, 0)
+        return slice(self.offsets[query_id], self.offsets[query_id+1])
+
+    def docno(self, doc_id):
+        return self.docnos[doc_id].decode()
 
     def query_results(self, query_title):
-        return self._docs[query_title]
+        return [docno.decode() for docno in self.docnos[self.doc_ids[self._query_slice(query_title)]].tolist()]
 
     def document_query_score(self, docno, query_title):
-        return self._scores[query_title][docno]
+        results = self._query_slice(query_title)
+        key = docno.encode()
+        doc_id = np.searchsorted(self.docnos, key)
+        if doc_id < len(self.docnos) and self.docnos[doc_id] == key:
+            matches = np.flatnonzero(self.doc_ids[results] == doc_id)
+            # As when the results were a dictionary, a document listed twice keeps its last score
+            if len(matches):
+                return float(self.scores[results][matches[-1]])
+        raise KeyError(docno)
+
+    def top_k(self, query_titles, k):
+        """
+        Take the first k results of many queries at once.
+
+        :param query_titles: A list of query titles. Queries missing from the run have no results.
+        :param k: The number of results to take from each query, in file order.
+        :return: A tuple of (doc_ids, scores, lengths). doc_ids and scores are len(query_titles) x k arrays, padded
+        with -1 and NaN where a query has fewer than k results; lengths holds each query's number of results.
+        """
+        query_ids = np.array([self._query_ids.get(query_title, -1) for query_title in query_titles], dtype=np.int64)
+        starts = np.where(query_ids >= 0, self.offsets[query_ids], 0)
+        lengths = np.where(query_ids >= 0, np.minimum(self.offsets[query_ids+1] - starts, k), 0)
+        positions = starts[:, np.newaxis] + np.arange(k)[np.newaxis, :]
+        valid = np.arange(k)[np.newaxis, :] < lengths[:, np.newaxis]
+        positions = np.where(valid, positions, 0)
+        if not len(self.doc_ids):
+            return np.full((len(query_ids), k), -1, dtype=np.int32), np.full((len(query_ids), k), np.nan), lengths
+        doc_ids = np.where(valid, self.doc_ids[positions], -1).astype(np.int32)
+        scores = np.where(valid, self.scores[positions], np.nan)
+        return doc_ids, scores, lengths
 
 
 class IndexWrapper(object):
-    def __init__(self, index):
+    def __init__(self, index, cache_bytes=2**27, store=None, collection_stats=None, index_factory=None,
+                 query_cache=None, path=None):
+        """
+        :param index: A pyndri.Index object.
+        :param cache_bytes: Memory budget for cached document vectors, shared by every Document from this index.
+        :param store: An optional DocumentVectorStore. Documents it holds are read from it instead of being
+        decoded from the index.
+        :param collection_stats: Optionally serve term counts, document frequencies and collection totals from
+        memory rather than the index. Either a CollectionStatistics object, a file to load them from (built and
+        saved there if missing or stale), or True to build them now.
+        :param index_factory: An optional picklable callable that opens another handle on the same index, such as
+        functools.partial(pyndri.Index, path). query_batch uses it to give each worker its own handle. Defaults to
+        opening path again with open_index.
+        :param query_cache: An optional QueryResultCache for this index. Queries found there are not run again. It is
+        keyed on identity() if the wrapper has a path, and otherwise on fingerprint(), which reads the whole dictionary.
+        :param path: The path the index was opened from with open_index, if it was. Its modification time goes into
+        identity(), which tells saved collection statistics apart from those of an index since rebuilt there.
+        """
         self.index = index
+        self.path = path
+        if index_factory is None and path is not None:
+            index_factory = functools.partial(open_index, path)
+        self.index_factory = index_factory
+        self._local = threading.local()
         self._token2id, self._id2token, self._id2df = self.index.get_dictionary()
+        self.vector_cache = LRUCache(max_bytes=cache_bytes)
+        # Collection frequencies asked of the index, when there are no collection statistics to serve them
+        self._term_counts = {}
+        self.store = store
+        self._store_docnos = {}
+        if store is not None:
+            self._store_docnos = {doc_id: docno for docno, doc_id in self.index.document_ids(store.docnos)}
+            self._store_term_ids = np.array([self.term_id(term) for term in store.terms], dtype=np.int32)
+
+        self._fingerprint = None
+        dictionary = (self._token2id, self._id2token, self._id2df)
+        if collection_stats is True:
+            collection_stats = CollectionStatistics.build(self.index, dictionary, path)
+        elif isinstance(collection_stats, str):
+            collection_stats = CollectionStatistics.for_index(self.index, collection_stats, dictionary, path)
+        self.collection_stats = collection_stats
+
+        self.query_cache = query_cache
+        if query_cache is not None:
+            query_cache.bind(self.identity() if path is not None else self.fingerprint())
 
     def query(self, query, count=1000):
         """
@@ -214,13 +678,86 @@ class IndexWrapper(object):
         :param count: Number of documents to retrieve
         :return: List of Document objects
         """
-        results = self.index.query(str(query), results_requested=count)
+        query = str(query)
+        if self.query_cache is None:
+            return self._documents(self.index.query(query, results_requested=count))
+
+        results = self.query_cache.get(query, count)
+        if results is None:
+            results = self.index.query(query, results_requested=count)
+            self.query_cache.put(query, count, results)
+        return self._documents(results)
+
+    def query_batch(self, queries, count=1000, workers=1, processes=False):
+        """
+        Run many queries, on a pool of workers if workers > 1. Identical queries are only run once.
+
+        Each worker opens its own handle with index_factory, since Indri query environments are not thread-safe.
+        Without a factory the queries run in this thread, whatever the number of workers.
+        :param queries: A sequence of Query objects or query strings.
+        :param count: Number of documents to retrieve per query
+        :param workers: Number of threads or processes to run queries on.
+        :param processes: If True, use a process pool rather than threads. Requires index_factory.
+        :return: A list of results, as returned by query(), in the same order as queries
+        """
+        query_strings = [str(query) for query in queries]
+        unique_queries = list(collections.OrderedDict.fromkeys(query_strings))
+
+        cached_results = {}
+        if self.query_cache is not None:
+            for query in unique_queries:
+                results = self.query_cache.get(query, count)
+                if results is not None:
+                    cached_results[query] = results
+            unique_queries = [query for query in unique_queries if query not in cached_results]
+
+        if processes and self.index_factory is None:
+            raise ValueError('An index_factory is required to run queries on a process pool.')
+        if workers <= 1 or self.index_factory is None or not unique_queries:
+            raw_results = [self.index.query(query, results_requested=count) for query in unique_queries]
+        elif processes:
+            with concurrent.futures.ProcessPoolExecutor(workers, initializer=_open_worker_index,
+                                                        initargs=(self.index_factory,)) as pool:
+                raw_results = list(pool.map(_run_worker_query, unique_queries, itertools.repeat(count),
+                                            chunksize=max(1, len(unique_queries) // (workers * 4))))
+        else:
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                raw_results = list(pool.map(self._run_thread_query, unique_queries, itertools.repeat(count)))
+
+        if self.query_cache is not None:
+            for query, raw in zip(unique_queries, raw_results):
+                self.query_cache.put(query, count, raw)
+        cached_results.update(zip(unique_queries, raw_results))
+
+        results = {query: self._documents(raw) for query, raw in cached_results.items()}
+        return [list(results[query]) for query in query_strings]
+
+    def _run_thread_query(self, query, count):
+        if not hasattr(self._local, 'index'):
+            self._local.index = self.index_factory()
+        return self._local.index.query(query, results_requested=count)
+
+    def _documents(self, results):
         docs = []
         for doc_id, score in results:
             doc = Document(self, doc_id=doc_id)
             docs.append((doc, score))
         return docs
 
+    def fingerprint(self):
+        """
+        :return: A string identifying the current contents of the index, computed on first use.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = index_fingerprint(self.index, (self._token2id, self._id2token, self._id2df))
+        return self._fingerprint
+
+    def identity(self):
+        """
+        :return: A cheap string identifying the index by its totals, number of terms and modification time.
+        """
+        return index_identity(self.index, (self._token2id, self._id2token, self._id2df), self.path)
+
     def docno(self, doc_id):
         try:
             return self.index.ext_document_id(doc_id)
@@ -231,38 +768,89 @@ class IndexWrapper(object):
         return self.index.document_ids((docno,))[0][1]
 
     def document_vector(self, doc_id):
-            _, token_ids = self.index.document(doc_id)
-            return collections.Counter([self._id2token[token_id] for token_id in token_ids if token_id > 0])
+        vector = self.vector_cache.get(('counter', doc_id))
+        if vector is None:
+            vector = self.term_vector(doc_id).to_counter(self)
+            self.vector_cache.put(('counter', doc_id), vector)
+        return vector
+
+    def term_vector(self, doc_id):
+        """
+        :return: The document as a TermVector of this index's term IDs.
+        """
+        vector = self.vector_cache.get(('terms', doc_id))
+        if vector is None:
+            if doc_id in self._store_docnos:
+                term_ids, counts = self.store.row(self._store_docnos[doc_id])
+                vector = TermVector(self._store_term_ids[term_ids], counts)
+                vector = vector.select(vector.term_ids > 0)
+            else:
+                _, token_ids = self.index.document(doc_id)
+                vector = TermVector.from_tokens(token_ids)
+            self.vector_cache.put(('terms', doc_id), vector)
+        return vector
+
+    def term(self, term_id):
+        return self._id2token[term_id]
+
+    def max_term_id(self):
+        return max(self._id2token, default=0)
+
+    def term_id(self, term):
+        """
+        :return: The term's ID, or 0 if it is not in the index.
+        """
+        return self._token2id.get(term, 0)
 
     def term_count(self, term):
-        return self.index.term_count(term)
+        # The index runs terms outside its dictionary through its own text processing, such as stemming, so only
+        # dictionary terms can be looked up in the collection statistics
+        if self.collection_stats is not None and term in self._token2id:
+            return int(self.collection_stats.term_counts[self._token2id[term]])
+        try:
+            return self._term_counts[term]
+        except KeyError:
+            count = self._term_counts[term] = self.index.term_count(term)
+        return count
+
+    def term_counts(self, term_ids):
+        """
+        :param term_ids: An integer array of term IDs.
+        :return: An array of their collection frequencies.
+        """
+        if self.collection_stats is not None:
+            return self.collection_stats.term_counts[term_ids]
+        return np.array([self.term_count(self.term(term_id)) if term_id > 0 else 0 for term_id in
+                         np.asarray(term_ids).tolist()], dtype=np.int64)
 
     def total_terms(self):
+        if self.collection_stats is not None:
+            return self.collection_stats.total_terms
         return self.index.total_terms()
 
     def total_docs(self):
+        if self.collection_stats is not None:
+            return self.collection_stats.total_docs
         return self.index.document_count()
 
     def term_document_frequency(self, term):
         try:
             term_id = self._token2id[term]
+            if self.collection_stats is not None:
+                return int(self.collection_stats.document_frequencies[term_id])
             return self._id2df[term_id]
         except IOError:
             return 0
 
 
-def build_rm1(initial_results, index, num_terms=20, stopper=None):
-    if stopper is None:
-        stopper = Stopper()
+_worker_index = None
+
 
-    zero_mu_scorer = DirichletTermScorer(index, mu=0)
+def _open_worker_index(index_factory):
+    global _worker_index
+    _worker_index = index_factory()
 
-    term_scores = collections.Counter()
 
-    for doc, score in initial_results:
-        for term in doc.document_vector():
-            if term not in stopper.stopwords:
-                term_scores[term] += zero_mu_scorer.score(term, doc) * math.exp(score) / len(initial_results)
+def _run_worker_query(query, count):
+    return tuple(_worker_index.query(query, results_requested=count))
 
-    vector = {term: score for term, score in term_scores.most_common(num_terms)}
-    return Query('rm1', vector=vector)
@@ -0,0 +1,108 @@
+import numpy as np
+
+from retrieval.core import BatchResults
+
+
+class Evaluator(object):
+    """
+    Evaluate every query of a run at once, following trec_eval: results are ranked by score, ties broken by docno in
+    descending order, documents with relevance of at least 1 are relevant, and only queries that are both in the run
+    and in the qrels are evaluated. Measures are named as in trec_eval:
+
+        map             average precision over the whole ranking
+        P_k             precision at rank k
+        recall_k        recall at rank k
+        ndcg_cut_k      nDCG at rank k, using relevance levels as gains
+
+    A ranking of n results is one row of a padded queries x n matrix, so each measure is a handful of array operations
+    over all queries and cutoffs.
+    """
+    def __init__(self, qrels, cutoffs=(5, 10, 15, 20, 30, 100, 200, 500, 1000)):
+        """
+        :param qrels: A Qrels object.
+        :param cutoffs: The ranks k at which to take P_k, recall_k and ndcg_cut_k.
+        """
+        self.qrels = qrels
+        self.cutoffs = tuple(cutoffs)
+
+    def evaluate(self, run):
+        """
+        :param run: A BatchResults object, or a {query_title: [(document, score), ...]} dictionary as taken by
+        BatchResults.from_results.
+        :return: A {query_title: {measure: value}} dictionary.
+        """
+        query_titles, measures = self.evaluate_arrays(run)
+        return {query_title: {measure: float(values[i]) for measure, values in measures.items()}
+                for i, query_title in enumerate(query_titles)}
+
+    def evaluate_arrays(self, run):
+        """
+        :return: The evaluated query titles, and a {measure: array} dictionary of values in the same order.
+        """
+        if not isinstance(run, BatchResults):
+            run = BatchResults.from_results(run)
+        query_titles = [query_title for query_title in run.query_titles if query_title in self.qrels]
+        relevance = self._ranked_relevance(run, query_titles)
+        depth = relevance.shape[1]
+
+        levels = [self.qrels.relevance_levels(query_title) for query_title in query_titles]
+        num_rel = np.array([np.count_nonzero(query_levels > 0) for query_levels in levels], dtype=np.float64)
+        relevant = relevance > 0
+        relevant_so_far = np.cumsum(relevant, axis=1)
+        ranks = np.arange(1, depth + 1)
+
+        measures = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precisions = np.where(relevant, relevant_so_far / ranks, 0.0).sum(axis=1)
+            measures['map'] = np.where(num_rel > 0, precisions / num_rel, 0.0)
+
+            # Gains are relevance levels, with negative levels counting as 0
+            max_cutoff = max(self.cutoffs, default=0)
+            discounts = 1 / np.log2(np.arange(2, max(max_cutoff, depth) + 2))
+            gains = np.maximum(relevance, 0)
+            ideal_gains = np.zeros((len(query_titles), max_cutoff))
+            for i, query_levels in enumerate(levels):
+                best = np.sort(np.maximum(query_levels, 0))[::-1][:max_cutoff]
+                ideal_gains[i, :len(best)] = best
+
+            for k in self.cutoffs:
+                found = relevant_so_far[:, min(k, depth) - 1] if depth else np.zeros(len(query_titles))
+                measures['P_{}'.format(k)] = found / k
+                measures['recall_{}'.format(k)] = np.where(num_rel > 0, found / num_rel, 0.0)
+                dcg = gains[:, :k] @ discounts[:min(k, depth)]
+                ideal_dcg = ideal_gains[:, :k] @ discounts[:k]
+                measures['ndcg_cut_{}'.format(k)] = np.where(ideal_dcg > 0, dcg / ideal_dcg, 0.0)
+
+        return query_titles, measures
+
+    def mean(self, run):
+        """
+        :return: A {measure: value} dictionary of each measure averaged over the evaluated queries.
+        """
+        _, measures = self.evaluate_arrays(run)
+        return {measure: float(values.mean()) if len(values) else 0.0 for measure, values in measures.items()}
+
+    def _ranked_relevance(self, run, query_titles):
+        """
+        :return: A queries x depth matrix of the relevance of each query's results in trec_eval order, padded with 0.
+        """
+        run_query_ids = {query_title: i for i, query_title in enumerate(run.query_titles)}
+        query_ids = np.array([run_query_ids[query_title] for query_title in query_titles], dtype=np.int64)
+        starts = run.offsets[query_ids]
+        lengths = run.offsets[query_ids + 1] - starts
+        depth = int(lengths.max(initial=0))
+        positions = starts[:, np.newaxis] + np.arange(depth)[np.newaxis, :]
+        valid = np.arange(depth)[np.newaxis, :] < lengths[:, np.newaxis]
+        positions = np.where(valid, positions, 0)
+        if not len(run.doc_ids):
+            return np.zeros((len(query_ids), depth), dtype=np.int32)
+
+        # docnos are sorted, so ordering by descending doc ID orders by descending docno. Padding sorts last.
+        doc_ids = np.where(valid, run.doc_ids[positions], -1)
+        scores = np.where(valid, run.scores[positions], -np.inf)
+        order = np.lexsort((-doc_ids, -scores, ~valid), axis=-1)
+        doc_ids = np.take_along_axis(doc_ids, order, axis=1)
+        valid = np.take_along_axis(valid, order, axis=1)
+
+        docnos = np.where(valid, run.docnos[np.maximum(doc_ids, 0)], b'')
+        return np.where(valid, self.qrels.relevance_matrix(query_titles, docnos), 0)
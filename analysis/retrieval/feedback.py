@@ -0,0 +1,111 @@
+import collections
+
+import numpy as np
+
+from retrieval.core import Query, Stopper
+from retrieval.scoring import DirichletTermScorer
+
+
+def feedback_weights(scores):
+    """
+    Turn retrieval scores, which Indri reports as log probabilities, into document weights summing to 1. The
+    log-sum-exp shift keeps long queries, whose scores are very negative, from underflowing to zero.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    weights = np.exp(scores - scores.max())
+    return weights / weights.sum()
+
+
+def relevance_model(initial_results, index, stopper=None):
+    """
+    Estimate the full RM1 distribution: a feedback-weighted sum of the maximum likelihood language models of the
+    result documents.
+    :param initial_results: A list of (Document, score) tuples, as returned by IndexWrapper.query.
+    :param index: The IndexWrapper the documents came from.
+    :param stopper: An optional Stopper whose words are left out of the model.
+    :return: Parallel arrays of term IDs and probabilities, with terms in order of first occurrence.
+    """
+    if stopper is None:
+        stopper = Stopper()
+
+    docs = [doc for doc, _ in initial_results]
+    if not docs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # Keep terms in order of first occurrence so that ties rank as they would in a Counter
+    term_ids = np.concatenate([stopper.stop(doc.term_vector(), index).term_ids for doc in docs])
+    _, first = np.unique(term_ids, return_index=True)
+    vocab = term_ids[np.sort(first)]
+
+    doc_term_probs = DirichletTermScorer(index, mu=0).score_batch(vocab, docs, sparse=True)
+    return vocab, doc_term_probs.T @ feedback_weights([score for _, score in initial_results])
+
+
+def build_rm1(initial_results, index, num_terms=20, stopper=None):
+    vocab, term_scores = relevance_model(initial_results, index, stopper=stopper)
+    top = np.argsort(-term_scores, kind='stable')[:num_terms]
+    vector = {index.term(term_id): score for term_id, score in zip(vocab[top].tolist(), term_scores[top].tolist())}
+    return Query('rm1', vector=vector)
+
+
+def build_rm3(query, rm1, original_weight=0.5):
+    """
+    Interpolate a query with its relevance model. Both are normalized to sum to 1 first.
+    :param query: The original Query.
+    :param rm1: The relevance model Query, as returned by build_rm1.
+    :param original_weight: The weight of the original query; the relevance model gets the rest.
+    :return: A Query with the original query's title.
+    """
+    vector = collections.OrderedDict()
+    for weight, model in ((original_weight, query), (1.0 - original_weight, rm1)):
+        length = model.length()
+        if length == 0 or weight == 0:
+            continue
+        for term, term_weight in model.vector.items():
+            vector[term] = vector.get(term, 0.0) + weight * term_weight / length
+    return Query(query.title, vector=vector)
+
+
+class RelevanceFeedback(object):
+    def __init__(self, index, num_docs=10, num_terms=20, original_weight=0.5, stopper=None, workers=1):
+        """
+        Pseudo-relevance feedback with RM3: retrieve, build RM1 from the top documents, interpolate it with the
+        query and, optionally, retrieve again with the expanded query.
+        :param index: An IndexWrapper object.
+        :param num_docs: The number of feedback documents.
+        :param num_terms: The number of relevance model terms kept.
+        :param original_weight: The weight of the original query in RM3.
+        :param stopper: An optional Stopper whose words are left out of the relevance model.
+        :param workers: Passed on to IndexWrapper.query_batch.
+        """
+        self.index = index
+        self.num_docs = num_docs
+        self.num_terms = num_terms
+        self.original_weight = original_weight
+        self.stopper = stopper
+        self.workers = workers
+
+    def relevance_models(self, queries, initial_results=None):
+        """
+        :param queries: A sequence of Query objects.
+        :param initial_results: Results already retrieved for the queries, if any.
+        :return: A list of RM1 Query objects, one per query.
+        """
+        if initial_results is None:
+            initial_results = self.index.query_batch(queries, count=self.num_docs, workers=self.workers)
+        return [build_rm1(results[:self.num_docs], self.index, num_terms=self.num_terms, stopper=self.stopper)
+                for results in initial_results]
+
+    def expand(self, queries, initial_results=None):
+        """
+        :return: A list of RM3 Query objects, one per query.
+        """
+        rm1s = self.relevance_models(queries, initial_results=initial_results)
+        return [build_rm3(query, rm1, original_weight=self.original_weight) for query, rm1 in zip(queries, rm1s)]
+
+    def retrieve(self, queries, count=1000):
+        """
+        Run the queries with feedback: expand each one, then retrieve again with the expanded query.
+        :return: A list of results, as returned by IndexWrapper.query, in the same order as queries.
+        """
+        return self.index.query_batch(self.expand(queries), count=count, workers=self.workers)
@@ -0,0 +1,173 @@
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+
+# The attributes instrument() looks for on its target to report cache statistics, from objects with a stats() method
+CACHE_ATTRIBUTES = ('cache', 'vector_cache', 'query_cache')
+
+
+class MethodStats(object):
+    def __init__(self, max_samples=10000, seed=0):
+        """
+        Call count, total and maximum latency of one method, with a uniform sample of latencies for percentiles.
+        :param max_samples: The size of the latency sample. Calls past this many replace samples at random.
+        """
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.max_samples = max_samples
+        self.samples = []
+        self._random = random.Random(seed)
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        if len(self.samples) < self.max_samples:
+            self.samples.append(seconds)
+        else:
+            i = self._random.randrange(self.calls)
+            if i < self.max_samples:
+                self.samples[i] = seconds
+
+    def summary(self):
+        p50, p90, p99 = np.percentile(self.samples, [50, 90, 99]).tolist() if self.samples else (0.0, 0.0, 0.0)
+        return {'calls': self.calls, 'total_seconds': self.total_seconds,
+                'mean_seconds': self.total_seconds / self.calls if self.calls else 0.0,
+                'p50_seconds': p50, 'p90_seconds': p90, 'p99_seconds': p99, 'max_seconds': self.max_seconds}
+
+
+class Profiler(object):
+    """
+    Call counts and latencies of the methods of instrumented objects, and the statistics of their caches, for one
+    process. Latencies are inclusive: an IndexWrapper.query call includes the time of the index query it makes.
+    """
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self.methods = {}
+        self.caches = {}
+        self.start_time = time.perf_counter()
+
+    def instrument(self, target, name):
+        """
+        :param target: An index, IndexWrapper, scorer or any other object.
+        :param name: The name to report its methods and caches under.
+        :return: A proxy to the target that times every public method call made through it.
+        """
+        for attribute in CACHE_ATTRIBUTES:
+            cache = getattr(target, attribute, None)
+            if cache is not None and callable(getattr(cache, 'stats', None)):
+                self.watch_cache('{}.{}'.format(name, attribute), cache)
+        return Instrumented(target, name, self)
+
+    def watch_cache(self, name, cache):
+        """
+        :param cache: An object with a stats() method returning a dictionary, such as an LRUCache.
+        """
+        self.caches[name] = cache
+
+    def method_stats(self, name):
+        if name not in self.methods:
+            self.methods[name] = MethodStats(max_samples=self.max_samples)
+        return self.methods[name]
+
+    def report(self):
+        """
+        :return: A dictionary of the process, its wall time so far, each method's statistics (slowest total first) and
+        each cache's statistics.
+        """
+        methods = sorted(self.methods.items(), key=lambda item: item[1].total_seconds, reverse=True)
+        return {'pid': os.getpid(), 'argv': sys.argv, 'wall_seconds': time.perf_counter() - self.start_time,
+                'methods': {name: stats.summary() for name, stats in methods},
+                'caches': {name: cache.stats() for name, cache in sorted(self.caches.items())}}
+
+    def write_report(self, file_name='-'):
+        """
+        :param file_name: A file to write the JSON report to, or '-' for stderr.
+        """
+        report = json.dumps(self.report(), indent=2)
+        if file_name == '-':
+            print(report, file=sys.stderr)
+        else:
+            with open(file_name, 'w') as f:
+                f.write(report + '\n')
+
+
+class Instrumented(object):
+    """
+    A proxy that forwards everything to its target, timing calls to the target's public methods. Calls the target
+    makes on itself are not seen, so wrap the objects whose callers are of interest, such as a pyndri.Index before
+    handing it to IndexWrapper.
+    """
+    __slots__ = ('_target', '_name', '_profiler', '_methods')
+
+    def __init__(self, target, name, profiler):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_profiler', profiler)
+        object.__setattr__(self, '_methods', {})
+
+    def __getattr__(self, attribute):
+        value = getattr(self._target, attribute)
+        if attribute.startswith('_') or not callable(value) or isinstance(value, type):
+            return value
+        if attribute not in self._methods:
+            self._methods[attribute] = _timed(value, self._profiler.method_stats('{}.{}'.format(self._name,
+                                                                                                 attribute)))
+        return self._methods[attribute]
+
+    def __setattr__(self, attribute, value):
+        setattr(self._target, attribute, value)
+
+    def __repr__(self):
+        return '<Instrumented {} {!r}>'.format(self._name, self._target)
+
+
+def _timed(method, stats):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats.add(time.perf_counter() - start)
+    return timed
+
+
+_profiler = None
+_profiler_pid = None
+
+
+def enable_profiling(report_file='-', max_samples=10000):
+    """
+    Start profiling this process and write the report when it exits. Worker processes, whose setup calls this again,
+    write to report_file with their process ID appended, so that they do not overwrite each other.
+    :param report_file: A file to write the JSON report to, or '-' for stderr.
+    :return: The process's Profiler.
+    """
+    global _profiler, _profiler_pid
+    # A forked worker inherits its parent's profiler but not the finalizer that would write its report
+    if _profiler is None or _profiler_pid != os.getpid():
+        _profiler = Profiler(max_samples=max_samples)
+        _profiler_pid = os.getpid()
+        if report_file != '-' and multiprocessing.parent_process() is not None:
+            report_file = '{}.{}'.format(report_file, os.getpid())
+        # Unlike atexit handlers, these finalizers also run when a multiprocessing worker exits
+        multiprocessing.util.Finalize(None, _profiler.write_report, args=(report_file,), exitpriority=0)
+    return _profiler
+
+
+def instrument(target, name):
+    """
+    :return: An instrumented proxy to the target if profiling is enabled in this process, or else the target itself.
+    """
+    if _profiler is None or _profiler_pid != os.getpid():
+        return target
+    return _profiler.instrument(target, name)
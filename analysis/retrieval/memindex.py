@@ -0,0 +1,156 @@
+import re
+
+import numpy as np
+
+from retrieval.store import DocumentVectorStore
+
+
+class MemoryIndex(object):
+    """
+    An in-memory stand-in for pyndri.Index, built from document vectors, with an inverted index and Dirichlet-smoothed
+    query likelihood ranking. It implements the parts of pyndri.Index that IndexWrapper uses, so wrap it as you would
+    a real index:
+
+        memory_index = MemoryIndex.from_csv('data/doc_vectors.csv')
+        index = IndexWrapper(memory_index, store=memory_index.store)
+
+    Passing the store as well lets IndexWrapper read document vectors straight from its arrays.
+
+    Document IDs start at 1 and term ID 0 is unused, as in Indri. Only flat queries are understood: plain terms,
+    #combine( ... ) and #weight( ... ).
+    """
+    def __init__(self, store, mu=2500):
+        """
+        :param store: A DocumentVectorStore holding every document in the collection.
+        :param mu: The Dirichlet smoothing parameter used for ranking.
+        """
+        self.store = store
+        self.mu = mu
+
+        self._token2id = {term: term_id for term_id, term in enumerate(store.terms) if term_id > 0}
+        self._docnos = {docno: i + 1 for i, docno in enumerate(store.docnos)}
+
+        term_ids = np.asarray(store.term_ids, dtype=np.int64)
+        counts = np.asarray(store.counts, dtype=np.int64)
+        offsets = np.asarray(store.offsets)
+        doc_ids = np.repeat(np.arange(1, len(store) + 1), np.diff(offsets))
+
+        self._doc_lengths = np.zeros(len(store) + 1, dtype=np.int64)
+        np.add.at(self._doc_lengths, doc_ids, counts)
+        self._term_counts = np.bincount(term_ids, weights=counts, minlength=len(store.terms)).astype(np.int64)
+        self._document_frequencies = np.bincount(term_ids, minlength=len(store.terms))
+        self._total_terms = int(counts.sum())
+
+        # Postings are grouped by term, with document IDs ascending within each term
+        order = np.lexsort((doc_ids, term_ids))
+        self._posting_docs = doc_ids[order]
+        self._posting_counts = counts[order]
+        self._posting_offsets = np.concatenate([[0], np.cumsum(self._document_frequencies)])
+
+    @classmethod
+    def from_csv(cls, file_name, mu=2500):
+        return cls(DocumentVectorStore.from_csv(file_name), mu=mu)
+
+    @classmethod
+    def from_vectors(cls, vectors, mu=2500):
+        """
+        :param vectors: An iterable of (docno, vector) pairs, where each vector is a {term: count} dictionary.
+        """
+        return cls(DocumentVectorStore.from_vectors(vectors), mu=mu)
+
+    def get_dictionary(self):
+        id2token = {term_id: term for term, term_id in self._token2id.items()}
+        id2df = {term_id: int(self._document_frequencies[term_id]) for term_id in id2token}
+        return dict(self._token2id), id2token, id2df
+
+    def document(self, doc_id):
+        docno = self.ext_document_id(doc_id)
+        term_ids, counts = self.store.row(docno)
+        return docno, tuple(np.repeat(term_ids, counts).tolist())
+
+    def document_ids(self, docnos):
+        return [(docno, self._docnos[docno]) for docno in docnos if docno in self._docnos]
+
+    def ext_document_id(self, doc_id):
+        if not 0 < doc_id <= len(self.store):
+            raise IndexError('Doc ID {} not found in the index.'.format(str(doc_id)))
+        return self.store.docnos[doc_id - 1]
+
+    def term_count(self, term):
+        return int(self._term_counts[self._token2id.get(term, 0)])
+
+    def total_terms(self):
+        return self._total_terms
+
+    def document_count(self):
+        return len(self.store)
+
+    def query(self, query, results_requested=1000):
+        """
+        :param query: An Indri query string.
+        :return: A tuple of (doc_id, score) tuples, best first.
+        """
+        terms, weights = parse_query(query)
+        if not terms or sum(weights) <= 0 or results_requested <= 0:
+            return ()
+        term_ids = np.array([self._token2id.get(term, 0) for term in terms], dtype=np.int64)
+        weights = np.array(weights) / sum(weights)
+
+        postings = [slice(self._posting_offsets[term_id], self._posting_offsets[term_id+1]) if term_id > 0
+                    else slice(0, 0) for term_id in term_ids.tolist()]
+        candidates = np.unique(np.concatenate([self._posting_docs[p] for p in postings]))
+        if len(candidates) == 0:
+            return ()
+
+        # Indri gives terms missing from the collection half an occurrence
+        collection_probs = np.where(term_ids > 0, self._term_counts[term_ids], 0.5) / self._total_terms
+        background = np.log(self.mu * collection_probs)
+        scores = np.full(len(candidates), np.dot(weights, background))
+        scores -= np.log(self._doc_lengths[candidates] + self.mu)
+        for i, p in enumerate(postings):
+            positions = np.searchsorted(candidates, self._posting_docs[p])
+            scores[positions] += weights[i] * (np.log(self._posting_counts[p] + self.mu * collection_probs[i]) -
+                                               background[i])
+
+        if results_requested < len(candidates):
+            top = np.argpartition(-scores, results_requested - 1)[:results_requested]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.lexsort((candidates[top], -scores[top]))]
+        return tuple(zip(candidates[top].tolist(), scores[top].tolist()))
+
+
+def parse_query(query):
+    """
+    :param query: A flat Indri query string: plain terms, #combine( ... ) or #weight( ... ).
+    :return: Parallel lists of terms and weights.
+    """
+    tokens = query.lower().replace('(', ' ( ').replace(')', ' ) ').split()
+    if not tokens:
+        return [], []
+    if tokens[0] in ('#weight', '#combine'):
+        if tokens[1] != '(' or tokens[-1] != ')':
+            raise ValueError('Malformed query: {}'.format(query))
+        operator, tokens = tokens[0], tokens[2:-1]
+    else:
+        operator = '#combine'
+    if any([re.match(r'#|\(|\)', token) for token in tokens]):
+        raise ValueError('Only flat #weight and #combine queries are supported: {}'.format(query))
+
+    if operator == '#weight':
+        if len(tokens) % 2:
+            raise ValueError('Malformed query: {}'.format(query))
+        return tokens[1::2], [float(weight) for weight in tokens[0::2]]
+    return tokens, [1.0] * len(tokens)
+
+
+def open_index(path):
+    """
+    Open an index by path: a docno,term,count CSV file is loaded as a MemoryIndex, anything else is opened with
+    pyndri, which is only imported when needed.
+    """
+    if path.endswith('.csv'):
+        return MemoryIndex.from_csv(path)
+
+    import pyndri
+    return pyndri.Index(path)
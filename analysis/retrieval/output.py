@@ -0,0 +1,105 @@
+import os
+import sys
+
+import numpy as np
+
+
+class ColumnWriter(object):
+    """
+    Write a script's output rows as delimited text in blocks, and optionally as one .npy file per column.
+
+    Fields are written with str(), as print does, so the text is the same as printing each row with sep=separator.
+    Rows are buffered and written block_rows at a time. With column_dir, every value is also kept in a buffer for its
+    column. On close, each column is saved as an array: int64 if every value is an int, float64 if every value is a
+    number, and a unicode string array otherwise. The column names go in columns.txt, in order. load_columns opens
+    the directory again, memory-mapping each array.
+
+        with ColumnWriter(['docno', 'query', 'score'], column_dir='out.columns') as writer:
+            writer.write_row([docno, query.title, score])
+    """
+    def __init__(self, columns, file=None, separator=',', header=False, column_dir=None, block_rows=4096):
+        """
+        :param columns: The column names.
+        :param file: A text file to write rows to, by default sys.stdout.
+        :param separator: The field separator.
+        :param header: Whether to start the text with a row of column names.
+        :param column_dir: An optional directory to save the columns in when the writer is closed.
+        :param block_rows: How many rows to buffer before writing them out.
+        """
+        self.columns = list(columns)
+        self.file = sys.stdout if file is None else file
+        self.separator = separator
+        self.column_dir = column_dir
+        self.block_rows = block_rows
+        self._block = []
+        self._values = [[] for _ in self.columns] if column_dir else None
+        if header:
+            self._block.append(separator.join(self.columns))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_row(self, row):
+        """
+        :param row: A sequence of one field per column.
+        """
+        if len(row) != len(self.columns):
+            raise ValueError('Expected {} fields, got {}: {}'.format(len(self.columns), len(row), row))
+        self._block.append(self.separator.join([str(field) for field in row]))
+        if self._values is not None:
+            for values, field in zip(self._values, row):
+                values.append(field)
+        if len(self._block) >= self.block_rows:
+            self.flush()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def flush(self):
+        if self._block:
+            self.file.write('\n'.join(self._block) + '\n')
+            self._block = []
+        self.file.flush()
+
+    def close(self):
+        """
+        Write out any buffered rows and save the columns.
+        """
+        self.flush()
+        if self._values is None:
+            return
+        os.makedirs(self.column_dir, exist_ok=True)
+        for column, values in zip(self.columns, self._values):
+            np.save(os.path.join(self.column_dir, column + '.npy'), column_array(values))
+        with open(os.path.join(self.column_dir, 'columns.txt'), 'w') as f:
+            for column in self.columns:
+                f.write(column + '\n')
+        self._values = None
+
+
+def column_array(values):
+    """
+    :return: The values as an int64 array if they are all ints, a float64 array if they are all numbers, or else an
+    array of their strings.
+    """
+    if all([isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in values]):
+        return np.array(values, dtype=np.int64)
+    if all([isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+            for value in values]):
+        return np.array(values, dtype=np.float64)
+    return np.array([str(value) for value in values], dtype=np.str_)
+
+
+def load_columns(column_dir, mmap_mode='r'):
+    """
+    :param column_dir: A directory written by ColumnWriter.
+    :param mmap_mode: Passed to np.load; None reads the arrays into memory.
+    :return: A {column: array} dictionary, in column order.
+    """
+    with open(os.path.join(column_dir, 'columns.txt')) as f:
+        columns = [line.rstrip('\n') for line in f]
+    return {column: np.load(os.path.join(column_dir, column + '.npy'), mmap_mode=mmap_mode) for column in columns}
@@ -0,0 +1,135 @@
+import numpy as np
+
+from retrieval.feedback import relevance_model
+from retrieval.scoring import DirichletTermScorer
+
+
+FEATURES = ('rm1_clarity', 'wig', 'nqc', 'avg_idf', 'scs', 'avg_scq')
+
+
+class QPPEngine(object):
+    """
+    Query performance predictors for many queries at once:
+
+        rm1_clarity     clarity of the RM1 model of the top results against the collection
+        wig             weighted information gain of the top results
+        nqc             normalized query commitment: the deviation of the top scores over the query's collection score
+        avg_idf         mean IDF of the query terms
+        scs             simplified clarity score of the query
+        avg_scq         mean collection query similarity of the query terms
+
+    Each query is run once, and its top results are shared by the post-retrieval features. Term IDs, collection counts
+    and document frequencies are looked up once per term and kept, and the pre-retrieval features are computed over
+    the terms of every query at once. Features follow the per-query definitions they replace, including their
+    handling of terms missing from the index: those add nothing to avg_idf and scs, and count as occurring in no
+    documents for avg_scq. A query with no terms, which the per-query functions failed on, gets 0.0 for every feature.
+    """
+    def __init__(self, index, stopper=None, num_results=10, num_rm1_terms=20, scorer=None):
+        """
+        :param index: An IndexWrapper object.
+        :param stopper: A Stopper whose words are left out of RM1.
+        :param num_results: How many top results the post-retrieval features use.
+        :param num_rm1_terms: The number of terms in the RM1 model.
+        :param scorer: The DirichletTermScorer for wig, by default one with Indri's parameters.
+        """
+        self.index = index
+        self.stopper = stopper
+        self.num_results = num_results
+        self.num_rm1_terms = num_rm1_terms
+        self.scorer = DirichletTermScorer(index) if scorer is None else scorer
+        self._terms = {}
+
+    def term_statistics(self, terms):
+        """
+        :param terms: A sequence of term strings.
+        :return: Parallel arrays of the terms' IDs (0 if missing from the index), collection counts and document
+        frequencies.
+        """
+        for term in terms:
+            if term not in self._terms:
+                term_id = self.index.term_id(term)
+                self._terms[term] = (term_id, self.index.term_count(term),
+                                     self.index.term_document_frequency(term) if term_id > 0 else 0)
+        statistics = np.array([self._terms[term] for term in terms], dtype=np.int64).reshape(len(terms), 3)
+        return statistics[:, 0], statistics[:, 1], statistics[:, 2]
+
+    def features(self, queries):
+        """
+        :param queries: A sequence of Query objects.
+        :return: A {feature: array} dictionary of each feature's values, in the order of queries.
+        """
+        features = self.pre_retrieval_features(queries)
+        results = self.index.query_batch(queries, count=self.num_results)
+        features['rm1_clarity'] = np.array([self.rm1_clarity(query_results) for query_results in results])
+        features['wig'] = np.array([self.wig(query, query_results) for query, query_results in zip(queries, results)])
+        features['nqc'] = self.nqc(features.pop('collection_score'), results)
+        return {feature: features[feature] for feature in FEATURES}
+
+    def rows(self, queries):
+        """
+        :return: A list of (title, rm1_clarity, wig, nqc, avg_idf, scs, avg_scq) tuples, one per query.
+        """
+        features = self.features(queries)
+        return list(zip([query.title for query in queries], *[features[feature].tolist() for feature in FEATURES]))
+
+    def pre_retrieval_features(self, queries):
+        """
+        :return: A {feature: array} dictionary of avg_idf, scs and avg_scq, and the collection score nqc divides by.
+        """
+        terms = [term for query in queries for term in query.vector]
+        weights = np.array([weight for query in queries for weight in query.vector.values()], dtype=np.float64)
+        num_terms = np.array([len(query.vector) for query in queries], dtype=np.int64)
+        rows = np.repeat(np.arange(len(queries)), num_terms)
+        lengths = np.array([query.length() for query in queries], dtype=np.float64)
+
+        term_ids, term_counts, document_frequencies = self.term_statistics(terms)
+        total_terms = self.index.total_terms()
+        total_docs = self.index.total_docs()
+        in_index = term_ids > 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            query_probs = weights / lengths[rows]
+            collection_probs = term_counts / total_terms
+            scs = np.where(term_counts > 0, query_probs * np.log(query_probs / collection_probs), 0.0)
+            idf = np.where(in_index & (document_frequencies > 0), np.log(total_docs / document_frequencies), 0.0)
+            scq = (1 + np.log(term_counts + 1)) * np.log(total_docs / np.where(in_index, document_frequencies + 1, 1))
+            collection_scores = query_probs * np.log(collection_probs + 0.001)
+
+            return {'avg_idf': np.where(num_terms > 0, np.bincount(rows, idf, minlength=len(queries)) / num_terms, 0.0),
+                    'scs': np.bincount(rows, scs, minlength=len(queries)),
+                    'avg_scq': np.where(num_terms > 0, np.bincount(rows, scq, minlength=len(queries)) / num_terms, 0.0),
+                    'collection_score': np.bincount(rows, collection_scores, minlength=len(queries))}
+
+    def rm1_clarity(self, results):
+        """
+        :param results: A query's top results, as returned by IndexWrapper.query.
+        """
+        vocab, term_scores = relevance_model(results, self.index, stopper=self.stopper)
+        top = np.argsort(-term_scores, kind='stable')[:self.num_rm1_terms]
+        term_probs = term_scores[top]
+        if term_probs.sum() == 0:
+            return 0.0
+        term_probs = term_probs / term_probs.sum()
+        collection_probs = (self.index.term_counts(vocab[top]) + 1) / self.index.total_terms()
+        return float(np.sum(term_probs * np.log(term_probs / collection_probs)))
+
+    def wig(self, query, results):
+        if not results:
+            return 0.0
+        terms = list(query.vector)
+        _, term_counts, _ = self.term_statistics(terms)
+        doc_probs = self.scorer.score_batch(terms, [doc for doc, _ in results])
+        collection_probs = (term_counts + 1) / self.index.total_terms()
+        return float(np.sum(np.log(doc_probs / collection_probs)) / np.sqrt(query.length()) / len(results))
+
+    def nqc(self, collection_scores, results):
+        """
+        :param collection_scores: Each query's collection score, from pre_retrieval_features.
+        :param results: Each query's top results.
+        """
+        nqc = np.zeros(len(results))
+        for i, query_results in enumerate(results):
+            if query_results:
+                scores = np.array([score for _, score in query_results])
+                nqc[i] = np.sqrt(np.mean((scores - scores.mean()) ** 2)) / collection_scores[i]
+        return nqc
@@ -0,0 +1,79 @@
+import concurrent.futures
+import itertools
+
+
+class ShardedRunner(object):
+    """
+    Run a script's work over many units (docnos, (user, docno) pairs, queries) on a pool of local processes.
+
+    The units are cut into contiguous shards, several per worker so that uneven shards even out. Each worker process
+    calls setup once to open its indexes and load its inputs, then runs work on one shard after another. Results come
+    back in the order of the units, whatever order the shards finish in, so the merged output is the same for any
+    number of workers.
+
+        runner = ShardedRunner(functools.partial(Metrics, args), Metrics.shard_lines, workers=args.workers)
+        for lines in runner.run(docnos):
+            ...
+
+    setup and work must be picklable: module-level functions, classes, methods of module-level classes, or
+    functools.partial objects over them.
+    """
+    def __init__(self, setup, work, workers=1, shards_per_worker=4):
+        """
+        :param setup: A callable returning the state shared by every unit of a worker, such as open indexes.
+        :param work: A callable taking (state, shard), where shard is a list of units, and returning a list of one
+        result per unit.
+        :param workers: Number of processes. With 1, everything runs in this process.
+        :param shards_per_worker: How many shards to cut the units into for each worker.
+        """
+        self.setup = setup
+        self.work = work
+        self.workers = workers
+        self.shards_per_worker = shards_per_worker
+
+    def shards(self, units):
+        """
+        :return: The units cut into up to workers * shards_per_worker contiguous lists of near-equal length.
+        """
+        num_shards = max(1, min(len(units), self.workers * self.shards_per_worker))
+        size, extra = divmod(len(units), num_shards)
+        shards = []
+        start = 0
+        for i in range(num_shards):
+            end = start + size + (1 if i < extra else 0)
+            shards.append(units[start:end])
+            start = end
+        return shards
+
+    def run(self, units):
+        """
+        :param units: A sequence of picklable work units.
+        :return: A generator of the result for each unit, in the order of units.
+        """
+        units = list(units)
+        if not units:
+            return
+
+        if self.workers <= 1:
+            state = self.setup()
+            for result in self.work(state, units):
+                yield result
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_set_up_worker,
+                                                    initargs=(self.setup,)) as pool:
+            for results in pool.map(_run_worker_shard, itertools.repeat(self.work), self.shards(units)):
+                for result in results:
+                    yield result
+
+
+_worker_state = None
+
+
+def _set_up_worker(setup):
+    global _worker_state
+    _worker_state = setup()
+
+
+def _run_worker_shard(work, shard):
+    return list(work(_worker_state, shard))
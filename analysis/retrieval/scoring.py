@@ -1,22 +1,168 @@
+import collections
 import math
-from functools import lru_cache
+
+import numpy as np
+import scipy.sparse
+
+from retrieval.cache import LRUCache
+from retrieval.vectors import TermVector
+
+
+def score_entry_size(score):
+    """
+    Rough size in bytes of one (term_id, doc_id) -> score entry of a TermScoreCache, including its key.
+    """
+    return 160
+
+
+class TermScoreCache(object):
+    def __init__(self, max_bytes=2**24):
+        """
+        What a DirichletTermScorer would otherwise look up again and again: each term's ID and collection probability,
+        each document's length, and single (term, document) scores. Term and document entries are a few numbers each
+        and are kept for the life of the scorer. Scores are keyed on (term_id, doc_id) and kept in an LRUCache, except
+        those of terms missing from the index: they all have ID 0 but not the same collection probability.
+        :param max_bytes: The memory budget for scores.
+        """
+        self.terms = {}
+        self.doc_lengths = {}
+        self.scores = LRUCache(max_bytes=max_bytes, sizeof=score_entry_size)
+        self.term_hits = 0
+        self.term_misses = 0
+
+    def clear(self):
+        self.terms.clear()
+        self.doc_lengths.clear()
+        self.scores.clear()
+
+    def stats(self):
+        """
+        :return: The score store's LRUCache statistics, along with the number of terms and documents held and the
+        term hit rate.
+        """
+        stats = self.scores.stats()
+        term_lookups = self.term_hits + self.term_misses
+        stats.update({'terms': len(self.terms), 'documents': len(self.doc_lengths), 'term_hits': self.term_hits,
+                      'term_misses': self.term_misses,
+                      'term_hit_rate': self.term_hits / term_lookups if term_lookups else 0.0})
+        return stats
 
 
 class DirichletTermScorer(object):
-    def __init__(self, index, mu=2500, epsilon=1.0):
+    def __init__(self, index, mu=2500, epsilon=1.0, cache_bytes=2**24):
+        """
+        :param index: An IndexWrapper object.
+        :param cache_bytes: The memory budget for single (term, document) scores kept by score().
+        """
         self.index = index
         self.mu = mu
         self.epsilon = epsilon
+        self.cache = TermScoreCache(max_bytes=cache_bytes)
+
+    def term_statistics(self, terms):
+        """
+        :param terms: A sequence of lowercase term strings.
+        :return: Parallel arrays of the terms' IDs and collection probabilities. Each term is looked up in the index
+        once per scorer.
+        """
+        statistics = [self._term_statistics(term) for term in terms]
+        return (np.array([term_id for term_id, _ in statistics], dtype=np.int64),
+                np.array([collection_prob for _, collection_prob in statistics], dtype=np.float64))
+
+    def _term_statistics(self, term):
+        try:
+            statistics = self.cache.terms[term]
+            self.cache.term_hits += 1
+        except KeyError:
+            self.cache.term_misses += 1
+            statistics = self.cache.terms[term] = (self.index.term_id(term), (
+                self.epsilon + self.index.term_count(term)) / self.index.total_terms())
+        return statistics
+
+    def document_length(self, document):
+        try:
+            return self.cache.doc_lengths[document.doc_id]
+        except KeyError:
+            length = self.cache.doc_lengths[document.doc_id] = document.term_vector().length
+        return length
+
+    def _smoothed(self, term_freqs, collection_probs, doc_lengths):
+        """
+        The Dirichlet-smoothed probability of terms in documents, for numbers or for arrays that broadcast together.
+        """
+        return (term_freqs + self.mu * collection_probs) / (doc_lengths + self.mu)
 
-    @lru_cache(maxsize=2**5)
     def score(self, term, document):
-        term = term.lower()
+        term_id, collection_prob = self._term_statistics(term.lower())
+        # Terms missing from the index all have ID 0, so their scores are not cached
+        if term_id == 0:
+            return self._smoothed(0, collection_prob, self.document_length(document))
+        key = (term_id, document.doc_id)
+        score = self.cache.scores.get(key)
+        if score is None:
+            score = self._smoothed(document.term_vector().count(term_id), collection_prob,
+                                   self.document_length(document))
+            self.cache.scores.put(key, score)
+        return score
 
-        doc_vector = document.document_vector()
-        term_freq = doc_vector[term]
-        doc_length = sum(doc_vector.values())
-        collection_prob = (self.epsilon + self.index.term_count(term)) / self.index.total_terms()
-        return (term_freq + self.mu * collection_prob) / (doc_length + self.mu)
+    def score_batch(self, vocab, documents, sparse=False):
+        """
+        Score every term of a vocabulary against every document in one pass.
+        :param vocab: A sequence of term strings, or an integer array of term IDs from the scorer's index; these become
+        the columns of the result.
+        :param documents: A sequence of Document objects; these become the rows of the result.
+        :param sparse: If True, return a scipy.sparse CSR matrix. This only saves anything when mu is 0, since
+        smoothing otherwise gives every cell some probability mass.
+        :return: A len(documents) x len(vocab) matrix of smoothed term probabilities.
+        """
+        if isinstance(vocab, np.ndarray) and vocab.dtype.kind in 'iu':
+            term_ids = vocab
+            # Without smoothing the collection probabilities drop out, so skip looking up the term counts
+            if self.mu == 0:
+                collection_probs = np.zeros(len(term_ids))
+            else:
+                collection_probs = (self.epsilon + self.index.term_counts(term_ids)) / self.index.total_terms()
+        else:
+            term_ids, collection_probs = self.term_statistics([term.lower() for term in vocab])
+
+        term_freqs, doc_lengths = term_frequency_matrix(term_ids, [document.term_vector() for document in documents])
+
+        if sparse and self.mu == 0:
+            row_lengths = doc_lengths[np.repeat(np.arange(len(documents)), np.diff(term_freqs.indptr))]
+            term_freqs.data = self._smoothed(term_freqs.data, 0.0, row_lengths)
+            return term_freqs
+
+        scores = self._smoothed(term_freqs.toarray(), collection_probs, doc_lengths[:, np.newaxis])
+        if sparse:
+            return scipy.sparse.csr_matrix(scores)
+        return scores
+
+
+def term_frequency_matrix(term_ids, term_vectors):
+    """
+    :param term_ids: An integer array of term IDs; these become the columns of the result.
+    :param term_vectors: A sequence of TermVector objects; these become the rows of the result.
+    :return: A sparse len(term_vectors) x len(term_ids) CSR matrix of term counts, and an array of vector lengths.
+    """
+    vocab, columns = np.unique(np.asarray(term_ids, dtype=np.int64), return_inverse=True)
+
+    rows, cols, freqs = [], [], []
+    lengths = np.zeros(len(term_vectors))
+    for i, term_vector in enumerate(term_vectors):
+        lengths[i] = term_vector.length
+        if len(vocab) == 0:
+            continue
+        positions = np.minimum(np.searchsorted(vocab, term_vector.term_ids), len(vocab) - 1)
+        matched = vocab[positions] == term_vector.term_ids
+        rows.append(np.full(np.count_nonzero(matched), i))
+        cols.append(positions[matched])
+        freqs.append(term_vector.counts[matched])
+
+    if rows:
+        rows, cols, freqs = np.concatenate(rows), np.concatenate(cols), np.concatenate(freqs)
+    term_freqs = scipy.sparse.csr_matrix((np.asarray(freqs, dtype=np.float64), (rows, cols)),
+                                         shape=(len(term_vectors), len(vocab)))
+    return term_freqs[:, columns], lengths
 
 
 class InterpolatedTermScorer(object):
@@ -35,17 +181,71 @@ class InterpolatedTermScorer(object):
     def score(self, term, document):
         return sum([self.weights[i] * self.scorers[i].score(term, document) for i in range(len(self.scorers))])
 
+    def score_batch(self, vocab, documents):
+        """
+        :param vocab: A sequence of term strings. Term IDs are not accepted, since the scorers may use different
+        indexes.
+        :return: A len(documents) x len(vocab) matrix of interpolated term probabilities.
+        """
+        vocab = list(vocab)
+        return sum([self.weights[i] * self.scorers[i].score_batch(vocab, documents) for i in range(len(self.scorers))])
+
+
+class ExpansionLanguageModel(object):
+    def __init__(self, scorer, expansion_docs):
+        """
+        The mixture of expansion document language models for one document, materialized over the expansion
+        vocabulary so that scoring a term is a lookup.
+        :param scorer: A scorer with a score_batch method, associated with the expansion index.
+        :param expansion_docs: A list of (document, weight) tuples. The weights should sum to 1.
+        """
+        self._scorer = scorer
+        self.documents = [doc for doc, _ in expansion_docs]
+        self.weights = np.array([weight for _, weight in expansion_docs])
+
+        vocab = build_vocab(*[doc.term_vector() for doc in self.documents])
+        if len(vocab):
+            term_scores = self.weights @ scorer.score_batch(vocab, self.documents)
+            self.probabilities = dict(zip([scorer.index.term(term_id) for term_id in vocab.tolist()],
+                                          term_scores.tolist()))
+        else:
+            self.probabilities = {}
+
+    def score(self, term):
+        return self.score_batch([term])[0]
+
+    def score_batch(self, vocab):
+        """
+        :param vocab: A sequence of term strings.
+        :return: An array of term probabilities. Terms outside the expansion vocabulary are scored once, then kept.
+        """
+        vocab = [term.lower() for term in vocab]
+        missing = list(collections.OrderedDict.fromkeys([term for term in vocab if term not in self.probabilities]))
+        if missing:
+            term_scores = self.weights @ self._scorer.score_batch(missing, self.documents)
+            self.probabilities.update(zip(missing, term_scores.tolist()))
+        return np.array([self.probabilities[term] for term in vocab])
+
 
 class ExpansionDocTermScorer(object):
     def __init__(self, scorer, stopper=None, num_docs=10, num_terms=20):
         """
-        :param scorer: Should be a scorer that is associated with the expansion index.
+        :param scorer: Should be a scorer that is associated with the expansion index. It must have a score_batch
+        method. Share one scorer between ExpansionDocTermScorers to share their expansion models.
         """
         self._scorer = scorer
         self._stopper = stopper
         self._num_docs = num_docs
         self._num_terms = num_terms
 
+    def expansion_model(self, document):
+        """
+        :param document: An ExpandableDocument object.
+        :return: The document's ExpansionLanguageModel, built on first use and kept by the document.
+        """
+        return document.expansion_model(self._scorer, stopper=self._stopper, num_docs=self._num_docs,
+                                        num_terms=self._num_terms)
+
     def score(self, term, document):
         """
         :param term: The term string.
@@ -53,15 +253,17 @@ class ExpansionDocTermScorer(object):
         associated document.
         :return: The term score.
         """
-        # First, normalize the document scores, in case it hasn't already been done
-        expansion_docs = document.expansion_docs(document.pseudo_query(stopper=self._stopper,
-                                                                       num_terms=self._num_terms),
-                                                 num_docs=self._num_docs)
-        k = expansion_docs[0][1]
-        total = sum([math.exp(score-k) for _, score in expansion_docs])
-        expansion_docs = [(doc, math.exp(score-k) / total) for doc, score in expansion_docs]
+        return float(self.expansion_model(document).score(term))
 
-        return sum([exp_score * self._scorer.score(term, exp_doc) for exp_doc, exp_score in expansion_docs])
+    def score_batch(self, vocab, documents):
+        """
+        :param vocab: A sequence of term strings.
+        :param documents: A sequence of ExpandableDocument objects.
+        :return: A len(documents) x len(vocab) matrix of expansion term probabilities.
+        """
+        vocab = list(vocab)
+        return np.array([self.expansion_model(document).score_batch(vocab) for document in documents]).reshape(
+            len(documents), len(vocab))
 
 
 class QLQueryScorer(object):
@@ -70,20 +272,67 @@ class QLQueryScorer(object):
 
     def score(self, query, document):
         score = 0.0
+        query_length = query.length()
         for term in query.vector:
-            q_weight = query.vector[term] / query.length()
+            q_weight = query.vector[term] / query_length
             term_score = math.log(self.term_scorer.score(term, document))
             score += q_weight * term_score
         return score
 
+    def score_matrix(self, queries, documents):
+        """
+        Score many queries against many documents, scoring each query term against each document only once.
+        :param queries: A sequence of Query objects.
+        :param documents: A sequence of Document objects.
+        :return: A len(queries) x len(documents) array of query log-likelihoods. The term scorer must have a
+        score_batch method.
+        """
+        vocab = list(collections.OrderedDict.fromkeys([term for query in queries for term in query.vector]))
+        columns = {term: j for j, term in enumerate(vocab)}
+
+        query_weights = np.zeros((len(queries), len(vocab)))
+        for i, query in enumerate(queries):
+            query_length = query.length()
+            for term, weight in query.vector.items():
+                query_weights[i, columns[term]] = weight / query_length
+
+        if not vocab:
+            return np.zeros((len(queries), len(documents)))
+        term_scores = np.log(self.term_scorer.score_batch(vocab, documents))
+        return query_weights @ term_scores.T
+
 
 def build_vocab(*vectors):
+    """
+    :return: The set of terms in any of the vectors, or a sorted array of term IDs if they are all TermVectors. With
+    no vectors at all, an empty array of term IDs, which score_batch accepts as an empty vocabulary.
+    """
+    if not vectors:
+        return np.zeros(0, dtype=np.int32)
+    if all([isinstance(vector, TermVector) for vector in vectors]):
+        return np.unique(np.concatenate([vector.term_ids for vector in vectors]))
+
     vocab = set()
     for vector in vectors:
         vocab = vocab | vector.keys()
     return vocab
 
 
+def pseudo_document(results, scorer):
+    """
+    The mixture of the language models of a query's results, each weighted by its share of the total score.
+    :param results: A list of (document, score) tuples, as returned by IndexWrapper.query.
+    :param scorer: A scorer with a score_batch method, associated with the results' index.
+    :return: A {term_id: probability} dictionary over the terms of every result.
+    """
+    total = sum([score for _, score in results])
+    weights = np.array([score / total for _, score in results])
+    documents = [doc for doc, _ in results]
+    vocab = build_vocab(*[doc.term_vector() for doc in documents])
+    term_scores = weights @ scorer.score_batch(vocab, documents)
+    return dict(zip(vocab.tolist(), term_scores.tolist()))
+
+
 def recall(returned, expected):
     return len(returned & expected) / len(expected)
 
@@ -92,7 +341,23 @@ def precision(returned, expected):
     return len(returned & expected) / len(returned)
 
 
+def shared_counts(vector1, vector2):
+    """
+    :return: The counts of the terms two TermVectors share, as a pair of aligned arrays.
+    """
+    _, indices1, indices2 = np.intersect1d(vector1.term_ids, vector2.term_ids, assume_unique=True,
+                                           return_indices=True)
+    return vector1.counts[indices1].astype(np.float64), vector2.counts[indices2].astype(np.float64)
+
+
 def jaccard_similarity(set1, set2):
+    if isinstance(set1, TermVector) and isinstance(set2, TermVector):
+        shared = len(shared_counts(set1, set2)[0])
+        try:
+            return shared / (len(set1) + len(set2) - shared)
+        except ZeroDivisionError:
+            return 0.0
+
     try:
         return len(set1 & set2) / len(set1 | set2)
     except ZeroDivisionError:
@@ -100,6 +365,14 @@ def jaccard_similarity(set1, set2):
 
 
 def kl_divergence(vector1, vector2):
+    if isinstance(vector1, TermVector) and isinstance(vector2, TermVector):
+        if vector1.length == 0 or vector2.length == 0:
+            return 0.0
+        p_terms, q_terms = shared_counts(vector1, vector2)
+        p_terms /= vector1.length
+        q_terms /= vector2.length
+        return float(np.sum(p_terms * np.log(p_terms / q_terms)))
+
     vector1_length = sum(vector1.values())
     vector2_length = sum(vector2.values())
 
@@ -134,12 +407,20 @@ def clarity(vector, index):
 
 
 def cosine_similarity(vector1, vector2):
+    if isinstance(vector1, TermVector) and isinstance(vector2, TermVector):
+        counts1, counts2 = shared_counts(vector1, vector2)
+        denom = np.linalg.norm(vector1.counts.astype(np.float64)) * np.linalg.norm(vector2.counts.astype(np.float64))
+        if denom == 0:
+            return 0.0
+        return float(np.dot(counts1, counts2) / denom)
+
     vector1_length = sum(vector1.values())
     vector2_length = sum(vector2.values())
 
     num = 0.0
-    for term in vector1.keys() & vector2.keys():  # use intersection to avoid terms missing in either, they add nothing
-        num += vector1[term] / vector1_length * vector2[term] / vector2_length
+    for term in vector1:  # skip terms missing in either, they add nothing; vector1's order keeps the sum deterministic
+        if term in vector2:
+            num += vector1[term] / vector1_length * vector2[term] / vector2_length
 
     denom1 = math.sqrt(sum([(x / vector1_length)**2 for x in vector1.values()]))
     denom2 = math.sqrt(sum([(x / vector2_length)**2 for x in vector2.values()]))
@@ -0,0 +1,111 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+def index_fingerprint(index, dictionary=None, chunk_size=2**16):
+    """
+    :param index: A pyndri.Index object.
+    :param dictionary: The index's get_dictionary() result, if already at hand, since it is slow to get.
+    :param chunk_size: How many terms to hash at a time. The hash is fed in chunks so that memory stays flat.
+    :return: A hex string identifying the index by its totals and its dictionary of terms, term IDs and document
+    frequencies, so that it changes when the index is rebuilt from different documents, even at the same path.
+    """
+    _, id2token, id2df = dictionary if dictionary is not None else index.get_dictionary()
+    digest = hashlib.sha1('{}:{}\n'.format(index.document_count(), index.total_terms()).encode('utf-8'))
+    term_ids = np.fromiter(id2token, dtype=np.int64, count=len(id2token))
+    term_ids.sort()
+    for start in range(0, len(term_ids), chunk_size):
+        chunk = term_ids[start:start+chunk_size]
+        digest.update(chunk.tobytes())
+        chunk = chunk.tolist()
+        digest.update(np.fromiter(map(id2df.__getitem__, chunk), dtype=np.int64, count=len(chunk)).tobytes())
+        digest.update('\n'.join(map(id2token.__getitem__, chunk)).encode('utf-8') + b'\n')
+    return digest.hexdigest()
+
+
+def index_identity(index, dictionary=None, path=None):
+    """
+    :param index: A pyndri.Index object.
+    :param dictionary: The index's get_dictionary() result, if already at hand, since it is slow to get.
+    :param path: The path the index was opened from, if known.
+    :return: A string identifying the index by its totals, its number of terms and the modification time of the file
+    at path, or of the manifest of an Indri repository there. Unlike index_fingerprint it does not walk the
+    dictionary, so it is cheap enough to check on every load.
+    """
+    token2id = dictionary[0] if dictionary is not None else index.get_dictionary()[0]
+    modified = ''
+    if path is not None:
+        manifest = os.path.join(path, 'manifest')
+        modified = os.stat(manifest if os.path.isfile(manifest) else path).st_mtime_ns
+    return '{}:{}:{}:{}'.format(index.document_count(), index.total_terms(), len(token2id), modified)
+
+
+class CollectionStatistics(object):
+    """
+    Collection term frequency and document frequency for every term in an index, as arrays indexed by term ID, along
+    with the collection totals and the fingerprint and identity of the index they were counted from.
+    """
+    def __init__(self, term_counts, document_frequencies, total_terms, total_docs, fingerprint=None, identity=None):
+        self.term_counts = term_counts
+        self.document_frequencies = document_frequencies
+        self.total_terms = total_terms
+        self.total_docs = total_docs
+        self.fingerprint = fingerprint
+        self.identity = identity
+
+    @classmethod
+    def build(cls, index, dictionary=None, path=None):
+        """
+        :param index: A pyndri.Index object. Every term in its dictionary is counted once, so this is slow for large
+        collections; save the result.
+        :param dictionary: The index's get_dictionary() result, if already at hand.
+        :param path: The path the index was opened from, if known, for its identity.
+        """
+        dictionary = dictionary if dictionary is not None else index.get_dictionary()
+        _, id2token, id2df = dictionary
+        size = max(id2token, default=0) + 1
+        term_counts = np.zeros(size, dtype=np.int64)
+        document_frequencies = np.zeros(size, dtype=np.int64)
+        for term_id, term in id2token.items():
+            term_counts[term_id] = index.term_count(term)
+            document_frequencies[term_id] = id2df[term_id]
+        return cls(term_counts, document_frequencies, index.total_terms(), index.document_count(),
+                   fingerprint=index_fingerprint(index, dictionary), identity=index_identity(index, dictionary, path))
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as data:
+            # Files saved before identities were kept have none, and are never taken to match an index
+            fingerprint = str(data['fingerprint']) or None if 'fingerprint' in data else None
+            identity = str(data['identity']) or None if 'identity' in data else None
+            return cls(data['term_counts'], data['document_frequencies'], int(data['total_terms']),
+                       int(data['total_docs']), fingerprint=fingerprint, identity=identity)
+
+    @classmethod
+    def for_index(cls, index, file_name=None, dictionary=None, path=None):
+        """
+        Load the statistics saved in file_name, or build and save them if the file is missing or was built from a
+        different index: one whose identity differs. Only building computes the full fingerprint.
+        :param index: A pyndri.Index object.
+        :param dictionary: The index's get_dictionary() result, if already at hand.
+        :param path: The path the index was opened from, if known. Without one, an index rebuilt with the same totals
+        and number of terms is not told apart from the old one.
+        """
+        dictionary = dictionary if dictionary is not None else index.get_dictionary()
+        if file_name and os.path.exists(file_name):
+            stats = cls.load(file_name)
+            if stats.identity == index_identity(index, dictionary, path):
+                return stats
+        stats = cls.build(index, dictionary, path)
+        if file_name:
+            stats.save(file_name)
+        return stats
+
+    def save(self, file_name):
+        with open(file_name, 'wb') as f:
+            np.savez(f, term_counts=self.term_counts, document_frequencies=self.document_frequencies,
+                     total_terms=self.total_terms, total_docs=self.total_docs,
+                     fingerprint=self.fingerprint if self.fingerprint is not None else '',
+                     identity=self.identity if self.identity is not None else '')
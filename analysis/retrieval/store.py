@@ -0,0 +1,128 @@
+import collections
+import os
+
+import numpy as np
+
+from retrieval.vectors import first_occurrence_counts
+
+
+class DocumentVectorStore(object):
+    """
+    Document vectors stored as CSR arrays: the terms of document i are term_ids[offsets[i]:offsets[i+1]], with the
+    matching entries of counts. Term IDs index into terms, where ID 0 is unused, as in Indri. Saved stores are opened
+    with numpy.memmap, so worker processes share the same pages rather than copies.
+    """
+    def __init__(self, docnos, terms, offsets, term_ids, counts, path=None):
+        self.docnos = list(docnos)
+        self.terms = list(terms)
+        self.offsets = offsets
+        self.term_ids = term_ids
+        self.counts = counts
+        self.path = path
+        self._rows = {docno: i for i, docno in enumerate(self.docnos)}
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, 'docnos.txt')) as f:
+            docnos = [line.rstrip('\n') for line in f]
+        with open(os.path.join(path, 'terms.txt')) as f:
+            terms = [line.rstrip('\n') for line in f]
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in
+                  ('offsets', 'term_ids', 'counts')]
+        return cls(docnos, terms, *arrays, path=path)
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        """
+        :param vectors: An iterable of (docno, vector) pairs, where each vector is a {term: count} dictionary.
+        """
+        term_ids = {}
+        terms = ['']
+        docnos = []
+        offsets = [0]
+        ids = []
+        counts = []
+        for docno, vector in vectors:
+            for term, count in vector.items():
+                if term not in term_ids:
+                    term_ids[term] = len(terms)
+                    terms.append(term)
+                ids.append(term_ids[term])
+                counts.append(count)
+            docnos.append(docno)
+            offsets.append(len(ids))
+        return cls(docnos, terms, np.array(offsets, dtype=np.int64), np.array(ids, dtype=np.int32),
+                   np.array(counts, dtype=np.int32))
+
+    @classmethod
+    def from_csv(cls, file_name):
+        """
+        :param file_name: A docno,term,count file such as data/doc_vectors.csv, grouped by docno.
+        """
+        def read_vectors():
+            with open(file_name) as f:
+                docno = None
+                vector = collections.OrderedDict()
+                for line in f:
+                    row_docno, term, count = line.strip().split(',')
+                    if row_docno != docno:
+                        if docno is not None:
+                            yield docno, vector
+                        docno = row_docno
+                        vector = collections.OrderedDict()
+                    vector[term] = vector.get(term, 0) + int(count)
+                if docno is not None:
+                    yield docno, vector
+
+        return cls.from_vectors(read_vectors())
+
+    @classmethod
+    def from_index(cls, index, docnos):
+        """
+        :param index: An IndexWrapper object.
+        :param docnos: The documents to include. Documents missing from the index are skipped.
+        """
+        def read_vectors():
+            for docno, doc_id in index.index.document_ids(list(docnos)):
+                _, token_ids = index.index.document(doc_id)
+                term_ids, counts = first_occurrence_counts(token_ids)
+                yield docno, collections.OrderedDict((index.term(term_id), count) for term_id, count in
+                                                     zip(term_ids.tolist(), counts.tolist()))
+
+        return cls.from_vectors(read_vectors())
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'docnos.txt'), 'w') as f:
+            f.writelines(docno + '\n' for docno in self.docnos)
+        with open(os.path.join(path, 'terms.txt'), 'w') as f:
+            f.writelines(term + '\n' for term in self.terms)
+        for name, array in (('offsets', self.offsets), ('term_ids', self.term_ids), ('counts', self.counts)):
+            np.save(os.path.join(path, name + '.npy'), np.asarray(array))
+        self.path = path
+
+    def row(self, docno):
+        """
+        :return: Views of the term ID and count arrays for the document; no data is copied.
+        """
+        i = self._rows[docno]
+        start, end = self.offsets[i], self.offsets[i+1]
+        return self.term_ids[start:end], self.counts[start:end]
+
+    def document_vector(self, docno):
+        term_ids, counts = self.row(docno)
+        return collections.Counter({self.terms[term_id]: count for term_id, count in
+                                    zip(term_ids.tolist(), counts.tolist())})
+
+    def __contains__(self, docno):
+        return docno in self._rows
+
+    def __len__(self):
+        return len(self.docnos)
+
+    def __reduce__(self):
+        # Saved stores travel to worker processes by path and are mapped again there
+        if self.path is not None:
+            return self.open, (self.path,)
+        return self.__class__, (self.docnos, self.terms, np.asarray(self.offsets), np.asarray(self.term_ids),
+                                np.asarray(self.counts))
@@ -0,0 +1,94 @@
+import numpy as np
+
+from retrieval.core import Qrels, Query
+from retrieval.memindex import MemoryIndex
+from retrieval.store import DocumentVectorStore
+
+
+def zipf_probabilities(vocab_size, exponent=1.0):
+    """
+    :return: The probability of each of vocab_size term ranks under a Zipf distribution, most frequent first.
+    """
+    weights = 1.0 / np.arange(1, vocab_size + 1) ** exponent
+    return weights / weights.sum()
+
+
+class SyntheticCollection(object):
+    """
+    A random collection for exercising the retrieval package without a TREC index. Documents draw their tokens from a
+    Zipfian vocabulary and their lengths from a Poisson distribution, so term and document statistics are shaped like
+    those of real text. Everything is generated from the seed, so the same arguments always give the same collection.
+
+    Term IDs are frequency ranks: term1 is the most frequent term and has ID 1. The collection is served by a
+    MemoryIndex, so wrap it as you would a real index:
+
+        collection = SyntheticCollection(num_docs=10000)
+        index = IndexWrapper(collection.index, store=collection.store)
+    """
+    def __init__(self, num_docs=1000, vocab_size=10000, mean_length=200, exponent=1.0, seed=0):
+        """
+        :param num_docs: The number of documents.
+        :param vocab_size: The number of distinct terms that may occur.
+        :param mean_length: The mean number of tokens per document. Every document has at least one.
+        :param exponent: The Zipf exponent; larger values concentrate tokens on fewer terms.
+        :param seed: The random seed.
+        """
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        lengths = np.maximum(rng.poisson(mean_length, num_docs), 1)
+        tokens = rng.choice(vocab_size, size=int(lengths.sum()), p=zipf_probabilities(vocab_size, exponent)) + 1
+
+        # Count each (document, term) pair by sorting their combined keys
+        keys = np.repeat(np.arange(num_docs, dtype=np.int64), lengths) * (vocab_size + 1) + tokens
+        keys, counts = np.unique(keys, return_counts=True)
+        doc_rows, term_ids = np.divmod(keys, vocab_size + 1)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(doc_rows, minlength=num_docs))])
+
+        docnos = ['SYN-{:07d}'.format(i + 1) for i in range(num_docs)]
+        terms = [''] + ['term{}'.format(rank) for rank in range(1, vocab_size + 1)]
+        self.store = DocumentVectorStore(docnos, terms, offsets.astype(np.int64), term_ids.astype(np.int32),
+                                         counts.astype(np.int32))
+        self.index = MemoryIndex(self.store)
+
+    def stopwords(self, num_terms=50):
+        """
+        :return: The most frequent terms, to stand in for a stop list.
+        """
+        return self.store.terms[1:num_terms + 1]
+
+    def queries(self, num_queries=50, min_terms=2, max_terms=5, num_stopwords=50, seed=None):
+        """
+        Make queries that have matches: each takes a few distinct non-stop words from a random document.
+        :param seed: The random seed, by default the collection's.
+        :return: A list of Query objects titled 1 to num_queries.
+        """
+        rng = np.random.default_rng(self.seed if seed is None else seed)
+        queries = []
+        for i in range(num_queries):
+            row = int(rng.integers(len(self.store)))
+            term_ids = np.asarray(self.store.term_ids[self.store.offsets[row]:self.store.offsets[row + 1]])
+            term_ids = term_ids[term_ids > num_stopwords]
+            if len(term_ids) == 0:
+                term_ids = np.asarray(self.store.term_ids[self.store.offsets[row]:self.store.offsets[row + 1]])
+            num_terms = min(len(term_ids), int(rng.integers(min_terms, max_terms + 1)))
+            chosen = rng.choice(term_ids, size=num_terms, replace=False)
+            queries.append(Query(str(i + 1), vector={self.store.terms[term_id]: 1 for term_id in chosen.tolist()}))
+        return queries
+
+    def qrels(self, queries, depth=100, relevant_fraction=0.1, seed=None):
+        """
+        Judge a random part of each query's top results relevant, so that measures have something to find.
+        :param queries: Query objects from queries().
+        :param depth: How many results of each query may be judged.
+        :param relevant_fraction: The chance that each of those results is relevant.
+        :param seed: The random seed, by default the collection's.
+        :return: A Qrels object, with relevance 1 for relevant documents and 0 for the other judged ones.
+        """
+        rng = np.random.default_rng(self.seed if seed is None else seed)
+        judgments = {}
+        for query in queries:
+            results = self.index.query(str(query), results_requested=depth)
+            relevant = rng.random(len(results)) < relevant_fraction
+            judgments[query.title] = {self.index.ext_document_id(doc_id): int(is_relevant) for (doc_id, _), is_relevant
+                                      in zip(results, relevant.tolist())}
+        return Qrels.from_dict(judgments)
@@ -0,0 +1,72 @@
+import collections
+
+import numpy as np
+
+
+def first_occurrence_counts(token_ids):
+    """
+    Count token IDs, keeping them in order of first occurrence the way a Counter built from the tokens would.
+    :param token_ids: A sequence of token IDs. IDs below 1 (out of vocabulary or stopped) are dropped.
+    :return: Parallel arrays of term IDs and counts.
+    """
+    token_ids = np.asarray(token_ids, dtype=np.int64)
+    term_ids, first, counts = np.unique(token_ids[token_ids > 0], return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
+    return term_ids[order], counts[order]
+
+
+class TermVector(object):
+    """
+    A document vector held as parallel arrays of int32 term IDs and counts, in order of first occurrence, with its
+    length computed once. Term IDs belong to the index that produced the vector.
+    """
+    __slots__ = ('term_ids', 'counts', 'length')
+
+    def __init__(self, term_ids, counts):
+        self.term_ids = np.asarray(term_ids, dtype=np.int32)
+        self.counts = np.asarray(counts, dtype=np.int32)
+        self.length = int(self.counts.sum())
+
+    @classmethod
+    def from_tokens(cls, token_ids):
+        return cls(*first_occurrence_counts(token_ids))
+
+    def count(self, term_id):
+        matches = np.flatnonzero(self.term_ids == term_id)
+        return int(self.counts[matches[0]]) if len(matches) else 0
+
+    def select(self, mask):
+        return TermVector(self.term_ids[mask], self.counts[mask])
+
+    def top(self, num_terms):
+        """
+        The most frequent terms, in the order Counter.most_common would give them for the equivalent Counter: by
+        descending count, ties in order of first occurrence. Only the terms that can make the cut are sorted.
+        :return: A TermVector of at most num_terms terms, and none if num_terms is not positive.
+        """
+        if num_terms <= 0:
+            return TermVector([], [])
+        counts = self.counts
+        if num_terms < len(counts):
+            # Keep every term tied with the num_terms-th largest count, so ties still go to the earliest terms
+            threshold = np.partition(counts, len(counts) - num_terms)[len(counts) - num_terms]
+            candidates = np.flatnonzero(counts >= threshold)
+        else:
+            candidates = np.arange(len(counts))
+        order = candidates[np.argsort(-counts[candidates], kind='stable')[:num_terms]]
+        return TermVector(self.term_ids[order], counts[order])
+
+    def to_counter(self, index):
+        """
+        :param index: The IndexWrapper whose term IDs this vector uses.
+        :return: The equivalent {term: count} Counter.
+        """
+        return collections.Counter({index.term(term_id): count for term_id, count in
+                                    zip(self.term_ids.tolist(), self.counts.tolist())})
+
+    @property
+    def nbytes(self):
+        return self.term_ids.nbytes + self.counts.nbytes
+
+    def __len__(self):
+        return len(self.term_ids)
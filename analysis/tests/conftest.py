@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+# The scripts import the retrieval package from the analysis directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval.core import IndexWrapper  # noqa: E402
+from retrieval.synthetic import SyntheticCollection  # noqa: E402
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+ANALYSIS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX = os.path.join(DATA_DIR, 'doc_vectors.csv')
+PSEUDO_QUERIES = os.path.join(DATA_DIR, 'pseudo-queries', 'ap.pq')
+QRELS = os.path.join(DATA_DIR, 'qrels', 'qrels.ap')
+STOPLIST = os.path.join(DATA_DIR, 'stoplist.indri')
+TOPIC_TERMS = os.path.join(DATA_DIR, 'annotations', 'recorded_topic_terms.csv')
+TOPICS = os.path.join(DATA_DIR, 'topics', 'topics.ap.title.csv')
+STEM_TERMS = os.path.join(os.path.dirname(ANALYSIS_DIR), 'stem_terms.py')
+
+
+def run_script(script, *args, stdin=None, hash_seed='0'):
+    """
+    :param hash_seed: PYTHONHASHSEED for the script, which decides the iteration order of sets of strings.
+    :return: The script's standard output, as bytes.
+    """
+    env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+    return subprocess.run([sys.executable, script] + list(args), cwd=ANALYSIS_DIR, input=stdin, env=env,
+                          stdout=subprocess.PIPE, check=True).stdout
+
+
+@pytest.fixture(scope='session')
+def collection():
+    return SyntheticCollection(num_docs=300, vocab_size=3000, mean_length=80, seed=7)
+
+
+@pytest.fixture
+def index(collection):
+    return IndexWrapper(collection.index, store=collection.store)
+
+
+@pytest.fixture
+def results(collection, index):
+    """
+    The top 10 results of each of the collection's queries.
+    """
+    return [index.query(query, count=10) for query in collection.queries(20)]
@@ -0,0 +1,120 @@
+import collections
+import os
+
+import numpy as np
+import pytest
+
+from retrieval.core import BatchResults
+
+from conftest import DATA_DIR
+
+
+RUN_FILE = os.path.join(DATA_DIR, 'runs', 'ap_baseline')
+
+
+class ReferenceBatchResults(object):
+    """
+    BatchResults as it was before run files were held as columns.
+    """
+    def __init__(self, file):
+        self._scores = collections.defaultdict(dict)
+        self._docs = collections.defaultdict(list)
+        with open(file) as f:
+            for line in f:
+                query, _, docno, rank, score, run = line.strip().split()
+                self._scores[query][docno] = float(score)
+                self._docs[query].append(docno)
+
+    def query_results(self, query_title):
+        return self._docs[query_title]
+
+    def document_query_score(self, docno, query_title):
+        return self._scores[query_title][docno]
+
+
+@pytest.fixture(scope='module')
+def runs():
+    return BatchResults(RUN_FILE, cache_file=False), ReferenceBatchResults(RUN_FILE)
+
+
+def write_run(file_name, lines):
+    with open(file_name, 'w') as f:
+        f.write(''.join(line + '\n' for line in lines))
+    return file_name
+
+
+def test_results_match_reference(runs):
+    run, reference = runs
+    assert run.query_titles == list(reference._docs)
+    for query_title in run.query_titles:
+        assert run.query_results(query_title) == reference.query_results(query_title)
+    assert run.query_results('999') == []
+
+
+def test_scores_match_reference(runs):
+    run, reference = runs
+    for query_title in run.query_titles[::5]:
+        for docno, score in reference._scores[query_title].items():
+            assert run.document_query_score(docno, query_title) == score
+    with pytest.raises(KeyError):
+        run.document_query_score('AP000000-0000', run.query_titles[0])
+
+
+def test_top_k_matches_reference(runs):
+    run, reference = runs
+    query_titles = run.query_titles[:10] + ['999']
+    for k in [1, 10, 1500]:
+        doc_ids, scores, lengths = run.top_k(query_titles, k)
+        for i, query_title in enumerate(query_titles):
+            expected = reference._docs[query_title][:k]
+            assert lengths[i] == len(expected)
+            assert [run.docno(doc_id) for doc_id in doc_ids[i, :lengths[i]]] == expected
+            assert scores[i, :lengths[i]].tolist() == [reference._scores[query_title][docno] for docno in expected]
+            assert (doc_ids[i, lengths[i]:] == -1).all() and np.isnan(scores[i, lengths[i]:]).all()
+
+
+def test_docnos_are_sorted(runs):
+    run, _ = runs
+    assert (run.docnos[1:] > run.docnos[:-1]).all()
+
+
+def test_repeated_document_keeps_last_score(tmp_path):
+    run = BatchResults(write_run(str(tmp_path / 'run'), ['2 Q0 d2 1 -1.5 r', '1 Q0 d1 1 -2 r', '2 Q0 d1 2 -3 r',
+                                                         '2 Q0 d2 3 -4 r']))
+    assert run.query_titles == ['2', '1']
+    assert run.query_results('2') == ['d2', 'd1', 'd2']
+    assert run.document_query_score('d2', '2') == -4.0
+
+
+def test_cache_is_reused_until_the_run_changes(tmp_path):
+    file_name = write_run(str(tmp_path / 'run'), ['1 Q0 d1 1 -1.5 r', '1 Q0 d2 2 -2.5 r'])
+    assert BatchResults(file_name).query_results('1') == ['d1', 'd2']
+    assert os.path.exists(file_name + '.npz')
+    cached = BatchResults(file_name)
+    assert cached.query_results('1') == ['d1', 'd2'] and cached.document_query_score('d2', '1') == -2.5
+
+    write_run(file_name, ['1 Q0 d3 1 -1.5 r', '1 Q0 d2 2 -2.5 r', '2 Q0 d1 1 -0.5 r'])
+    changed = BatchResults(file_name)
+    assert changed.query_results('1') == ['d3', 'd2'] and changed.query_results('2') == ['d1']
+
+
+def test_malformed_lines_are_named(tmp_path):
+    file_name = write_run(str(tmp_path / 'run'), ['1 Q0 d1 1 -1.5 r', '', '1 Q0 d2 2 -2.5'])
+    with pytest.raises(ValueError, match='line 3: expected 6 fields, found 5'):
+        BatchResults(file_name)
+    assert not os.path.exists(file_name + '.npz')
+    file_name = write_run(str(tmp_path / 'run'), ['1 Q0 d1 1 -1.5 r', '1 Q0 d2 2 low r'])
+    with pytest.raises(ValueError, match='line 2: rank 2 or score low is not a number'):
+        BatchResults(file_name)
+
+
+def test_from_results_matches_parsed_run(tmp_path):
+    results = {'1': [('d2', -1.0), ('d1', -2.0)], '2': [], '3': [('d1', -0.5)]}
+    file_name = write_run(str(tmp_path / 'run'), ['{} Q0 {} {} {} r'.format(query_title, docno, rank + 1, score)
+                                                  for query_title in results
+                                                  for rank, (docno, score) in enumerate(results[query_title])])
+    built, parsed = BatchResults.from_results(results), BatchResults(file_name, cache_file=False)
+    assert built.query_titles == parsed.query_titles == ['1', '3']
+    np.testing.assert_array_equal(built.docnos, parsed.docnos)
+    for name in ['offsets', 'doc_ids', 'ranks', 'scores']:
+        np.testing.assert_array_equal(getattr(built, name), getattr(parsed, name))
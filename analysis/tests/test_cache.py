@@ -0,0 +1,127 @@
+import os
+import sqlite3
+
+import retrieval.core
+from retrieval.cache import LRUCache, QueryResultCache
+from retrieval.core import IndexWrapper
+from retrieval.memindex import MemoryIndex
+
+
+RESULTS = [(3, -1.5), (1, -2.25)]
+
+
+def last_used(file_name):
+    with sqlite3.connect(file_name) as connection:
+        return dict(connection.execute('SELECT query, last_used FROM query_results').fetchall())
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=3, sizeof=lambda value: 1)
+    for key in 'abc':
+        cache.put(key, key)
+    cache.get('a')
+    cache.put('d', 'd')
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['a', 'c', 'd']
+
+
+def test_entries_are_kept_per_fingerprint(tmp_path):
+    cache = QueryResultCache(str(tmp_path / 'cache.db'))
+    cache.bind('old')
+    cache.put('#combine( a )', 10, RESULTS)
+    assert cache.get('#combine( a )', 10) == RESULTS
+    assert cache.get('#combine( a )', 20) is None
+    cache.bind('new')
+    assert cache.get('#combine( a )', 10) is None
+
+
+def test_rebuilt_index_at_the_same_path_misses(tmp_path):
+    file_name = str(tmp_path / 'cache.db')
+    before = IndexWrapper(MemoryIndex.from_vectors([('d1', {'a': 2, 'b': 1}), ('d2', {'a': 3})]),
+                          query_cache=QueryResultCache(file_name))
+    after = IndexWrapper(MemoryIndex.from_vectors([('d1', {'a': 2, 'b': 1}), ('d2', {'b': 3})]),
+                         query_cache=QueryResultCache(file_name))
+    assert [doc.docno for doc, _ in before.query('b')] == ['d1']
+    assert [doc.docno for doc, _ in after.query('b')] == ['d2', 'd1']
+
+
+def test_hits_are_recorded_in_batches(tmp_path):
+    file_name = str(tmp_path / 'cache.db')
+    cache = QueryResultCache(file_name, flush_every=2)
+    cache.bind('index')
+    cache.put('a', 10, RESULTS)
+    cache.put('b', 10, RESULTS)
+    written = last_used(file_name)
+    cache.get('a', 10)
+    cache.get('a', 10)
+    assert last_used(file_name) == written
+    cache.get('b', 10)
+    assert last_used(file_name)['a'] > written['a']
+    written = last_used(file_name)
+    cache.get('a', 10)
+    cache.close()
+    assert last_used(file_name)['a'] > written['a']
+
+
+def test_eviction_counts_entries_of_every_process(tmp_path):
+    file_name = str(tmp_path / 'cache.db')
+    first = QueryResultCache(file_name, max_entries=3, count_every=1)
+    second = QueryResultCache(file_name, max_entries=3, count_every=1)
+    first.bind('index')
+    second.bind('index')
+    first.put('a', 10, RESULTS)
+    second.put('b', 10, RESULTS)
+    second.put('c', 10, RESULTS)
+    first.put('d', 10, RESULTS)
+    assert first.entries() == second.entries() == 3
+    assert first.evictions == 1
+    assert first.get('a', 10) is None
+    assert [second.get(query, 10) for query in 'bcd'] == [RESULTS] * 3
+
+
+def test_other_processes_entries_are_seen_at_the_next_count(tmp_path):
+    file_name = str(tmp_path / 'cache.db')
+    first = QueryResultCache(file_name, max_entries=4, count_every=3)
+    second = QueryResultCache(file_name)
+    first.bind('index')
+    second.bind('index')
+    for query in 'abc':
+        second.put(query, 10, RESULTS)
+    first.put('d', 10, RESULTS)
+    first.put('e', 10, RESULTS)
+    assert first.entries() == 5 and first.evictions == 0
+    first.put('f', 10, RESULTS)
+    assert first.entries() == 4 and first.evictions == 2
+    assert [first.get(query, 10) is None for query in 'abcdef'] == [True, True] + [False] * 4
+
+
+def test_puts_do_not_count_the_table(tmp_path):
+    cache = QueryResultCache(str(tmp_path / 'cache.db'), max_entries=5)
+    cache.bind('index')
+    statements = []
+    cache._connection.set_trace_callback(statements.append)
+    for i in range(20):
+        cache.put(str(i), 10, RESULTS)
+    assert not [statement for statement in statements if 'COUNT' in statement]
+    assert cache.entries() == 5 and cache.evictions == 15
+    assert [cache.get(str(i), 10) is not None for i in range(20)] == [False] * 15 + [True] * 5
+
+
+def test_identity_keys_results_by_path_and_modification_time(tmp_path, monkeypatch):
+    file_name = str(tmp_path / 'cache.db')
+    index_file = str(tmp_path / 'index.csv')
+
+    def open_index(rows, modified):
+        with open(index_file, 'w') as f:
+            f.writelines('{},{},{}\n'.format(*row) for row in rows)
+        os.utime(index_file, ns=(modified, modified))
+        return IndexWrapper(MemoryIndex.from_csv(index_file), path=index_file,
+                            query_cache=QueryResultCache(file_name))
+
+    def fingerprint(*args):
+        raise AssertionError('the dictionary was walked')
+    monkeypatch.setattr(retrieval.core, 'index_fingerprint', fingerprint)
+    before = open_index([('d1', 'a', 2), ('d1', 'b', 1), ('d2', 'a', 3)], 10**18)
+    assert [doc.docno for doc, _ in before.query('b')] == ['d1']
+    after = open_index([('d1', 'a', 2), ('d1', 'b', 1), ('d2', 'b', 3)], 10**18 + 1)
+    assert [doc.docno for doc, _ in after.query('b')] == ['d2', 'd1']
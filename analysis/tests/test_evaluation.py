@@ -0,0 +1,95 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+from retrieval.core import BatchResults, Qrels
+from retrieval.evaluation import Evaluator
+from retrieval.scoring import average_precision
+
+from conftest import DATA_DIR
+
+
+CUTOFFS = (5, 10, 100, 1000)
+
+
+@pytest.fixture(scope='module')
+def ap_run():
+    return (BatchResults(os.path.join(DATA_DIR, 'runs', 'ap_baseline'), cache_file=False),
+            Qrels(os.path.join(DATA_DIR, 'qrels', 'qrels.ap')))
+
+
+def trec_eval_ranking(run, query_title):
+    """
+    The query's docnos by descending score, ties broken by descending docno, one result at a time.
+    """
+    results = [(run.document_query_score(docno, query_title), docno) for docno in run.query_results(query_title)]
+    return [docno for _, docno in sorted(results, reverse=True)]
+
+
+def reference_measures(qrels, query_title, ranking, cutoffs):
+    relevant = [qrels.is_rel(docno, query_title) for docno in ranking]
+    num_rel = len(qrels.rel_docs(query_title))
+    measures = {'map': average_precision(query_title, ranking, qrels)}
+    gains = [max(qrels.relevance_of(docno, query_title), 0) for docno in ranking]
+    ideal = sorted([max(qrels.relevance_of(docno, query_title), 0) for docno in qrels.judged_docs(query_title)],
+                   reverse=True)
+    for k in cutoffs:
+        found = sum(relevant[:k])
+        measures['P_{}'.format(k)] = found / k
+        measures['recall_{}'.format(k)] = found / num_rel if num_rel else 0.0
+        dcg = sum([gain / math.log2(i + 2) for i, gain in enumerate(gains[:k])])
+        ideal_dcg = sum([gain / math.log2(i + 2) for i, gain in enumerate(ideal[:k])])
+        measures['ndcg_cut_{}'.format(k)] = dcg / ideal_dcg if ideal_dcg else 0.0
+    return measures
+
+
+def test_measures_match_reference(ap_run):
+    run, qrels = ap_run
+    evaluated = Evaluator(qrels, cutoffs=CUTOFFS).evaluate(run)
+    assert list(evaluated) == [query_title for query_title in run.query_titles if query_title in qrels]
+    for query_title, measures in evaluated.items():
+        expected = reference_measures(qrels, query_title, trec_eval_ranking(run, query_title), CUTOFFS)
+        assert measures.keys() == expected.keys()
+        for measure, value in measures.items():
+            assert value == pytest.approx(expected[measure], abs=1e-12), (query_title, measure)
+
+
+def test_ties_break_by_descending_docno():
+    qrels = Qrels.from_dict({'1': {'a': 1, 'c': 2}})
+    results = {'1': [('a', -1.0), ('b', -1.0), ('c', -1.0), ('d', -2.0)]}
+    measures = Evaluator(qrels, cutoffs=(1, 3)).evaluate(results)['1']
+    # Ranked c, b, a, d
+    assert measures['P_1'] == 1.0
+    assert measures['map'] == pytest.approx((1 + 2 / 3) / 2)
+    assert measures['ndcg_cut_3'] == pytest.approx((2 + 1 / 2) / (2 + 1 / math.log2(3)))
+
+
+def test_queries_missing_from_run_or_qrels_are_skipped():
+    qrels = Qrels.from_dict({'1': {'a': 1}, '2': {'b': 1}})
+    evaluator = Evaluator(qrels, cutoffs=(5,))
+    evaluated = evaluator.evaluate({'1': [('a', 1.0)], '3': [('a', 1.0)]})
+    assert list(evaluated) == ['1']
+    assert evaluator.mean({'3': [('a', 1.0)]})['map'] == 0.0
+
+
+def test_measures_match_trec_eval(ap_run):
+    pytrec_eval = pytest.importorskip('pytrec_eval')
+    run, qrels = ap_run
+    with open(os.path.join(DATA_DIR, 'qrels', 'qrels.ap')) as f:
+        judgments = {}
+        for line in f:
+            query_title, _, docno, relevance = line.split()
+            judgments.setdefault(query_title, {})[docno] = int(relevance)
+    scores = {query_title: {docno: run.document_query_score(docno, query_title)
+                            for docno in run.query_results(query_title)} for query_title in run.query_titles}
+    measures = {'map', 'P.' + ','.join(map(str, CUTOFFS)), 'recall.' + ','.join(map(str, CUTOFFS)),
+                'ndcg_cut.' + ','.join(map(str, CUTOFFS))}
+    expected = pytrec_eval.RelevanceEvaluator(judgments, measures).evaluate(scores)
+
+    query_titles, actual = Evaluator(qrels, cutoffs=CUTOFFS).evaluate_arrays(run)
+    assert set(query_titles) == set(expected)
+    for measure, values in actual.items():
+        np.testing.assert_allclose(values, [expected[query_title][measure] for query_title in query_titles],
+                                   rtol=0, atol=1e-15, err_msg=measure)
@@ -0,0 +1,92 @@
+import collections
+import math
+
+import numpy as np
+import pytest
+
+from retrieval.core import Query, Stopper
+from retrieval.feedback import RelevanceFeedback, build_rm1, build_rm3, feedback_weights, relevance_model
+
+
+def reference_rm1(results, stopper, num_terms):
+    """
+    RM1 one document at a time: each document's maximum likelihood model, weighted by its normalized score.
+    """
+    total = sum([math.exp(score) for _, score in results])
+    model = collections.OrderedDict()
+    for doc, score in results:
+        vector = doc.document_vector()
+        length = sum(vector.values())
+        for term, count in stopper.stop(vector).items():
+            model[term] = model.get(term, 0.0) + math.exp(score) / total * count / length
+    return collections.Counter(model).most_common(num_terms)
+
+
+@pytest.fixture
+def stopper(collection):
+    return Stopper(terms=collection.stopwords(30))
+
+
+def test_feedback_weights_do_not_underflow():
+    weights = feedback_weights([-5000.0, -5001.0, -5003.0])
+    assert weights.sum() == pytest.approx(1.0)
+    np.testing.assert_allclose(weights, np.exp([0.0, -1.0, -3.0]) / np.exp([0.0, -1.0, -3.0]).sum())
+
+
+def test_rm1_matches_reference(collection, index, stopper):
+    for query in collection.queries(10):
+        results = index.query(query, count=10)
+        rm1 = build_rm1(results, index, num_terms=15, stopper=stopper)
+        expected = reference_rm1(results, stopper, 15)
+        assert list(rm1.vector) == sorted(term for term, _ in expected)
+        for term, weight in expected:
+            assert rm1.vector[term] == pytest.approx(weight, rel=1e-12)
+
+
+def test_rm3_interpolates_normalized_models():
+    query = Query('1', vector={'a': 2, 'b': 2})
+    rm1 = Query('rm1', vector={'b': 0.6, 'c': 0.3, 'd': 0.1})
+    rm3 = build_rm3(query, rm1, original_weight=0.3)
+    assert rm3.title == '1'
+    assert dict(rm3.vector) == pytest.approx({'a': 0.3 * 0.5, 'b': 0.3 * 0.5 + 0.7 * 0.6, 'c': 0.7 * 0.3,
+                                              'd': 0.7 * 0.1})
+    assert sum(rm3.vector.values()) == pytest.approx(1.0)
+    assert dict(build_rm3(query, rm1, original_weight=1.0).vector) == {'a': 0.5, 'b': 0.5}
+    assert dict(build_rm3(query, rm1, original_weight=0.0).vector) == pytest.approx(dict(rm1.vector))
+
+
+def test_empty_inputs(index, stopper):
+    term_ids, probabilities = relevance_model([], index, stopper=stopper)
+    assert len(term_ids) == len(probabilities) == 0
+    empty_rm1 = build_rm1([], index, stopper=stopper)
+    assert empty_rm1.length() == 0
+
+    query = Query('1', vector={'term100': 1, 'term200': 3})
+    assert dict(build_rm3(query, empty_rm1, original_weight=0.4).vector) == pytest.approx({'term100': 0.1,
+                                                                                           'term200': 0.3})
+    rm1 = Query('rm1', vector={'term100': 0.5, 'term300': 0.5})
+    assert dict(build_rm3(Query('2', vector={}), rm1, original_weight=0.4).vector) == \
+        pytest.approx({'term100': 0.3, 'term300': 0.3})
+    assert build_rm3(Query('3', vector={}), empty_rm1).length() == 0
+
+
+def test_expand_and_retrieve(collection, index, stopper):
+    queries = collection.queries(8) + [Query('nothing', vector={'notaterm': 1})]
+    feedback = RelevanceFeedback(index, num_docs=5, num_terms=10, original_weight=0.6, stopper=stopper)
+    initial_results = [index.query(query, count=5) for query in queries]
+
+    expanded = feedback.expand(queries)
+    assert [query.title for query in expanded] == [query.title for query in queries]
+    for query, results, rm3 in zip(queries, initial_results, expanded):
+        assert rm3 == build_rm3(query, build_rm1(results, index, num_terms=10, stopper=stopper), original_weight=0.6)
+    assert feedback.expand(queries, initial_results=initial_results) == expanded
+    # Nothing matches, so the expanded query is the original one, scaled
+    assert dict(expanded[-1].vector) == pytest.approx({'notaterm': 0.6})
+
+    retrieved = feedback.retrieve(queries, count=20)
+    for rm3, results in zip(expanded, retrieved):
+        assert [(doc.docno, score) for doc, score in results] == \
+            [(doc.docno, score) for doc, score in index.query(rm3, count=20)]
+        scores = [score for _, score in results]
+        assert scores == sorted(scores, reverse=True)
+    assert all(len(results) == 20 for results in retrieved[:-1]) and retrieved[-1] == []
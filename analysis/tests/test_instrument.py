@@ -0,0 +1,40 @@
+import json
+
+from retrieval.core import IndexWrapper
+from retrieval.instrument import Profiler
+from retrieval.memindex import MemoryIndex
+
+from conftest import INDEX
+
+
+def test_profiler_counts_calls_through_the_proxies(tmp_path):
+    profiler = Profiler()
+    backend = profiler.instrument(MemoryIndex.from_csv(INDEX), 'index.backend')
+    index = profiler.instrument(IndexWrapper(backend), 'index')
+    expected = IndexWrapper(MemoryIndex.from_csv(INDEX))
+
+    num_results = 0
+    for query in ['#weight( 2.0 computer 1.0 market )', 'market', 'computer']:
+        results = index.query(query, count=5)
+        assert [doc.docno for doc, _ in results] == [doc.docno for doc, _ in expected.query(query, count=5)]
+        num_results += len(results)
+    assert num_results > 0
+    assert backend.document_count() == expected.index.document_count()
+    # Attributes and private methods pass through untimed
+    assert index.vector_cache is index._target.vector_cache
+
+    file_name = str(tmp_path / 'report.json')
+    profiler.write_report(file_name)
+    with open(file_name) as f:
+        report = json.load(f)
+    assert set(report) == {'pid', 'argv', 'wall_seconds', 'methods', 'caches'}
+    methods = report['methods']
+    # The wrapper's own calls to the backend are counted too
+    assert {name: stats['calls'] for name, stats in methods.items()} == \
+        {'index.query': 3, 'index.backend.query': 3, 'index.backend.document_count': 1,
+         'index.backend.get_dictionary': 1, 'index.backend.ext_document_id': num_results}
+    assert set(methods['index.query']) == {'calls', 'total_seconds', 'mean_seconds', 'p50_seconds', 'p90_seconds',
+                                           'p99_seconds', 'max_seconds'}
+    assert methods['index.query']['total_seconds'] >= methods['index.backend.query']['total_seconds']
+    assert list(report['caches']) == ['index.vector_cache']
+    assert report['caches']['index.vector_cache'] == index.vector_cache.stats()
@@ -0,0 +1,74 @@
+import io
+
+import numpy as np
+import pytest
+
+from retrieval.output import ColumnWriter, column_array, load_columns
+
+
+ROWS = [('d{}'.format(i), i, i / 4 if i % 3 else i // 3, 'q{}'.format(i % 2)) for i in range(11)]
+COLUMNS = ['docno', 'rank', 'score', 'query']
+
+
+class CountingFile(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+        return super().write(text)
+
+
+def printed(rows, sep=','):
+    output = io.StringIO()
+    for row in rows:
+        print(*row, sep=sep, file=output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('header', [False, True])
+def test_text_matches_print(header):
+    output = io.StringIO()
+    with ColumnWriter(COLUMNS, file=output, header=header) as writer:
+        writer.write_rows(ROWS)
+    assert output.getvalue() == ('docno,rank,score,query\n' if header else '') + printed(ROWS)
+
+
+def test_rows_are_written_in_blocks():
+    output = CountingFile()
+    writer = ColumnWriter(COLUMNS, file=output, separator='\t', block_rows=4)
+    writer.write_rows(ROWS[:7])
+    assert len(output.writes) == 1 and output.getvalue() == printed(ROWS[:4], sep='\t')
+    writer.write_rows(ROWS[7:])
+    writer.close()
+    assert len(output.writes) == 3 and output.getvalue() == printed(ROWS, sep='\t')
+
+
+def test_wrong_number_of_fields():
+    with pytest.raises(ValueError):
+        ColumnWriter(COLUMNS, file=io.StringIO()).write_row(('d1', 1))
+
+
+@pytest.mark.parametrize('mmap_mode', ['r', None])
+def test_columns_round_trip_across_blocks(tmp_path, mmap_mode):
+    column_dir = str(tmp_path / 'out.columns')
+    output = io.StringIO()
+    with ColumnWriter(COLUMNS, file=output, column_dir=column_dir, block_rows=4) as writer:
+        writer.write_rows(ROWS)
+    assert output.getvalue() == printed(ROWS)
+
+    columns = load_columns(column_dir, mmap_mode=mmap_mode)
+    assert list(columns) == COLUMNS
+    assert all([isinstance(array, np.memmap) == (mmap_mode == 'r') for array in columns.values()])
+    assert columns['docno'].dtype.kind == 'U' and columns['docno'].tolist() == [row[0] for row in ROWS]
+    assert columns['rank'].dtype == np.int64 and columns['rank'].tolist() == [row[1] for row in ROWS]
+    assert columns['score'].dtype == np.float64 and columns['score'].tolist() == [row[2] for row in ROWS]
+    assert columns['query'].tolist() == [row[3] for row in ROWS]
+
+
+def test_column_types():
+    assert column_array([1, np.int32(2)]).dtype == np.int64
+    assert column_array([1, 2.5]).dtype == np.float64
+    assert column_array([True, 1]).tolist() == ['True', '1']
+    assert column_array(['a', 1]).tolist() == ['a', '1']
@@ -0,0 +1,88 @@
+import math
+import statistics
+
+import numpy as np
+import pytest
+
+from retrieval.core import Query, Stopper
+from retrieval.feedback import build_rm1
+from retrieval.qpp import FEATURES, QPPEngine
+from retrieval.scoring import DirichletTermScorer, clarity
+
+
+def reference_features(query, index, stopper, scorer):
+    """
+    The per-query feature functions pq-qpp-features.py had before QPPEngine, in the order of FEATURES.
+    """
+    top_results = index.query(query, count=10)
+    terms = list(query.vector)
+
+    def scq(term):
+        document_frequency = index.term_document_frequency(term) if index.term_id(term) > 0 else 0
+        return (1 + math.log(index.term_count(term) + 1)) * math.log(index.total_docs() / (document_frequency + 1))
+
+    scs = 0.0
+    for term in terms:
+        query_prob = query.vector[term] / query.length()
+        if index.term_count(term):
+            scs += query_prob * math.log(query_prob / (index.term_count(term) / index.total_terms()))
+
+    idf = 0.0
+    for term in terms:
+        if index.term_id(term) > 0 and index.term_document_frequency(term):
+            idf += math.log(index.total_docs() / index.term_document_frequency(term))
+
+    wig = 0.0
+    nqc = 0.0
+    if top_results:
+        for doc, _ in top_results:
+            for term in terms:
+                wig += 1 / math.sqrt(query.length()) * math.log(
+                    scorer.score(term, doc) / ((index.term_count(term) + 1) / index.total_terms()))
+        wig /= len(top_results)
+
+        scores = [score for _, score in top_results]
+        mean = statistics.mean(scores)
+        collection_score = sum([query.vector[term] / query.length() *
+                                math.log(index.term_count(term) / index.total_terms() + 0.001) for term in terms])
+        nqc = math.sqrt(sum([(score - mean) ** 2 for score in scores]) / len(scores)) / collection_score
+
+    rm1_clarity = clarity(build_rm1(top_results, index, stopper=stopper).vector, index)
+    return rm1_clarity, wig, nqc, idf / len(terms), scs, statistics.mean([scq(term) for term in terms])
+
+
+@pytest.fixture
+def queries(collection):
+    queries = collection.queries(20)
+    # Weighted queries like the pseudo-queries, one with a term missing from the index
+    queries += [Query('w1', vector={'term5': 3.5, 'term40': 1.25, 'term300': 2.0}),
+                Query('w2', vector={'term7': 2.0, 'missing': 1.0})]
+    return queries
+
+
+def test_features_match_per_query_reference(index, queries):
+    stopper = Stopper(terms=['term{}'.format(i) for i in range(1, 51)])
+    engine = QPPEngine(index, stopper=stopper)
+    rows = engine.rows(queries)
+    scorer = DirichletTermScorer(index)
+    for query, row in zip(queries, rows):
+        assert row[0] == query.title
+        expected = reference_features(query, index, stopper, scorer)
+        for feature, value, expected_value in zip(FEATURES, row[1:], expected):
+            assert value == pytest.approx(expected_value, rel=1e-12, abs=1e-15), (query.title, feature)
+
+
+def test_empty_queries_get_zero(index, queries):
+    features = QPPEngine(index).features([queries[0], Query('empty', vector={}), queries[1]])
+    for feature in FEATURES:
+        assert features[feature][1] == 0.0, feature
+        assert np.isfinite(features[feature]).all(), feature
+    assert all(len(values) == 0 for values in QPPEngine(index).features([]).values())
+
+
+def test_batches_do_not_change_features(index, queries):
+    together = QPPEngine(index).features(queries)
+    engine = QPPEngine(index)
+    apart = [engine.features([query]) for query in queries]
+    for feature in FEATURES:
+        np.testing.assert_allclose(together[feature], [values[feature][0] for values in apart], rtol=1e-15)
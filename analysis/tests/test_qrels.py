@@ -0,0 +1,129 @@
+import collections
+import os
+import random
+
+import numpy as np
+import pytest
+
+from retrieval.core import Qrels
+
+from conftest import DATA_DIR
+
+
+QRELS_FILE = os.path.join(DATA_DIR, 'qrels', 'qrels.ap')
+
+
+class ReferenceQrels(object):
+    """
+    Qrels as it was before the judgments moved into arrays, except that lookups no longer add empty judgments.
+    """
+    def __init__(self, file):
+        self._qrels = collections.defaultdict(dict)
+        with open(file) as f:
+            for line in f:
+                query, _, docno, rel = line.strip().split()
+                self._qrels[query][docno] = int(rel)
+
+    def relevance_of(self, docno, query_title):
+        return self._qrels.get(query_title, {}).get(docno, 0)
+
+    def rel_docs(self, query_title):
+        judgments = self._qrels.get(query_title, {})
+        return set([docno for docno in judgments if judgments[docno] > 0])
+
+    def judged_docs(self, query_title):
+        return set(self._qrels.get(query_title, {}).keys())
+
+    def judged_for_queries(self, docno):
+        return {query: judgments[docno] for query, judgments in self._qrels.items() if docno in judgments}
+
+
+@pytest.fixture(scope='module')
+def qrels_pair():
+    return Qrels(QRELS_FILE), ReferenceQrels(QRELS_FILE)
+
+
+def sample_pairs(file, count, seed=0):
+    with open(file) as f:
+        lines = [line.split() for line in f]
+    return [(fields[2], fields[0]) for fields in random.Random(seed).sample(lines, count)]
+
+
+def test_lookups_match_reference(qrels_pair):
+    qrels, reference = qrels_pair
+    pairs = sample_pairs(QRELS_FILE, 2000)
+    pairs += [('AP000000-0000', query_title) for _, query_title in pairs[:50]]
+    pairs += [(docno, '999') for docno, _ in pairs[:50]]
+    for docno, query_title in pairs:
+        assert qrels.relevance_of(docno, query_title) == reference.relevance_of(docno, query_title)
+        assert qrels.is_rel(docno, query_title) == (reference.relevance_of(docno, query_title) > 0)
+
+
+def test_document_sets_match_reference(qrels_pair):
+    qrels, reference = qrels_pair
+    for query_title in list(reference._qrels)[:20] + ['999']:
+        assert qrels.rel_docs(query_title) == reference.rel_docs(query_title)
+        assert qrels.judged_docs(query_title) == reference.judged_docs(query_title)
+    assert '999' not in qrels
+
+
+def test_judged_for_queries_matches_reference(qrels_pair):
+    qrels, reference = qrels_pair
+    for docno, _ in sample_pairs(QRELS_FILE, 200, seed=1) + [('AP000000-0000', None)]:
+        judged = qrels.judged_for_queries(docno)
+        assert judged == reference.judged_for_queries(docno)
+        # In the order the queries first appear in the file
+        assert list(judged) == [query for query in reference._qrels if query in judged]
+
+
+def test_relevance_matrix_matches_relevance_of(qrels_pair):
+    qrels, _ = qrels_pair
+    pairs = sample_pairs(QRELS_FILE, 60, seed=2)
+    query_titles = [query_title for _, query_title in pairs[:6]] + ['999']
+    docnos = [docno for docno, _ in pairs] + ['AP000000-0000', '']
+    matrix = qrels.relevance_matrix(query_titles, [[docno.encode() for docno in docnos]] * len(query_titles))
+    expected = [[qrels.relevance_of(docno, query_title) for docno in docnos] for query_title in query_titles]
+    np.testing.assert_array_equal(matrix, expected)
+
+
+def test_later_judgments_replace_earlier_ones(tmp_path):
+    file_name = str(tmp_path / 'qrels')
+    with open(file_name, 'w') as f:
+        f.write('1 0 d1 1\n1 0 d2 0\n\n2 0 d1 2\n1 0 d1 0\n')
+    qrels = Qrels(file_name)
+    assert qrels.relevance_of('d1', '1') == 0
+    assert qrels.judged_docs('1') == {'d1', 'd2'}
+    assert qrels.judged_for_queries('d1') == {'1': 0, '2': 2}
+
+
+@pytest.mark.parametrize('line', ['1 0 d3', '1 0 d3 1 extra', '1 0 d3 1 1 0 d4 1'])
+def test_malformed_lines_are_named(tmp_path, line):
+    file_name = str(tmp_path / 'qrels')
+    with open(file_name, 'w') as f:
+        f.write('1 0 d1 1\n1 0 d2 0\n' + line + '\n1 0 d4 1\n')
+    with pytest.raises(ValueError, match='line 3: expected 4 fields'):
+        Qrels(file_name)
+
+
+def test_bad_relevance_is_named(tmp_path):
+    file_name = str(tmp_path / 'qrels')
+    with open(file_name, 'w') as f:
+        f.write('1 0 d1 1\n\n1 0 d2 yes\n')
+    with pytest.raises(ValueError, match='line 3: relevance yes is not an integer'):
+        Qrels(file_name)
+
+
+def test_empty_file(tmp_path):
+    file_name = str(tmp_path / 'qrels')
+    open(file_name, 'w').close()
+    qrels = Qrels(file_name)
+    assert '1' not in qrels and qrels.judged_for_queries('d1') == {}
+    assert qrels.relevance_matrix(['1'], [['d1']]).tolist() == [[0]]
+
+
+def test_from_dict_keeps_weights():
+    qrels = Qrels.from_dict({'q': {'apple': 0.5, 'pear': 2, 'plum': 0}})
+    assert qrels.relevance_of('apple', 'q') == 0.5
+    assert qrels.rel_docs('q') == {'apple', 'pear'}
+    assert qrels.judged_docs('q') == {'apple', 'pear', 'plum'}
+    assert Qrels.from_dict({}).judged_docs('q') == set()
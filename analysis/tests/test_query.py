@@ -0,0 +1,36 @@
+import pickle
+
+import pytest
+
+from retrieval.core import Query, Stopper
+
+
+def test_term_order_does_not_matter():
+    first = Query('1', vector={'wars': 1, 'star': 2})
+    second = Query('2', query_string='Star wars star')
+    assert str(first) == str(second) == '#weight( 2 star 1 wars )'
+    assert first == second and hash(first) == hash(second)
+    assert list(second.vector) == ['star', 'wars']
+    assert second.length() == 3
+
+
+def test_queries_are_immutable():
+    query = Query('1', vector={'star': 2})
+    with pytest.raises(AttributeError):
+        query.vector = {'wars': 1}
+    with pytest.raises(TypeError):
+        query.vector['wars'] = 1
+    assert str(query) == '#weight( 2 star )'
+
+
+def test_stopped_copy_leaves_the_query_alone():
+    query = Query('1', query_string='the star wars')
+    stopped = Query(query.title, vector=Stopper(terms=['the']).stop(query.vector))
+    assert str(stopped) == '#weight( 1 star 1 wars )'
+    assert str(query) == '#weight( 1 star 1 the 1 wars )'
+
+
+def test_queries_pickle_through_their_constructor():
+    query = Query('1', vector={'wars': 1, 'star': 2})
+    copy = pickle.loads(pickle.dumps(query))
+    assert copy == query and copy.title == '1' and dict(copy.vector) == dict(query.vector)
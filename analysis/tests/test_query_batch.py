@@ -0,0 +1,97 @@
+import functools
+
+import pytest
+
+from retrieval.cache import QueryResultCache
+from retrieval.core import IndexWrapper, Query
+from retrieval.memindex import MemoryIndex, open_index
+
+from conftest import INDEX, PSEUDO_QUERIES
+
+
+class CountingIndex(MemoryIndex):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+
+    def query(self, query, results_requested=1000):
+        self.queries.append(query)
+        return super().query(query, results_requested=results_requested)
+
+
+@pytest.fixture(scope='module')
+def queries():
+    terms = {}
+    with open(PSEUDO_QUERIES) as f:
+        for line in f:
+            docno, term, weight = line.strip().split(',')
+            terms.setdefault(docno, {})[term] = float(weight)
+    queries = [Query(docno, vector=vector) for docno, vector in list(terms.items())[:12]]
+    # Repeats, one as a query string, and a query with no terms in the index
+    return queries + [queries[3], str(queries[0]), Query('none', vector={'notaterm': 1.0}), queries[5]]
+
+
+@pytest.fixture(scope='module')
+def expected(queries):
+    index = IndexWrapper(open_index(INDEX))
+    return [ranking(index.query(query, count=10)) for query in queries]
+
+
+def ranking(results):
+    return [(doc.docno, score) for doc, score in results]
+
+
+@pytest.mark.parametrize('workers, processes', [(1, False), (2, False), (3, True)])
+def test_batch_matches_serial_queries(queries, expected, workers, processes):
+    index = IndexWrapper(open_index(INDEX), path=INDEX)
+    results = index.query_batch(queries, count=10, workers=workers, processes=processes)
+    assert [ranking(query_results) for query_results in results] == expected
+
+
+def test_identical_queries_run_once(queries, expected):
+    backend = CountingIndex.from_csv(INDEX)
+    results = IndexWrapper(backend).query_batch(queries, count=10)
+    assert [ranking(query_results) for query_results in results] == expected
+    assert len(backend.queries) == len(set(backend.queries)) == len(set(map(str, queries)))
+    # Each position gets its own list, even for repeated queries
+    assert results[3] == results[12] and results[3] is not results[12]
+
+
+def test_workers_open_their_own_handles(queries, expected):
+    handles = []
+
+    def factory():
+        handles.append(CountingIndex.from_csv(INDEX))
+        return handles[-1]
+    backend = CountingIndex.from_csv(INDEX)
+    results = IndexWrapper(backend, index_factory=factory).query_batch(queries, count=10, workers=2)
+    assert [ranking(query_results) for query_results in results] == expected
+    assert backend.queries == [] and 1 <= len(handles) <= 2
+    assert sorted(query for handle in handles for query in handle.queries) == sorted(set(map(str, queries)))
+
+
+def test_without_a_factory_queries_run_in_this_thread(queries, expected):
+    backend = CountingIndex.from_csv(INDEX)
+    index = IndexWrapper(backend)
+    assert index.index_factory is None
+    results = index.query_batch(queries, count=10, workers=4)
+    assert [ranking(query_results) for query_results in results] == expected
+    assert len(backend.queries) == len(set(map(str, queries)))
+    with pytest.raises(ValueError):
+        index.query_batch(queries, count=10, workers=2, processes=True)
+
+
+def test_path_gives_a_factory():
+    index = IndexWrapper(open_index(INDEX), path=INDEX)
+    assert isinstance(index.index_factory, functools.partial) and index.index_factory.args == (INDEX,)
+
+
+def test_cached_queries_are_not_run(tmp_path, queries, expected):
+    file_name = str(tmp_path / 'cache.db')
+    IndexWrapper(open_index(INDEX), path=INDEX, query_cache=QueryResultCache(file_name)).query_batch(queries[:6],
+                                                                                                   count=10)
+    backend = CountingIndex.from_csv(INDEX)
+    results = IndexWrapper(backend, path=INDEX, query_cache=QueryResultCache(file_name)).query_batch(queries,
+                                                                                                   count=10)
+    assert [ranking(query_results) for query_results in results] == expected
+    assert sorted(backend.queries) == sorted(set(map(str, queries)) - set(map(str, queries[:6])))
@@ -0,0 +1,29 @@
+import os
+
+from retrieval.runner import ShardedRunner
+
+
+def set_up():
+    return {'pid': os.getpid()}
+
+
+def square_shard(state, shard):
+    return [(unit * unit, state['pid']) for unit in shard]
+
+
+def test_shards_are_contiguous_and_even():
+    runner = ShardedRunner(set_up, square_shard, workers=3, shards_per_worker=2)
+    shards = runner.shards(list(range(20)))
+    assert [unit for shard in shards for unit in shard] == list(range(20))
+    assert len(shards) == 6 and {len(shard) for shard in shards} == {3, 4}
+    assert runner.shards([1, 2]) == [[1], [2]]
+
+
+def test_results_keep_unit_order_for_any_worker_count():
+    units = list(range(50))
+    for workers in [1, 3, 4]:
+        results = list(ShardedRunner(set_up, square_shard, workers=workers).run(units))
+        assert [square for square, _ in results] == [unit * unit for unit in units]
+        if workers > 1:
+            assert os.getpid() not in {pid for _, pid in results}
+    assert list(ShardedRunner(set_up, square_shard, workers=3).run([])) == []
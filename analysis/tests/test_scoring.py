@@ -0,0 +1,207 @@
+import collections
+import math
+
+import numpy as np
+import pytest
+
+from retrieval.core import Document, ExpandableDocument, IndexWrapper, Query, Stopper
+from retrieval.memindex import MemoryIndex
+from retrieval.scoring import DirichletTermScorer, ExpansionDocTermScorer, InterpolatedTermScorer, QLQueryScorer, \
+    build_vocab, cosine_similarity, pseudo_document
+
+
+class PluralIndex(MemoryIndex):
+    """
+    Counts plurals as their singular, as a stemming index would, so terms outside the dictionary have counts.
+    """
+    def term_count(self, term):
+        return super().term_count(term[:-1] if term.endswith('s') else term)
+
+
+def reference_score(index, term, document, mu=2500, epsilon=1.0):
+    """
+    DirichletTermScorer.score as it was before scoring went through term IDs, from the document's Counter.
+    """
+    vector = document.document_vector()
+    collection_prob = (epsilon + index.term_count(term)) / index.total_terms()
+    return (vector[term] + mu * collection_prob) / (sum(vector.values()) + mu)
+
+
+def reference_pseudo_document(results, scorer):
+    total = sum([score for _, score in results])
+    vocab = set()
+    for doc, _ in results:
+        vocab |= doc.document_vector().keys()
+    return {term: sum([score / total * reference_score(scorer.index, term, doc, scorer.mu, scorer.epsilon)
+                       for doc, score in results]) for term in vocab}
+
+
+def documents(index, doc_ids):
+    return [Document(index, doc_id=doc_id) for doc_id in doc_ids]
+
+
+@pytest.mark.parametrize('mu', [0, 10, 2500])
+def test_score_batch_matches_reference(index, mu):
+    docs = documents(index, range(1, 21))
+    vocab = ['term1', 'term2', 'term50', 'term700', 'term2999', 'missing']
+    scores = DirichletTermScorer(index, mu=mu).score_batch(vocab, docs)
+    expected = [[reference_score(index, term, doc, mu=mu) for term in vocab] for doc in docs]
+    np.testing.assert_allclose(scores, expected, rtol=1e-12)
+
+
+def test_score_batch_term_ids_match_strings(index):
+    docs = documents(index, range(1, 11))
+    vocab = ['term3', 'term40', 'term400']
+    scorer = DirichletTermScorer(index)
+    term_ids = np.array([index.term_id(term) for term in vocab])
+    np.testing.assert_array_equal(scorer.score_batch(term_ids, docs), scorer.score_batch(vocab, docs))
+
+
+def test_score_batch_sparse_without_smoothing(index):
+    docs = documents(index, range(1, 11))
+    vocab = ['term1', 'term20', 'term200']
+    scorer = DirichletTermScorer(index, mu=0)
+    np.testing.assert_array_equal(scorer.score_batch(vocab, docs, sparse=True).toarray(),
+                                  scorer.score_batch(vocab, docs))
+
+
+def test_score_matches_score_batch(index):
+    docs = documents(index, range(1, 11))
+    vocab = ['term1', 'term5', 'term60', 'Term60', 'missing']
+    scorer = DirichletTermScorer(index)
+    batch = scorer.score_batch(vocab, docs)
+    for i, doc in enumerate(docs):
+        for j, term in enumerate(vocab):
+            assert scorer.score(term, doc) == batch[i, j]
+            assert scorer.score(term, doc) == pytest.approx(reference_score(index, term.lower(), doc), rel=1e-12)
+
+
+def test_pseudo_document_matches_reference(index, results):
+    scorer = DirichletTermScorer(index)
+    for query_results in results[:5]:
+        expected = reference_pseudo_document(query_results, scorer)
+        actual = pseudo_document(query_results, scorer)
+        assert {index.term(term_id) for term_id in actual} == set(expected)
+        for term_id, probability in actual.items():
+            assert probability == pytest.approx(expected[index.term(term_id)], rel=1e-12)
+
+
+def test_pseudo_document_counts_each_result(index, results):
+    query_results = results[0]
+    vector = collections.Counter()
+    for doc, _ in query_results:
+        vector.update(doc.document_vector())
+    assert len(pseudo_document(query_results, DirichletTermScorer(index))) == len(vector)
+
+
+def test_build_vocab_of_nothing_is_empty_term_ids():
+    vocab = build_vocab()
+    assert isinstance(vocab, np.ndarray) and vocab.dtype.kind == 'i' and len(vocab) == 0
+
+
+def test_pseudo_document_of_no_results(index):
+    scorer = DirichletTermScorer(index)
+    assert pseudo_document([], scorer) == {}
+    # As before term IDs, a query with no results is not similar to anything
+    assert cosine_similarity(pseudo_document([], scorer), pseudo_document([], scorer)) == 0.0
+
+
+def test_terms_outside_the_index_do_not_share_scores():
+    index = IndexWrapper(PluralIndex.from_vectors([('d1', {'apple': 2, 'pear': 1}), ('d2', {'apple': 3})]))
+    doc = Document(index, doc_id=1)
+    scorer = DirichletTermScorer(index, mu=10)
+    assert index.term_id('apples') == index.term_id('pears') == 0
+    scores = [scorer.score(term, doc) for term in ['apples', 'pears', 'apples']]
+    assert scores == [reference_score(index, term, doc, mu=10) for term in ['apples', 'pears', 'apples']]
+    assert scores[0] != scores[1]
+    np.testing.assert_array_equal(scorer.score_batch(['apples', 'pears'], [doc])[0], scores[:2])
+
+
+def test_cached_scores_are_bit_identical_to_score_batch(index):
+    docs = documents(index, range(1, 31))
+    vocab = ['term{}'.format(i) for i in range(1, 400, 7)] + ['missing']
+    # Room for about a hundred scores, so most are evicted and computed again
+    scorer = DirichletTermScorer(index, cache_bytes=10**4)
+    batch = scorer.score_batch(vocab, docs)
+    for _ in range(2):
+        assert [[scorer.score(term, doc) for term in vocab] for doc in docs] == batch.tolist()
+    stats = scorer.cache.stats()
+    assert stats['evictions'] > 0
+    assert stats['terms'] == len(vocab) and stats['documents'] == len(docs)
+    assert stats['term_misses'] == len(vocab)
+    assert scorer.score(vocab[-2], docs[-1]) == batch[-1, -2]
+    assert scorer.cache.stats()['hits'] == stats['hits'] + 1
+
+
+def test_cache_is_per_scorer(index):
+    doc = Document(index, doc_id=1)
+    smooth, sharp = DirichletTermScorer(index, mu=2500), DirichletTermScorer(index, mu=10)
+    assert smooth.score('term1', doc) == pytest.approx(reference_score(index, 'term1', doc, mu=2500), rel=1e-12)
+    assert sharp.score('term1', doc) == pytest.approx(reference_score(index, 'term1', doc, mu=10), rel=1e-12)
+    smooth.cache.clear()
+    assert smooth.cache.stats()['terms'] == 0
+
+
+def reference_expansion_score(index, term, document, stopper, num_docs, num_terms):
+    """
+    ExpansionDocTermScorer.score as it was before expansion models were materialized: a softmax over the expansion
+    documents' scores, mixing their Dirichlet term probabilities.
+    """
+    expansion_docs = document.expansion_docs(document.pseudo_query(stopper=stopper, num_terms=num_terms),
+                                             num_docs=num_docs)
+    k = expansion_docs[0][1]
+    total = sum([math.exp(score - k) for _, score in expansion_docs])
+    return sum([math.exp(score - k) / total * reference_score(index, term.lower(), doc)
+                for doc, score in expansion_docs])
+
+
+def expandable_documents(index, doc_ids):
+    return [ExpandableDocument(Document(index, doc_id=doc_id).docno, index) for doc_id in doc_ids]
+
+
+def test_expansion_score_batch_matches_reference(index):
+    stopper = Stopper(terms=['term{}'.format(i) for i in range(1, 20)])
+    scorer = ExpansionDocTermScorer(DirichletTermScorer(index), stopper=stopper, num_docs=5, num_terms=8)
+    docs = expandable_documents(index, range(1, 11))
+    vocab = ['term3', 'term25', 'term250', 'Term25', 'missing']
+    batch = scorer.score_batch(vocab, docs)
+    for i, doc in enumerate(docs):
+        for j, term in enumerate(vocab):
+            expected = reference_expansion_score(index, term, doc, stopper, 5, 8)
+            assert batch[i, j] == pytest.approx(expected, rel=1e-12)
+            assert scorer.score(term, doc) == batch[i, j]
+
+
+def test_interpolated_score_batch_matches_score(index):
+    docs = expandable_documents(index, range(1, 6))
+    expansion_scorer = ExpansionDocTermScorer(DirichletTermScorer(index), stopper=Stopper())
+    scorer = InterpolatedTermScorer([DirichletTermScorer(index), expansion_scorer], [0.3, 0.7])
+    vocab = ['term2', 'term30', 'missing']
+    batch = scorer.score_batch(vocab, docs)
+    for i, doc in enumerate(docs):
+        for j, term in enumerate(vocab):
+            assert batch[i, j] == pytest.approx(scorer.score(term, doc), rel=1e-12)
+
+
+def reference_query_likelihood(index, query, document):
+    return sum([query.vector[term] / query.length() * math.log(reference_score(index, term, document))
+                for term in query.vector])
+
+
+def test_score_matrix_matches_reference(index, collection):
+    queries = collection.queries(10) + [Query('w', vector={'term9': 2.5, 'term90': 0.5, 'missing': 1.0})]
+    docs = documents(index, range(1, 16))
+    scorer = QLQueryScorer(DirichletTermScorer(index))
+    matrix = scorer.score_matrix(queries, docs)
+    assert matrix.shape == (len(queries), len(docs))
+    for i, query in enumerate(queries):
+        for j, doc in enumerate(docs):
+            assert matrix[i, j] == pytest.approx(reference_query_likelihood(index, query, doc), rel=1e-12)
+            assert matrix[i, j] == pytest.approx(scorer.score(query, doc), rel=1e-12)
+
+
+def test_score_matrix_of_no_terms(index):
+    docs = documents(index, range(1, 4))
+    scorer = QLQueryScorer(DirichletTermScorer(index))
+    np.testing.assert_array_equal(scorer.score_matrix([Query('empty', vector={})], docs), np.zeros((1, 3)))
+    assert scorer.score_matrix([], docs).shape == (0, 3)
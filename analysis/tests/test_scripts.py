@@ -0,0 +1,78 @@
+import collections
+import json
+import os
+
+import pytest
+
+from conftest import DATA_DIR, INDEX, PSEUDO_QUERIES, QRELS, STOPLIST, TOPIC_TERMS, TOPICS, run_script
+
+
+@pytest.fixture(scope='module')
+def doc_metrics_inputs(tmp_path_factory):
+    """
+    The AP title queries as a JSON query file, expansion parameters for each of them, and a few annotated documents.
+    """
+    directory = tmp_path_factory.mktemp('doc_metrics')
+    terms = collections.OrderedDict()
+    with open(TOPICS) as f:
+        for line in f:
+            query_title, term = line.strip().split(',')
+            terms.setdefault(query_title, []).append(term)
+    queries = {'queries': [{'title': query_title, 'model': [{'feature': term, 'weight': count} for term, count in
+                                                             collections.Counter(terms[query_title]).items()]}
+                           for query_title in terms]}
+    with open(str(directory / 'queries.json'), 'w') as f:
+        json.dump(queries, f)
+    with open(str(directory / 'params'), 'w') as f:
+        for i, query_title in enumerate(terms):
+            f.write('{} origW:{},expDocs:{},expTerms:{}\n'.format(query_title, 0.3 + i % 5 / 10, 5 + i % 6,
+                                                                  10 + i % 5))
+    with open(os.path.join(DATA_DIR, 'annotations', 'docs.ap')) as f:
+        docnos = [line.strip() for line in f][:4]
+    with open(str(directory / 'docs'), 'w') as f:
+        f.write(''.join(docno + '\n' for docno in docnos))
+    return str(directory / 'queries.json'), str(directory / 'params'), str(directory / 'docs'), docnos
+
+
+def test_doc_list_matches_single_documents(doc_metrics_inputs):
+    queries, params, doc_list, docnos = doc_metrics_inputs
+    inputs = [INDEX, INDEX, queries, QRELS, STOPLIST, params]
+    single = b''.join([run_script('doc_metrics.py', TOPIC_TERMS, docno, *inputs) for docno in docnos])
+    assert single
+    assert run_script('doc_metrics.py', TOPIC_TERMS, *inputs, '--doc-list', doc_list) == single
+    assert run_script('doc_metrics.py', TOPIC_TERMS, *inputs, '--doc-list', doc_list, '--workers', '3') == single
+
+
+def test_doc_metrics_does_not_depend_on_string_hashing(doc_metrics_inputs):
+    queries, params, _, docnos = doc_metrics_inputs
+    inputs = [TOPIC_TERMS, docnos[0], INDEX, INDEX, queries, QRELS, STOPLIST, params]
+    assert run_script('doc_metrics.py', *inputs, hash_seed='1') == run_script('doc_metrics.py', *inputs, hash_seed='2')
+
+
+@pytest.fixture(scope='module')
+def user_topic_terms():
+    """
+    The topic terms of the first 60 (user, docno) pairs on AP, as the user,docno,collection,term,... lines
+    tt_pq_metrics reads.
+    """
+    terms = collections.OrderedDict()
+    with open(TOPIC_TERMS) as f:
+        for line in f:
+            user, docno, collection, term = line.strip().split(',')
+            if collection == 'ap':
+                terms.setdefault((user, docno), []).append(term)
+    return ''.join(','.join([user, docno, 'ap'] + terms[user, docno]) + '\n'
+                   for user, docno in list(terms)[:60]).encode()
+
+
+@pytest.mark.parametrize('script, args', [
+    ('tt_pq_metrics.py', [PSEUDO_QUERIES, INDEX]),
+    ('pq_q_metrics.py', [PSEUDO_QUERIES, TOPICS, QRELS, STOPLIST, '--index', INDEX]),
+    ('tt_query_metrics.py', [TOPIC_TERMS, TOPICS, QRELS, INDEX, STOPLIST]),
+    ('pq-qpp-features.py', [PSEUDO_QUERIES, INDEX, STOPLIST]),
+])
+def test_output_does_not_depend_on_workers(user_topic_terms, script, args):
+    stdin = user_topic_terms if script == 'tt_pq_metrics.py' else None
+    one = run_script(script, *args, stdin=stdin)
+    assert one
+    assert run_script(script, *args, '--workers', '3', stdin=stdin, hash_seed='1') == one
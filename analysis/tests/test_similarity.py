@@ -0,0 +1,46 @@
+import math
+
+import numpy as np
+import pytest
+
+from retrieval.core import Document
+from retrieval.scoring import cosine_similarity, jaccard_similarity, kl_divergence, recall
+from retrieval.similarity import VectorSet, mean_pairwise
+
+
+def document_vectors(index, num_docs=8):
+    return [Document(index, doc_id=doc_id).document_vector() for doc_id in range(1, num_docs + 1)]
+
+
+@pytest.mark.parametrize('method, function', [
+    ('cosine', cosine_similarity),
+    ('kl_divergence', kl_divergence),
+    ('jaccard', lambda vector1, vector2: jaccard_similarity(set(vector1), set(vector2))),
+    ('recall', lambda vector1, vector2: recall(set(vector1), set(vector2))),
+])
+def test_vector_set_matches_scalar_functions(index, method, function):
+    vectors = document_vectors(index)
+    expected = [[function(vector1, vector2) for vector2 in vectors] for vector1 in vectors]
+    np.testing.assert_allclose(getattr(VectorSet(vectors), method)(), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_term_vectors_match_dictionaries(index):
+    docs = [Document(index, doc_id=doc_id) for doc_id in range(1, 9)]
+    np.testing.assert_allclose(VectorSet([doc.term_vector() for doc in docs]).cosine(),
+                               VectorSet([doc.document_vector() for doc in docs]).cosine(), rtol=1e-12)
+
+
+def test_mean_pairwise(index):
+    vectors = document_vectors(index, 4)
+    cosines = [cosine_similarity(vectors[i], vectors[j]) for i in range(4) for j in range(i + 1, 4)]
+    assert mean_pairwise(VectorSet(vectors).cosine()) == pytest.approx(sum(cosines) / len(cosines), rel=1e-12)
+
+
+@pytest.mark.parametrize('num_vectors', [0, 1])
+def test_mean_pairwise_without_pairs(index, num_vectors):
+    assert mean_pairwise(VectorSet(document_vectors(index, num_vectors)).cosine()) is None
+
+
+def test_mean_pairwise_of_two_vectors(index):
+    vectors = document_vectors(index, 2)
+    assert not math.isnan(mean_pairwise(VectorSet(vectors).cosine()))
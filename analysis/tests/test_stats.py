@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pytest
+
+from retrieval.core import IndexWrapper
+from retrieval.memindex import MemoryIndex
+import retrieval.stats
+from retrieval.stats import CollectionStatistics, index_fingerprint, index_identity
+
+
+class CaseFoldingIndex(MemoryIndex):
+    """
+    Stands in for Indri's text processing of term_count queries, which can match terms outside the dictionary.
+    """
+    def term_count(self, term):
+        return super().term_count(term.lower())
+
+
+def test_statistics_match_live_lookups(collection):
+    live = IndexWrapper(collection.index)
+    served = IndexWrapper(collection.index, collection_stats=True)
+    terms = ['term1', 'term2', 'term100', 'term2999', 'missing']
+    assert [served.term_count(term) for term in terms] == [live.term_count(term) for term in terms]
+    assert [served.term_document_frequency(term) for term in terms[:-1]] == \
+        [live.term_document_frequency(term) for term in terms[:-1]]
+    term_ids = np.array([live.term_id(term) for term in terms[:-1]])
+    np.testing.assert_array_equal(served.term_counts(term_ids), live.term_counts(term_ids))
+    assert (served.total_terms(), served.total_docs()) == (live.total_terms(), live.total_docs())
+
+
+def test_terms_outside_the_dictionary_use_the_index():
+    index = CaseFoldingIndex.from_vectors([('d1', {'apple': 2, 'pear': 1}), ('d2', {'apple': 3})])
+    served = IndexWrapper(index, collection_stats=True)
+    assert served.term_count('apple') == 5
+    assert served.term_count('Apple') == IndexWrapper(index).term_count('Apple') == 5
+
+
+def write_index(file_name, rows, modified):
+    with open(file_name, 'w') as f:
+        f.writelines('{},{},{}\n'.format(*row) for row in rows)
+    os.utime(file_name, ns=(modified, modified))
+    return MemoryIndex.from_csv(file_name)
+
+
+def test_rebuilt_index_with_the_same_totals_is_detected(tmp_path):
+    file_name = str(tmp_path / 'stats.npz')
+    index_file = str(tmp_path / 'index.csv')
+    before = write_index(index_file, [('d1', 'a', 2), ('d1', 'b', 1), ('d2', 'a', 3)], 10**18)
+    assert IndexWrapper(before, collection_stats=file_name, path=index_file).term_count('b') == 1
+    assert CollectionStatistics.load(file_name).fingerprint == index_fingerprint(before)
+
+    after = write_index(index_file, [('d1', 'a', 2), ('d1', 'b', 1), ('d2', 'b', 3)], 10**18 + 1)
+    assert (before.total_terms(), before.document_count()) == (after.total_terms(), after.document_count())
+    assert index_fingerprint(before) != index_fingerprint(after)
+    assert index_identity(before, path=index_file) != index_identity(before)
+    assert IndexWrapper(after, collection_stats=file_name, path=index_file).term_count('b') == 4
+    saved = CollectionStatistics.load(file_name)
+    assert saved.fingerprint == index_fingerprint(after)
+    assert saved.identity == index_identity(after, path=index_file)
+
+
+def test_loading_does_not_fingerprint_the_index(tmp_path, collection, monkeypatch):
+    file_name = str(tmp_path / 'stats.npz')
+    built = CollectionStatistics.for_index(collection.index, file_name)
+
+    def fingerprint(*args):
+        raise AssertionError('the dictionary was walked')
+    monkeypatch.setattr(retrieval.stats, 'index_fingerprint', fingerprint)
+    loaded = CollectionStatistics.for_index(collection.index, file_name)
+    assert loaded.fingerprint == built.fingerprint
+    np.testing.assert_array_equal(loaded.term_counts, built.term_counts)
+    with pytest.raises(AssertionError):
+        CollectionStatistics.for_index(MemoryIndex.from_vectors([('d1', {'a': 1})]), file_name)
+
+
+def test_files_without_an_identity_are_rebuilt(tmp_path, collection):
+    file_name = str(tmp_path / 'stats.npz')
+    stats = CollectionStatistics.build(collection.index)
+    stats.fingerprint = stats.identity = None
+    stats.save(file_name)
+    assert CollectionStatistics.load(file_name).identity is None
+    rebuilt = CollectionStatistics.for_index(collection.index, file_name)
+    assert (rebuilt.fingerprint, rebuilt.identity) == (index_fingerprint(collection.index),
+                                                      index_identity(collection.index))
@@ -0,0 +1,112 @@
+import concurrent.futures
+import importlib.util
+import io
+import sys
+
+import pytest
+
+from conftest import PSEUDO_QUERIES, STEM_TERMS, TOPIC_TERMS, TOPICS, run_script
+
+nltk_stem = pytest.importorskip('nltk.stem')
+
+
+@pytest.fixture(scope='module')
+def stem_terms():
+    spec = importlib.util.spec_from_file_location('stem_terms', STEM_TERMS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # So that its functions pickle by name for the pool's workers
+    sys.modules[spec.name] = module
+    yield module
+    del sys.modules[spec.name]
+
+
+@pytest.fixture(scope='module')
+def stemmer():
+    return nltk_stem.SnowballStemmer('english')
+
+
+def old_script_output(file_name, stemmer):
+    """
+    The output of the deleted stem_terms.py, stem_terms-pq.py and stem_terms-query.py, picked by the column count.
+    """
+    output = io.StringIO()
+    with open(file_name) as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) == 4:
+                user, doc, index, term = fields
+                print(','.join([user, doc, index, stemmer.stem(term)]), file=output)
+            elif len(fields) == 3:
+                doc, term, weight = fields
+                print(','.join([doc, stemmer.stem(term), weight]), file=output)
+            else:
+                query, term = fields
+                print(','.join([query, stemmer.stem(term)]), file=output)
+    return output.getvalue().encode()
+
+
+def read_cache(file_name):
+    with open(file_name) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('file_name', [PSEUDO_QUERIES, TOPICS, TOPIC_TERMS])
+def test_output_matches_the_old_scripts(tmp_path, stemmer, file_name):
+    expected = old_script_output(file_name, stemmer)
+    cache = str(tmp_path / 'cache.tsv')
+    assert run_script(STEM_TERMS, file_name, '--cache', cache) == expected
+    # Again from the cache, and on a pool
+    assert run_script(STEM_TERMS, file_name, '--cache', cache, '--workers', '2') == expected
+
+
+def test_suffix_writes_each_input_beside_it(tmp_path, stemmer):
+    inputs = []
+    for name, source in (('terms.pq', PSEUDO_QUERIES), ('topics.csv', TOPICS)):
+        inputs.append(str(tmp_path / name))
+        with open(source) as f, open(inputs[-1], 'w') as output:
+            output.writelines(f.readlines()[:200])
+    assert run_script(STEM_TERMS, *inputs, '--suffix=-stemmed', '--cache', str(tmp_path / 'cache.tsv')) == b''
+    for file_name, stemmed in zip(inputs, [str(tmp_path / 'terms-stemmed.pq'), str(tmp_path / 'topics-stemmed.csv')]):
+        with open(stemmed, 'rb') as f:
+            assert f.read() == old_script_output(file_name, stemmer)
+
+
+def test_stems_are_kept_across_runs(tmp_path, stem_terms, stemmer):
+    file_name = str(tmp_path / 'cache.tsv')
+    cache = stem_terms.StemCache(file_name)
+    output = io.StringIO()
+    stem_terms.stem_file(TOPICS, output, cache, 1, chunk_bytes=1000)
+    assert output.getvalue().encode() == old_script_output(TOPICS, stemmer)
+    cache.save()
+
+    reloaded = stem_terms.StemCache(file_name)
+    assert reloaded.stems == cache.stems
+    with concurrent.futures.ProcessPoolExecutor(2) as pool:
+        reloaded.add(['running', 'walked'] + list(cache.stems)[:5], pool=pool, workers=2)
+    reloaded.save()
+    lines = read_cache(file_name).splitlines()
+    assert len(lines) == len(set(lines)) == len(cache.stems) + len({'running', 'walked'} - set(cache.stems))
+    assert stem_terms.StemCache(file_name).stems['walked'] == stemmer.stem('walked')
+
+
+def test_truncated_cache_is_repaired(tmp_path, stem_terms, stemmer):
+    file_name = str(tmp_path / 'cache.tsv')
+    with open(file_name, 'w') as f:
+        f.write('cats\tcat\nbad line\ndogs\tdog\nrunni')
+    cache = stem_terms.StemCache(file_name)
+    assert cache.stems == {'cats': 'cat', 'dogs': 'dog'}
+    cache.add(['running', 'cats'])
+    cache.save()
+    assert read_cache(file_name) == 'cats\tcat\ndogs\tdog\nrunning\t{}\n'.format(stemmer.stem('running'))
+    assert stem_terms.StemCache(file_name).stems == cache.stems
+
+    # Once repaired, new stems are appended again
+    with open(file_name, 'a') as f:
+        f.write('partial')
+    cache = stem_terms.StemCache(file_name)
+    cache.save()
+    assert read_cache(file_name).endswith('running\t{}\n'.format(stemmer.stem('running')))
+    cache.add(['walked'])
+    cache.save()
+    assert read_cache(file_name).endswith('\nwalked\t{}\n'.format(stemmer.stem('walked')))
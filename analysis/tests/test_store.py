@@ -0,0 +1,70 @@
+import collections
+import pickle
+
+import numpy as np
+
+from retrieval.core import IndexWrapper
+from retrieval.memindex import MemoryIndex
+from retrieval.store import DocumentVectorStore
+
+from conftest import INDEX
+
+
+VECTORS = [('d1', collections.OrderedDict([('apple', 2), ('pear', 1)])),
+           ('d2', collections.OrderedDict()),
+           ('d3', collections.OrderedDict([('pear', 4), ('plum', 3), ('apple', 1)]))]
+
+
+def assert_same_store(store, expected):
+    assert store.docnos == expected.docnos and store.terms == expected.terms
+    for docno in expected.docnos:
+        term_ids, counts = store.row(docno)
+        expected_term_ids, expected_counts = expected.row(docno)
+        np.testing.assert_array_equal(term_ids, expected_term_ids)
+        np.testing.assert_array_equal(counts, expected_counts)
+        assert store.document_vector(docno) == expected.document_vector(docno)
+
+
+def test_rows_follow_the_vectors():
+    store = DocumentVectorStore.from_vectors(VECTORS)
+    assert len(store) == 3 and 'd2' in store and 'd4' not in store
+    for docno, vector in VECTORS:
+        term_ids, counts = store.row(docno)
+        assert [store.terms[term_id] for term_id in term_ids.tolist()] == list(vector)
+        assert counts.tolist() == list(vector.values())
+        assert store.document_vector(docno) == collections.Counter(vector)
+
+
+def test_save_and_open_map_the_arrays(tmp_path):
+    store = DocumentVectorStore.from_vectors(VECTORS)
+    store.save(str(tmp_path / 'store'))
+    assert store.path == str(tmp_path / 'store')
+    opened = DocumentVectorStore.open(str(tmp_path / 'store'))
+    assert_same_store(opened, store)
+    for array in (opened.offsets, opened.term_ids, opened.counts):
+        assert isinstance(array, np.memmap) and not array.flags.writeable
+    # Rows are views into the mapped files
+    assert isinstance(opened.row('d3')[0], np.memmap)
+
+
+def test_saved_stores_pickle_by_path(tmp_path):
+    store = DocumentVectorStore.from_vectors(VECTORS)
+    in_memory = pickle.loads(pickle.dumps(store))
+    assert in_memory.path is None
+    assert_same_store(in_memory, store)
+
+    store.save(str(tmp_path / 'store'))
+    data = pickle.dumps(DocumentVectorStore.open(str(tmp_path / 'store')))
+    assert len(data) < 200
+    mapped = pickle.loads(data)
+    assert mapped.path == str(tmp_path / 'store') and isinstance(mapped.term_ids, np.memmap)
+    assert_same_store(mapped, store)
+
+
+def test_csv_store_matches_index_vectors():
+    store = DocumentVectorStore.from_csv(INDEX)
+    index = IndexWrapper(MemoryIndex(store))
+    from_index = DocumentVectorStore.from_index(index, store.docnos[:50] + ['missing'])
+    assert from_index.docnos == store.docnos[:50]
+    for docno in from_index.docnos:
+        assert from_index.document_vector(docno) == store.document_vector(docno)
@@ -0,0 +1,87 @@
+import collections
+import gc
+import os
+import weakref
+
+import numpy as np
+import pytest
+
+from retrieval.core import Document, ExpandableDocument, IndexWrapper, Stopper
+from retrieval.vectors import TermVector
+
+from conftest import DATA_DIR, INDEX, STOPLIST, run_script
+
+
+def most_common(vector, num_terms):
+    """
+    The (term ID, count) pairs of Counter.most_common over the vector's terms, in order of first occurrence.
+    """
+    return collections.Counter(dict(zip(vector.term_ids.tolist(), vector.counts.tolist()))).most_common(num_terms)
+
+
+def pairs(vector):
+    return list(zip(vector.term_ids.tolist(), vector.counts.tolist()))
+
+
+@pytest.mark.parametrize('num_terms', [-1, 0, 1, 7, 30, 31, 100])
+def test_top_matches_most_common(num_terms):
+    # Many ties, so first occurrence decides much of the order
+    vector = TermVector(np.arange(100, 130) * 3, np.random.default_rng(3).integers(1, 5, size=30))
+    assert pairs(vector.top(num_terms)) == most_common(vector, num_terms)
+
+
+def test_top_matches_most_common_on_random_vectors():
+    rng = np.random.default_rng(11)
+    for _ in range(200):
+        length = int(rng.integers(0, 60))
+        vector = TermVector(rng.permutation(1000)[:length] + 1, rng.integers(1, int(rng.integers(2, 20)), size=length))
+        for num_terms in [0, 1, int(rng.integers(1, 70)), length]:
+            assert pairs(vector.top(num_terms)) == most_common(vector, num_terms)
+
+
+def test_top_of_empty_vector():
+    top = TermVector([], []).top(5)
+    assert len(top.term_ids) == 0 and top.length == 0
+
+
+def test_pseudo_query_matches_most_common(index):
+    stopper = Stopper(terms=['term{}'.format(i) for i in range(1, 30)])
+    for doc_id in range(1, 40):
+        doc = ExpandableDocument(Document(index, doc_id=doc_id).docno, index)
+        vector = stopper.stop(doc.term_vector().to_counter(index))
+        for num_terms in [1, 5, 20, 1000]:
+            assert dict(doc.pseudo_query(num_terms=num_terms, stopper=stopper).vector) == \
+                dict(vector.most_common(num_terms))
+
+
+def test_build_pseudo_queries_matches_most_common(tmp_path):
+    with open(os.path.join(DATA_DIR, 'annotations', 'docs.ap')) as f:
+        docnos = [line.strip() for line in f][:30]
+    with open(str(tmp_path / 'docs'), 'w') as f:
+        f.write(''.join(docno + '\n' for docno in docnos))
+    stopper = Stopper(file=STOPLIST)
+    vectors = collections.defaultdict(collections.Counter)
+    with open(INDEX) as f:
+        for line in f:
+            docno, term, count = line.strip().split(',')
+            vectors[docno][term] += int(count)
+    expected = ''.join(['{},{},{}\n'.format(docno, term, float(count)) for docno in docnos
+                        for term, count in stopper.stop(vectors[docno]).most_common(20)]).encode()
+
+    args = ['build_pseudo_queries.py', INDEX, str(tmp_path / 'docs'), '--stoplist', STOPLIST]
+    assert run_script(*args) == expected
+    assert run_script(*args, '--workers', '4') == expected
+
+
+def test_stoppers_do_not_keep_indexes_alive(collection):
+    stopper = Stopper(terms=['term1'])
+    index = IndexWrapper(collection.index, store=collection.store)
+    docno = Document(index, doc_id=1).docno
+    ExpandableDocument(docno, index).pseudo_query(num_terms=5)
+    ExpandableDocument(docno, index).pseudo_query(num_terms=5, stopper=stopper)
+    assert len(stopper._stopword_masks) == 1
+    reference = weakref.ref(index)
+    del index
+    gc.collect()
+    assert reference() is None
+    assert len(stopper._stopword_masks) == 0
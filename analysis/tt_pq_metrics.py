@@ -1,14 +1,19 @@
 import argparse
 import collections
+import functools
 import math
 import random
 import sys
 
-import pyndri
-
+from retrieval.cache import QueryResultCache
 from retrieval.core import Query, IndexWrapper, Qrels
-from retrieval.scoring import jaccard_similarity, cosine_similarity, average_precision, recall, build_vocab, \
+from retrieval.instrument import enable_profiling, instrument
+from retrieval.memindex import open_index
+from retrieval.output import ColumnWriter
+from retrieval.runner import ShardedRunner
+from retrieval.scoring import jaccard_similarity, cosine_similarity, average_precision, recall, pseudo_document, \
     DirichletTermScorer
+from retrieval.store import DocumentVectorStore
 
 
 def combine_vectors(*vectors):
@@ -18,6 +23,81 @@ def combine_vectors(*vectors):
     return vector
 
 
+class TTPQMetrics(object):
+    """
+    The index, scorer and pseudo-queries shared by every (user, docno) pair, loaded once per process.
+    """
+    def __init__(self, args):
+        if args.profile:
+            enable_profiling(args.profile)
+        self.args = args
+        if not args.skip_retrieval:
+            store = DocumentVectorStore.open(args.doc_store) if args.doc_store else None
+            self.index = IndexWrapper(instrument(open_index(args.index), 'index.backend'), store=store,
+                                      collection_stats=args.collection_stats,
+                                      query_cache=QueryResultCache(args.query_cache) if args.query_cache else None,
+                                      path=args.index)
+            self.index = instrument(self.index, 'index')
+            self.scorer = instrument(DirichletTermScorer(self.index), 'scorer')
+
+        pseudo_query_terms = collections.defaultdict(collections.Counter)
+        with open(args.pseudo_queries) as f:
+            for line in f:
+                docno, term, weight = line.strip().split(',')
+                pseudo_query_terms[docno][term] = float(weight)
+
+        self.pseudo_queries = {}
+        self.pseudo_query_rankings = {}
+        for docno in pseudo_query_terms:
+            self.pseudo_queries[docno] = Query(docno, vector=pseudo_query_terms[docno])
+            # Ties keep the order of the file
+            self.pseudo_query_rankings[docno] = sorted(pseudo_query_terms[docno].keys(), key=lambda k:
+                                                       pseudo_query_terms[docno][k], reverse=True)
+
+    def user_document_row(self, user, docno, tts):
+        args = self.args
+        pseudo_query = self.pseudo_queries[docno]
+        # as a test, let's do all the same comparisons against a random pseudo-query
+        # pseudo_query = pseudo_queries[random.choice(list(pseudo_queries.keys()))]
+
+        tt_qrels = Qrels.from_dict({docno: collections.Counter(tts)})
+
+        pseudo_ap = average_precision(docno, self.pseudo_query_rankings[docno], tt_qrels)
+        pseudo_term_recall = recall(set(pseudo_query.vector.keys()), set(tts))
+
+        if not args.skip_retrieval:
+            index = self.index
+            scorer = self.scorer
+            tt_vector = collections.Counter(tts)
+            tt_query = Query(docno, vector=tt_vector)
+
+            tt_results = index.query(tt_query, count=args.num_results)
+            pseudo_results = index.query(pseudo_query, count=args.num_results)
+
+            tt_result_docs = set([doc for doc, _ in tt_results])
+            tt_result_docnos = set([doc.docno for doc in tt_result_docs])
+            pseudo_result_docs = set([doc for doc, _ in pseudo_results])
+            pseudo_result_docnos = set([doc.docno for doc in pseudo_result_docs])
+
+            # tt_pseudo_doc = combine_vectors(*[r.document_vector() for r in tt_result_docs])
+            # pseudo_pseudo_doc = combine_vectors(*[r.document_vector() for r in pseudo_result_docs])
+
+            tt_pseudo_doc = pseudo_document(tt_results, scorer)
+            pseudo_pseudo_doc = pseudo_document(pseudo_results, scorer)
+
+            results_jaccard = jaccard_similarity(tt_result_docnos, pseudo_result_docnos)
+            pseudo_results_recall = recall(pseudo_result_docnos, tt_result_docnos)
+            cosine = cosine_similarity(tt_pseudo_doc, pseudo_pseudo_doc)
+
+            return user, docno, results_jaccard, pseudo_results_recall, cosine, pseudo_ap, pseudo_term_recall
+            # print(docno, results_jaccard, pseudo_results_recall, cosine, pseudo_ap, pseudo_term_recall, sep=',')
+        else:
+            return user, docno, pseudo_ap, pseudo_term_recall
+
+    def shard_rows(self, units):
+        return [self.user_document_row(user, docno, tts) for user, docno, tts in units]
+
+
 def main():
     options = argparse.ArgumentParser()
     # options.add_argument('topic_terms')
@@ -25,22 +105,15 @@ def main():
     options.add_argument('index')
     options.add_argument('-n', '--num-results', type=int, default=10)
     options.add_argument('--skip-retrieval', action='store_true')
+    options.add_argument('--doc-store')
+    options.add_argument('--collection-stats')
+    options.add_argument('--query-cache')
+    options.add_argument('--workers', type=int, default=1, help='processes to spread (user, docno) pairs over')
+    options.add_argument('--columns', help='also save each output column as a .npy file in this directory')
+    options.add_argument('--profile', nargs='?', const='-',
+                         help='time index and scorer calls and write a JSON report at exit, to this file or stderr')
     args = options.parse_args()
 
-    if not args.skip_retrieval:
-        index = IndexWrapper(pyndri.Index(args.index))
-        scorer = DirichletTermScorer(index)
-
-    pseudo_query_terms = collections.defaultdict(collections.Counter)
-    with open(args.pseudo_queries) as f:
-        for line in f:
-            docno, term, weight = line.strip().split(',')
-            pseudo_query_terms[docno][term] = float(weight)
-
-    pseudo_queries = {}
-    for docno in pseudo_query_terms:
-        pseudo_queries[docno] = Query(docno, vector=pseudo_query_terms[docno])
-
     # topic_terms[user][doc][term][weight]
     topic_terms = collections.defaultdict(lambda: collections.defaultdict(dict))
     # with open(args.topic_terms) as f:
@@ -50,56 +123,15 @@ def main():
         terms = parts[3:]
         topic_terms[user][docno] = terms
 
-    for user in topic_terms:
-        for docno in topic_terms[user]:
-            tts = topic_terms[user][docno]
-
-            pseudo_query = pseudo_queries[docno]
-            # as a test, let's do all the same comparisons against a random pseudo-query
-            # pseudo_query = pseudo_queries[random.choice(list(pseudo_queries.keys()))]
-
-            tt_qrels = Qrels()
-            tt_qrels._qrels[docno] = collections.Counter(tts)
-
-            pseudo_ap = average_precision(docno, sorted(pseudo_query.vector.keys(), key=lambda k:
-                                                        pseudo_query.vector[k], reverse=True), tt_qrels)
-            pseudo_term_recall = recall(set(pseudo_query.vector.keys()), set(tts))
-
-            if not args.skip_retrieval:
-                tt_vector = collections.Counter(tts)
-                tt_query = Query(docno, vector=tt_vector)
-
-                tt_results = index.query(tt_query, count=args.num_results)
-                pseudo_results = index.query(pseudo_query, count=args.num_results)
-
-                tt_result_docs = set([doc for doc, _ in tt_results])
-                tt_result_docnos = set([doc.docno for doc in tt_result_docs])
-                pseudo_result_docs = set([doc for doc, _ in pseudo_results])
-                pseudo_result_docnos = set([doc.docno for doc in pseudo_result_docs])
-
-                # tt_pseudo_doc = combine_vectors(*[r.document_vector() for r in tt_result_docs])
-                # pseudo_pseudo_doc = combine_vectors(*[r.document_vector() for r in pseudo_result_docs])
-
-                def normalize_results_scores(results):
-                    total = sum([score for _, score in results])
-                    return [(doc, score / total) for doc, score in results]
-
-                tt_vocab = build_vocab(*[r.document_vector() for r in tt_result_docs])
-                pseudo_vocab = build_vocab(*[r.document_vector() for r in pseudo_result_docs])
-
-                tt_pseudo_doc = {term: sum([exp_score * scorer.score(term, exp_doc) for exp_doc, exp_score in
-                                            normalize_results_scores(tt_results)]) for term in tt_vocab}
-                pseudo_pseudo_doc = {term: sum([exp_score * scorer.score(term, exp_doc) for exp_doc, exp_score in
-                                                normalize_results_scores(pseudo_results)]) for term in pseudo_vocab}
-
-                results_jaccard = jaccard_similarity(tt_result_docnos, pseudo_result_docnos)
-                pseudo_results_recall = recall(pseudo_result_docnos, tt_result_docnos)
-                cosine = cosine_similarity(tt_pseudo_doc, pseudo_pseudo_doc)
-
-                print(user, docno, results_jaccard, pseudo_results_recall, cosine, pseudo_ap, pseudo_term_recall, sep=',')
-                # print(docno, results_jaccard, pseudo_results_recall, cosine, pseudo_ap, pseudo_term_recall, sep=',')
-            else:
-                print(user, docno, pseudo_ap, pseudo_term_recall, sep=',')
+    units = [(user, docno, topic_terms[user][docno]) for user in topic_terms for docno in topic_terms[user]]
+    if args.skip_retrieval:
+        columns = ['user', 'docno', 'pseudo_ap', 'pseudo_term_recall']
+    else:
+        columns = ['user', 'docno', 'results_jaccard', 'pseudo_results_recall', 'cosine', 'pseudo_ap',
+                   'pseudo_term_recall']
+    runner = ShardedRunner(functools.partial(TTPQMetrics, args), TTPQMetrics.shard_rows, workers=args.workers)
+    with ColumnWriter(columns, column_dir=args.columns) as writer:
+        writer.write_rows(runner.run(units))
 
 
 if __name__ == '__main__':
@@ -1,12 +1,97 @@
 import argparse
 import collections
+import functools
 
-import pyndri
-
+from retrieval.cache import QueryResultCache
 from retrieval.core import IndexWrapper, read_queries, Qrels, Query, Stopper
+from retrieval.instrument import enable_profiling, instrument
+from retrieval.memindex import open_index
+from retrieval.output import ColumnWriter
+from retrieval.runner import ShardedRunner
 from retrieval.scoring import jaccard_similarity, recall
 
 
+class TTQueryMetrics(object):
+    """
+    The index, topic terms, queries and qrels shared by every query, loaded once per process.
+    """
+    def __init__(self, args):
+        if args.profile:
+            enable_profiling(args.profile)
+        self.args = args
+        self.index = IndexWrapper(instrument(open_index(args.index), 'index.backend'),
+                                  query_cache=QueryResultCache(args.query_cache) if args.query_cache else None,
+                                  path=args.index)
+        self.index = instrument(self.index, 'index')
+        self.stopper = Stopper(file=args.stoplist)
+
+        self.topic_terms = collections.defaultdict(lambda: collections.defaultdict(list))
+        with open(args.topic_terms) as f:
+            for line in f:
+                user, docno, _, term = line.strip().split(',')
+                self.topic_terms[docno][user].append(term)
+
+        self.queries = read_queries(args.queries, format=args.queries.split('.')[-1])
+        self.qrels = Qrels(file=args.qrels)
+
+    def shard_rows(self, query_indexes):
+        """
+        :param query_indexes: Positions of queries in the queries file.
+        :return: The output rows of each query, retrieving every query of the shard in one batch.
+        """
+        args = self.args
+        index = self.index
+        stopper = self.stopper
+        topic_terms = self.topic_terms
+        qrels = self.qrels
+        queries = [self.queries[i] for i in query_indexes]
+
+        # Sorted so that documents come out in the same order from run to run
+        all_judged_with_tt = [sorted(qrels.judged_docs(query.title) & set(topic_terms.keys())) for query in queries]
+
+        if not args.skip_retrieval:
+            # Run every retrieval up front so identical queries are only run once
+            retrieved = [i for i, judged_with_tt in enumerate(all_judged_with_tt) if judged_with_tt]
+            all_query_results = dict(zip(retrieved, index.query_batch([queries[i] for i in retrieved], count=10)))
+
+            tt_keys = sorted(set([(docno, user) for i in retrieved for docno in all_judged_with_tt[i]
+                                  for user in topic_terms[docno]]))
+            tt_queries = [Query(docno, vector=collections.Counter(topic_terms[docno][user]))
+                          for docno, user in tt_keys]
+            all_tt_results = dict(zip(tt_keys, index.query_batch(tt_queries, count=10)))
+
+        shard_rows = []
+        for i, query in enumerate(queries):
+            rows = []
+            judged_with_tt = all_judged_with_tt[i]
+
+            if judged_with_tt and not args.skip_retrieval:
+                query_results = all_query_results[i]
+                query_results_docs = [r[0].docno for r in query_results]
+
+            for docno in judged_with_tt:
+                for user in topic_terms[docno]:
+                    tt_set = set(topic_terms[docno][user]) - stopper.stopwords
+                    qt_set = set(query.vector.keys()) - stopper.stopwords
+
+                    tt_query_jaccard = jaccard_similarity(tt_set, qt_set)
+                    tt_query_recall = recall(tt_set, qt_set)
+                    results_jaccard = -1
+                    results_recall = -1
+
+                    if not args.skip_retrieval:
+                        tt_results = all_tt_results[(docno, user)]
+                        tt_results_docs = [r[0].docno for r in tt_results]
+
+                        results_jaccard = jaccard_similarity(set(tt_results_docs), set(query_results_docs))
+                        results_recall = recall(set(tt_results_docs), set(query_results_docs))
+
+                    rows.append([user, docno, query.title, qrels.relevance_of(docno, query.title), tt_query_jaccard,
+                                 tt_query_recall, results_jaccard, results_recall])
+            shard_rows.append(rows)
+        return shard_rows
+
+
 def main():
     options = argparse.ArgumentParser()
     options.add_argument('topic_terms')
@@ -15,48 +100,19 @@ def main():
     options.add_argument('index')
     options.add_argument('stoplist')
     options.add_argument('--skip-retrieval', action='store_true')
+    options.add_argument('--workers', type=int, default=1, help='processes to spread queries over')
+    options.add_argument('--query-cache')
+    options.add_argument('--columns', help='also save each output column as a .npy file in this directory')
+    options.add_argument('--profile', nargs='?', const='-',
+                         help='time index and scorer calls and write a JSON report at exit, to this file or stderr')
     args = options.parse_args()
 
-    index = IndexWrapper(pyndri.Index(args.index))
-    stopper = Stopper(file=args.stoplist)
-
-    topic_terms = collections.defaultdict(lambda: collections.defaultdict(list))
-    with open(args.topic_terms) as f:
-        for line in f:
-            user, docno, _, term = line.strip().split(',')
-            topic_terms[docno][user].append(term)
-
-    queries = read_queries(args.queries, format=args.queries.split('.')[-1])
-    qrels = Qrels(file=args.qrels)
-
-    for query in queries:
-        judged_docs = qrels.judged_docs(query.title)
-        judged_with_tt = judged_docs & set(topic_terms.keys())
-
-        if judged_with_tt and not args.skip_retrieval:
-            query_results = index.query(query, count=10)
-            query_results_docs = [r[0].docno for r in query_results]
-
-        for docno in judged_with_tt:
-            for user in topic_terms[docno]:
-                tt_set = set(topic_terms[docno][user]) - stopper.stopwords
-                qt_set = set(query.vector.keys()) - stopper.stopwords
-
-                tt_query_jaccard = jaccard_similarity(tt_set, qt_set)
-                tt_query_recall = recall(tt_set, qt_set)
-                results_jaccard = -1
-                results_recall = -1
-
-                if not args.skip_retrieval:
-                    tt_query = Query(docno, vector=collections.Counter(topic_terms[docno][user]))
-                    tt_results = index.query(tt_query, count=10)
-                    tt_results_docs = [r[0].docno for r in tt_results]
-
-                    results_jaccard = jaccard_similarity(set(tt_results_docs), set(query_results_docs))
-                    results_recall = recall(set(tt_results_docs), set(query_results_docs))
-
-                print(user, docno, query.title, qrels.relevance_of(docno, query.title), tt_query_jaccard,
-                      tt_query_recall, results_jaccard, results_recall, sep=',')
+    num_queries = len(read_queries(args.queries, format=args.queries.split('.')[-1]))
+    runner = ShardedRunner(functools.partial(TTQueryMetrics, args), TTQueryMetrics.shard_rows, workers=args.workers)
+    with ColumnWriter(['user', 'docno', 'query', 'relevance', 'tt_query_jaccard', 'tt_query_recall',
+                       'results_jaccard', 'results_recall'], column_dir=args.columns) as writer:
+        for rows in runner.run(range(num_queries)):
+            writer.write_rows(rows)
 
 
 if __name__ == '__main__':
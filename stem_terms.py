@@ -1,10 +1,145 @@
+import argparse
+import concurrent.futures
+import os
 import sys
 
 from nltk.stem import SnowballStemmer
 
 
+# The column holding the term in each kind of CSV file
+SCHEMAS = {
+    'topic-terms': 3,     # user,docno,collection,term
+    'pseudo-queries': 1,  # docno,term,weight
+    'queries': 1,         # query,term
+    'doc-vectors': 1,     # docno,term,count
+}
+
 stemmer = SnowballStemmer('english')
-with open(sys.argv[1]) as f:
-  for line in f:
-    user, doc, index, term = line.strip().split(',')
-    print(','.join([user, doc, index, stemmer.stem(term)]))
+
+
+class StemCache(object):
+    """
+    English Snowball stems of every term seen so far, kept in a term<TAB>stem file that grows across runs.
+
+    A line without a newline or without exactly one tab, as left by a run that was killed while writing, is skipped,
+    and the file is rewritten without it on the next save.
+    """
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.stems = {}
+        self._new = {}
+        self._rewrite = False
+        if file_name and os.path.exists(file_name):
+            with open(file_name) as f:
+                for line in f:
+                    fields = line.split('\t')
+                    if len(fields) != 2 or not line.endswith('\n'):
+                        self._rewrite = True
+                        continue
+                    self.stems[fields[0]] = fields[1][:-1]
+
+    def add(self, terms, pool=None, workers=1):
+        """
+        Stem the terms not already in the cache, on the pool if one is given.
+
+        :param workers: The number of processes in the pool, which sets how finely the terms are split up.
+        """
+        terms = [term for term in dict.fromkeys(terms) if term not in self.stems]
+        if not terms:
+            return
+        if pool is None:
+            stems = stem_all(terms)
+        else:
+            chunk_size = max(1, len(terms) // (workers * 4))
+            chunks = [terms[i:i+chunk_size] for i in range(0, len(terms), chunk_size)]
+            stems = [stem for chunk_stems in pool.map(stem_all, chunks) for stem in chunk_stems]
+        for term, stem in zip(terms, stems):
+            self.stems[term] = stem
+            self._new[term] = stem
+
+    def save(self):
+        if not self.file_name or not (self._new or self._rewrite):
+            return
+        if self._rewrite:
+            # Write the whole cache to a new file and swap it in, so an interrupted save loses nothing
+            with open(self.file_name + '.tmp', 'w') as f:
+                for term, stem in self.stems.items():
+                    f.write('{}\t{}\n'.format(term, stem))
+            os.replace(self.file_name + '.tmp', self.file_name)
+            self._rewrite = False
+        else:
+            with open(self.file_name, 'a') as f:
+                for term, stem in self._new.items():
+                    f.write('{}\t{}\n'.format(term, stem))
+        self._new = {}
+
+
+def stem_all(terms):
+    return [stemmer.stem(term) for term in terms]
+
+
+def detect_term_column(file_name):
+    """
+    :return: The term column of a file: 3 for four-column topic term files, 1 for everything else.
+    """
+    with open(file_name) as f:
+        first_line = f.readline()
+    return 3 if len(first_line.strip().split(',')) == 4 else 1
+
+
+def stem_file(file_name, output, cache, term_column, pool=None, workers=1, chunk_bytes=2**24):
+    """
+    Write file_name to output with the term column stemmed, reading a chunk of lines at a time. Terms new to the
+    cache are stemmed on the pool of workers processes, if one is given.
+    """
+    with open(file_name) as f:
+        lines = f.readlines(chunk_bytes)
+        while lines:
+            rows = [line.strip().split(',') for line in lines]
+            cache.add([row[term_column] for row in rows], pool=pool, workers=workers)
+            stems = cache.stems
+            for row in rows:
+                row[term_column] = stems[row[term_column]]
+            output.write(''.join([','.join(row) + '\n' for row in rows]))
+            lines = f.readlines(chunk_bytes)
+
+
+def stemmed_name(file_name, suffix):
+    """
+    :return: The file name with the suffix before its extension, as in doc_vectors.csv -> doc_vectors-stemmed.csv.
+    """
+    root, extension = os.path.splitext(file_name)
+    return root + suffix + extension
+
+
+def main():
+    options = argparse.ArgumentParser(description='Stem the term column of topic term, pseudo-query, query or '
+                                                  'document vector CSV files with the English Snowball stemmer.')
+    options.add_argument('inputs', nargs='+')
+    options.add_argument('--schema', choices=sorted(SCHEMAS),
+                         help='the kind of every input; by default four-column files are taken to be topic terms '
+                              'and any other file to have its term in the second column')
+    options.add_argument('--suffix', help='write each input to its own file with this suffix before the extension, '
+                                          'as in --suffix=-stemmed, rather than to stdout')
+    options.add_argument('--cache', default='.stem-cache.tsv', help='file of stems kept across runs')
+    options.add_argument('--workers', type=int, default=1, help='processes to stem new terms on')
+    args = options.parse_args()
+
+    cache = StemCache(args.cache)
+    pool = concurrent.futures.ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+    try:
+        for file_name in args.inputs:
+            term_column = SCHEMAS[args.schema] if args.schema else detect_term_column(file_name)
+            if args.suffix:
+                with open(stemmed_name(file_name, args.suffix), 'w') as output:
+                    stem_file(file_name, output, cache, term_column, pool=pool, workers=args.workers)
+            else:
+                stem_file(file_name, sys.stdout, cache, term_column, pool=pool, workers=args.workers)
+            cache.save()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()